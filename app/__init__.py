@@ -33,7 +33,11 @@ load_dotenv("vars.dev.env")
 # Disable specific pipeline component to speedup similarity inference 
 # https://spacy.io/usage/processing-pipelines#pipelines
 if SPACY_AVAILABLE:
-	nlp = spacy.load("en_core_web_md", exclude=["ner", "parser"])
+	try:
+		nlp = spacy.load("en_core_web_md", exclude=["ner", "parser"])
+	except OSError:
+		nlp = None
+		logger.warning("spaCy model en_core_web_md is not installed. NLP features are disabled.")
 else:
     # Assign a dummy value for nlp to avoid hard errors in he webserver.
 	# as well as allowing tests to import nlp object.
@@ -2,12 +2,15 @@
 
 
 import json
+import random
 
+import click
 from flask import Flask
 from flask.cli import AppGroup
 
 from app import generate_description, setup_gcs_models
-from app.tools import nltk_pos_tag_download, get_model_stats
+from app.utils import gcs
+from app.tools import nltk_pos_tag_download, get_model_stats, export_word_vectors, export_descriptions
 
 
 app = Flask(__name__)
@@ -24,11 +27,33 @@ def create_pos_map():
 def show_model_stats():
     get_model_stats.show_current_model_stats()
 
+@task_cli.command("export-vectors", help="Export word vectors and the genre table for semantic context matching of the current description model. Requires spaCy.")
+def export_vectors():
+    manifest = gcs.get_manifest()
+    export_word_vectors.export_model_vectors("description", manifest)
+    gcs.publish_manifest(manifest)
+
 @task_cli.command("demo", help="Generate a sample game description in JSON format.")
 def show_demo():
     generator = generate_description.DescriptionGenerator(app.config)
     print(json.dumps(generator(), indent=4))
 
+@task_cli.command("export", help="Generate descriptions in parallel to a JSON lines file (.jsonl or .jsonl.gz).")
+@click.option("--count", type=int, required=True, help="Number of descriptions to generate.")
+@click.option("--workers", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+@click.option("--out", type=click.Path(dir_okay=False), required=True, help="Output file.")
+@click.option("--seed", type=int, default=None, help="Seed of the first description. Defaults to a random seed.")
+def export(count, workers, out, seed):
+    if seed is None:
+        seed = random.randrange(2**32)
+
+    generator = generate_description.DescriptionGenerator(app.config)
+    # Load all models before forking to share them between the workers
+    generator.load_all()
+    seconds = export_descriptions.export_descriptions(generator, count, out, workers, seed)
+    print(f"Exported {count} descriptions with seeds {seed}-{seed + count - 1} to {out} "
+          f"in {seconds:.1f}s ({count / seconds:.1f} descriptions/s)")
+
 @task_cli.command("train", help="Train new models and store to remote bucket.")
 def setup_gcs_models_():
     setup_gcs_models.setup()
@@ -20,8 +20,9 @@ def upload_image():
     """Generate a screenshot and upload to Cloud Storage.
     
     Use randomized tags as prompt attributes and as remote
-    storage prefix.
+    storage prefix. Both images are uploaded concurrently once generated.
     """
+    start = time.perf_counter()
     tags = common.select_tags()
 
     ## Screenshot generation
@@ -36,14 +37,9 @@ def upload_image():
         **{f"tag{i+1}": tag for i, tag in enumerate(tags.context + tags.extra)}
     }
 
+    images = []
     prefix = f"{tags.genre}/{tags.context[0]}/{int(time.time())}.png"
-    gcs.upload_to_gcs(
-        _create_image(prompt, metadata),
-        gcs.IMG_BUCKET,
-        prefix,
-        content_type="image/png"
-    )
-    logger.info("Image uploaded to gs://%s/%s", gcs.IMG_BUCKET, prefix)
+    images.append((prefix, _create_image(prompt, metadata)))
 
 
     ## Art generation
@@ -69,13 +65,14 @@ def upload_image():
     print(prompt)
 
     prefix = f"{tags.genre}/{tags.context[0]}/art/{int(time.time())}.png"
-    gcs.upload_to_gcs(
-        _create_image(prompt),
-        gcs.IMG_BUCKET,
-        prefix,
-        content_type="image/png"
-    )
-    logger.info("Image uploaded to gs://%s/%s", gcs.IMG_BUCKET, prefix)
+    images.append((prefix, _create_image(prompt)))
+
+    results = gcs.upload_many(gcs.IMG_BUCKET, images, content_type="image/png")
+    for (prefix, _), result in zip(images, results):
+        if isinstance(result, Exception):
+            raise result
+        logger.info("Image uploaded to gs://%s/%s", gcs.IMG_BUCKET, prefix)
+    logger.info("Image job finished in %.1fs", time.perf_counter() - start)
 
 def _create_image(prompt, metadata={}):
     """Generate an image using OpenAI DALL-E model.
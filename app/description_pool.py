@@ -0,0 +1,121 @@
+# A pool of pre-generated game descriptions kept filled by a background thread.
+
+import collections
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger("app")
+
+# Seconds between logging pool statistics
+STATS_INTERVAL = 300
+# Seconds to wait after a failed generation
+ERROR_BACKOFF = 1
+
+
+class DescriptionPool:
+    """Serves ready-made descriptions from an in-process pool.
+
+    A daemon thread keeps the pool filled up to a high-water mark by calling a
+    generator function. Taking a description from the pool is O(1); when the pool
+    is empty, a description is generated inline.
+    """
+
+    def __init__(self, generate, size):
+        """Create the pool and start filling it.
+
+        Args:
+            generate (callable): function returning a new description
+            size (int): high-water mark of the pool
+        """
+        self._generate = generate
+        self.size = size
+        self._pool = collections.deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self._generate_seconds = 0.0
+        self._last_logged = time.monotonic()
+
+        self._closed = False
+        self._thread = threading.Thread(target=self._fill, name="description-pool", daemon=True)
+        self._thread.start()
+
+    def get(self):
+        """Take a description from the pool or generate one if the pool is empty.
+        Return:
+            a description
+        """
+        with self._lock:
+            if self._pool:
+                self.hits += 1
+                self._not_full.notify()
+                return self._pool.popleft()
+            self.misses += 1
+
+        return self._generate()
+
+    def close(self):
+        """Stop filling the pool and drop the pre-generated descriptions."""
+        with self._lock:
+            self._closed = True
+            self._pool.clear()
+            self._not_full.notify()
+
+    def stats(self):
+        """Get pool statistics.
+        Return:
+            a dict of the current depth, the high-water mark, hit and miss counts,
+            the hit ratio and the refill rate in descriptions per second of generation time
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "depth": len(self._pool),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else None,
+                "generated": self.generated,
+                "refill_rate": self.generated / self._generate_seconds if self._generate_seconds else None
+            }
+
+    def _fill(self):
+        """Keep the pool filled to its high-water mark."""
+        while True:
+            with self._lock:
+                full = len(self._pool) >= self.size
+                if full:
+                    self._not_full.wait(timeout=STATS_INTERVAL)
+                if self._closed:
+                    return
+
+            self._log_stats()
+            if full:
+                continue
+
+            start = time.perf_counter()
+            try:
+                description = self._generate()
+            except Exception:
+                logger.exception("Failed to pre-generate a description")
+                time.sleep(ERROR_BACKOFF)
+                continue
+
+            with self._lock:
+                if self._closed:
+                    return
+                self._pool.append(description)
+                self.generated += 1
+                self._generate_seconds += time.perf_counter() - start
+
+    def _log_stats(self):
+        """Log pool statistics every STATS_INTERVAL seconds."""
+        now = time.monotonic()
+        if now - self._last_logged >= STATS_INTERVAL:
+            self._last_logged = now
+            logger.info("Description pool: %s", self.stats())
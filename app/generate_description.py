@@ -1,19 +1,49 @@
 # Generate a randomized game description with a title and a list of features.
 
 import dataclasses
+import hashlib
+import json
 import logging
 import random
 import re
 import string
-from types import SimpleNamespace
+import threading
 
 from app import model_specs
-from app.generator import generator
+from app.generator import generator, model_bundle
 from app.utils import gcs, common, data_files
 
 
 logger = logging.getLogger("app")
 screenshot_pool = None
+screenshot_pool_lock = threading.Lock()
+
+# Models of the description components by generator attribute name.
+# Other trained models, like ratings, are not used for descriptions.
+DESCRIPTION_MODELS = {
+	"description": "description",
+	"names": "names",
+	"feature": "feature",
+	"tagline": "tagline"
+}
+SYSTEM_REQUIREMENT_MODELS = {
+	"os": "requirements_OS",
+	"processor": "requirements_Processor",
+	"memory": "requirements_Memory",
+	"graphics": "requirements_Graphics",
+	"storage": "requirements_Storage",
+	"sound_card": "requirements_Sound_Card",
+	"additional_notes": "requirements_Additional_Notes"
+}
+# Models used by every description, loaded on startup
+STARTUP_MODELS = [
+	"description",
+	"requirements_OS",
+	"requirements_Processor",
+	"requirements_Memory",
+	"requirements_Graphics",
+	"requirements_Storage"
+]
 
 class DescriptionGenerator():
 	"""Generates formatted game description consisting of multiple items:
@@ -23,92 +53,103 @@ class DescriptionGenerator():
 	 * >= 0 bullet point list of features
 	 * randomly selected tags
 	 * developer name
+
+	Generation keeps no state between calls, so a DescriptionGenerator can be shared between threads.
 	"""
 
 	def __init__(self, context_config):
 		"""Create generators for each description component.
-		Model content is expected to be available in Cloud Storage.
+		Model content is expected to be available in Cloud Storage. Models are downloaded
+		to a local directory and memory mapped by the generators.
+
+		Only the models needed by every description are loaded here; the rest are
+		loaded on first use, or by load_all().
 
 		Args:
 			context_config (dict): additional context to provide to the generator
 		"""
-		model_data = gcs._download_all_model_files()
-
-		# Helper function to create a Generator instance with its identity
-		def create_generator(key):
-			return generator.Generator(model_data[key + ".pkl"], name=key)
-
-		self.generators = SimpleNamespace(
-			description=create_generator("description"),
-			names=create_generator("names"),
-			feature=create_generator("feature"),
-			tagline=create_generator("tagline"),
-
-			system_requirements=SimpleNamespace(
-				os=create_generator("requirements_OS"),
-				processor=create_generator("requirements_Processor"),
-				memory=create_generator("requirements_Memory"),
-				graphics=create_generator("requirements_Graphics"),
-				storage=create_generator("requirements_Storage"),
-				sound_card=create_generator("requirements_Sound_Card"),
-				additional_notes=create_generator("requirements_Additional_Notes")
-			)
+		manifest = gcs.get_model_manifest(legacy_filenames=[
+			name + ".pkl" for name in [*DESCRIPTION_MODELS.values(), *SYSTEM_REQUIREMENT_MODELS.values()]
+		])
+		self.ENABLE_SEMANTIC_CONTEXT = context_config.get("ENABLE_SEMANTIC_CONTEXT", False)
+		self.version = _output_version(manifest, self.ENABLE_SEMANTIC_CONTEXT)
+
+		self.models = ModelRegistry(manifest, semantic_context=self.ENABLE_SEMANTIC_CONTEXT)
+		self.models.load(STARTUP_MODELS)
+
+		self.generators = _LazyGenerators(
+			self.models,
+			DESCRIPTION_MODELS,
+			system_requirements=_LazyGenerators(self.models, SYSTEM_REQUIREMENT_MODELS)
 		)
 
-		self.ENABLE_SEMANTIC_CONTEXT = context_config.get("ENABLE_SEMANTIC_CONTEXT", False)
-		if self.ENABLE_SEMANTIC_CONTEXT:
-			logger.info("Semantic context enabled for description generation.")
+	def load_all(self):
+		"""Load all models not loaded yet."""
+		self.models.load([*DESCRIPTION_MODELS.values(), *SYSTEM_REQUIREMENT_MODELS.values()])
+
+	def __call__(self, seed=None):
+		"""Generate a description with random number of paragraphs and content types.
+
+		Args:
+			seed (int): optional random seed. The same seed always results in the same
+				description for the same version of the models. Screenshots are not
+				included: they are selected from the current screenshot pool.
+		Return:
+			the description as a dict
+		"""
+		rng = random.Random(seed) if seed is not None else random
 
-	def __call__(self):
-		"""Generate a description with random number of paragraphs and content types."""
 		# Randomize a new content config for each run
-		config = create_description_config()
+		config = create_description_config(rng)
 		logger.debug(config)
 
 		seeds = data_files.SEEDS
-		tags = common.select_tags()
+		tags = common.select_tags(rng)
 
 		description = []
 
+		# Use the genre as context for the description if enabled
+		context = self._context(tags.genre)
+
 		# Generate n paragraphs as main content
 		paragraphs = []
 		for _ in range(config.num_paragraphs):
-			size = int(abs(random.gauss(15, 3)))
-			seed = random.choice(seeds["text"])
-
-			# Use the genre as context for the description if enabled
-			context = tags.genre if self.ENABLE_SEMANTIC_CONTEXT else None
+			size = int(abs(rng.gauss(15, 3)))
+			text_seed = rng.choice(seeds["text"])
 			paragraphs.append(
 				self.generators.description.generate(
-					seed=seed,
+					seed=text_seed,
 					size=size,
 					complete_sentence=True,
-					context=context
+					context=context,
+					state=self.generators.description.new_state(rng)
 				)
 			)
 
 		description.append({
-			"title": self.generate_title(enable_extended_vocabulary=config.extended_title),
+			"title": self.generate_title(enable_extended_vocabulary=config.extended_title, rng=rng),
 			"content": "\n\n".join(paragraphs)
 		})
 
 		# Repeat for sub sections if included in the config;
 		# 1 paragraph per section
 		for _ in range(config.num_subsections):
-			seed = random.choice(seeds["headers"])
+			header_seed = rng.choice(seeds["headers"])
+			state = self.generators.description.new_state(rng)
 			header = self.generators.description.generate(
-				seed=seed, size=3, continue_until_valid=True
+				seed=header_seed, size=3, continue_until_valid=True, state=state
 			)
 			header = string.capwords(header.rstrip("."))
 			
-			self.generators.description.ff_to_next_sentence()
-			size = int(abs(random.gauss(15, 3)))
-			context = header if self.ENABLE_SEMANTIC_CONTEXT else None
+			self.generators.description.ff_to_next_sentence(state)
+			size = int(abs(rng.gauss(15, 3)))
+			context = self._context(header)
 
 			paragraph = self.generators.description.generate(
 				size=size,
 				complete_sentence=True,
-				context=context
+				context=context,
+				state=state
 			)
 
 			description.append({
@@ -120,47 +161,56 @@ class DescriptionGenerator():
 		features = []
 		for _ in range(config.num_features):
 			# set a shorthish upper bound
-			size = min(int(abs(random.gauss(12, 4))), 22)
+			size = min(int(abs(rng.gauss(12, 4))), 22)
 			features.append(
-				self.generators.feature.generate(size=size, complete_sentence=True)
+				self.generators.feature.generate(
+					size=size, complete_sentence=True, state=self.generators.feature.new_state(rng)
+				)
 			)
 
 		# Tagline
 		tagline = ""
 		if config.tagline:
-			tagline = self.generators.tagline.generate(size=4, complete_sentence=True)
+			tagline = self.generators.tagline.generate(
+				size=4, complete_sentence=True, state=self.generators.tagline.new_state(rng)
+			)
 
 		# System requirements;
 		# use a list to guarentee ordering
 		system_requirements = [
 			{
 				"name": "OS",
-				"value": self.generators.system_requirements.os.generate(
-					size=abs(random.gauss(4, 2))
+				"value": self._requirement(
+					self.generators.system_requirements.os, rng,
+					size=abs(rng.gauss(4, 2))
 				)
 			},
 			{
 				"name": "Processor",
-				"value": self.generators.system_requirements.processor.generate(
-					size=abs(random.gauss(9, 4))
+				"value": self._requirement(
+					self.generators.system_requirements.processor, rng,
+					size=abs(rng.gauss(9, 4))
 				)
 			},
 			{
 				"name": "Memory",
-				"value": self.generators.system_requirements.memory.generate(
-					size=min(abs(random.gauss(5, 4)), 10)
+				"value": self._requirement(
+					self.generators.system_requirements.memory, rng,
+					size=min(abs(rng.gauss(5, 4)), 10)
 				)
 			},
 			{
 				"name": "Graphics",
-				"value": self.generators.system_requirements.graphics.generate(
-					size=min(abs(random.gauss(9, 4)), 20)
+				"value": self._requirement(
+					self.generators.system_requirements.graphics, rng,
+					size=min(abs(rng.gauss(9, 4)), 20)
 				)
 			},
 			{
 				"name": "Storage",
-				"value": self.generators.system_requirements.storage.generate(
-					size=abs(random.gauss(4, 2))
+				"value": self._requirement(
+					self.generators.system_requirements.storage, rng,
+					size=abs(rng.gauss(4, 2))
 				)
 			}
 		]
@@ -170,8 +220,9 @@ class DescriptionGenerator():
 			system_requirements.append(
 				{
 					"name": "Sound Card",
-					"value": self.generators.system_requirements.sound_card.generate(
-						size=abs(random.gauss(4, 2))
+					"value": self._requirement(
+						self.generators.system_requirements.sound_card, rng,
+						size=abs(rng.gauss(4, 2))
 					)
 				}
 			)
@@ -180,28 +231,25 @@ class DescriptionGenerator():
 			system_requirements.append(
 				{
 					"name": "Additional Notes",
-					"value": self.generators.system_requirements.additional_notes.generate(
-						size=abs(random.gauss(9, 4)),
+					"value": self._requirement(
+						self.generators.system_requirements.additional_notes, rng,
+						size=abs(rng.gauss(9, 4)),
 						continue_until_valid=True
 					)
 				}
 			)
 
 
-		# Screenshot
-		global screenshot_pool
-		# Lazy load the screenshot pool on first use
-		if screenshot_pool is None:
-			screenshot_pool = gcs.list_image_bucket()
-
-		screenshots = select_screenshots(screenshot_pool, tags)
+		# Screenshot; selected with a generator of its own, since the number of draws
+		# depends on the screenshot pool, which grows independently of the models
+		screenshots = select_screenshots(get_screenshot_pool(), tags, random.Random(rng.random()))
 
 		description_model = model_specs.GameDescription(
 			description=description,
 			features=features,
 			tagline=tagline,
 			tags=tags,
-			developer=generate_developer(),
+			developer=generate_developer(rng),
 			system_requirements=system_requirements,
 			screenshots=[s.public_url for s in screenshots]
 		)
@@ -209,7 +257,23 @@ class DescriptionGenerator():
 		# return a json serializable dict
 		return dataclasses.asdict(description_model)
 
-	def generate_title(self, enable_extended_vocabulary=False):
+	def _context(self, text):
+		"""Semantic context for the description generator, if enabled.
+		The context is resolved once, see Generator.semantic_context.
+		Args:
+			text (str): the context text
+		Return:
+			a context for Generator.generate(), or None
+		"""
+		if not self.ENABLE_SEMANTIC_CONTEXT:
+			return None
+		return self.generators.description.semantic_context(text)
+
+	def _requirement(self, requirement_generator, rng, **kwargs):
+		"""Generate a system requirement value with a new walk using rng."""
+		return requirement_generator.generate(state=requirement_generator.new_state(rng), **kwargs)
+
+	def generate_title(self, enable_extended_vocabulary=False, rng=random):
 		"""Generate a title.
 
 		A title is a rendered template using either POS tagged words
@@ -218,16 +282,19 @@ class DescriptionGenerator():
 		Args:
 			enable_extended_vocabulary (boolean): whether to include generated
 				words to the title
+			rng (random.Random): random number generator, defaults to the random module
 		Return:
 			the title
 		"""
-		template = random.choice(data_files.TITLE_TEMPLATES).rstrip()
+		template = rng.choice(data_files.TITLE_TEMPLATES).rstrip()
 
 		if enable_extended_vocabulary:
-			size = max(5, int(abs(random.gauss(6, 2.5))))
+			size = max(5, int(abs(rng.gauss(6, 2.5))))
 			# generate a word until we get one with alphabethic only characters
 			for _ in range(10):
-				word = self.generators.names.generate(size=size).replace(" ", "")
+				word = self.generators.names.generate(
+					size=size, state=self.generators.names.new_state(rng)
+				).replace(" ", "")
 				if re.match(r"^[a-zA-Z]*$", word):
 					break
 
@@ -235,9 +302,149 @@ class DescriptionGenerator():
 			m = re.search(r"{{[A-Z]+}}", template)
 			template = template.replace(m.group(), word)
 
-		return _render_template(template).strip("- ").title()
+		return _render_template(template, rng).strip("- ").title()
 
-def create_description_config():
+class ModelRegistry():
+	"""Loads the Generators of a model version on first use.
+
+	Model files are downloaded as listed in the manifest the registry was created with,
+	so models loaded later are of the same version as the ones loaded on startup.
+	If the manifest lists a compressed model bundle, the bundle is downloaded instead
+	and models are carved out of it; see _has_bundle. Each model is loaded once: concurrent first uses of a model
+	wait for a single load.
+	"""
+
+	def __init__(self, manifest, semantic_context=False):
+		"""Create an empty registry.
+		Args:
+			manifest (dict): manifest of the model version, see gcs.get_model_manifest
+			semantic_context (bool): whether to load word vectors and the genre table
+				for the description model
+		"""
+		self.manifest = manifest
+		self.semantic_context = semantic_context
+		self._generators = {}
+		self._bundle = None
+		self._bundle_lock = threading.Lock()
+		self._locks = {
+			name: threading.Lock()
+			for name in [*DESCRIPTION_MODELS.values(), *SYSTEM_REQUIREMENT_MODELS.values()]
+		}
+
+	def get(self, name):
+		"""Get the Generator of a model, loading it on first use.
+		Args:
+			name (str): name of the model
+		Return:
+			the Generator
+		"""
+		model = self._generators.get(name)
+		if model is None:
+			with self._locks[name]:
+				model = self._generators.get(name)
+				if model is None:
+					model = self._load(name)
+					self._generators[name] = model
+		return model
+
+	def load(self, names):
+		"""Load models not loaded yet. Model files are downloaded in a single batch.
+		Args:
+			names (list): names of the models
+		"""
+		missing = [name for name in names if name not in self._generators]
+		if missing and self._has_bundle():
+			self._get_bundle()
+		elif missing:
+			gcs.download_model_files(self.manifest, [name + ".pkl" for name in missing])
+		for name in missing:
+			self.get(name)
+
+	def _load(self, name):
+		"""Download the files of a model and create its Generator."""
+		model = generator.Generator(self._model_data(name + ".pkl"), name=name)
+
+		if name == "description" and self.semantic_context:
+			# Use the word vectors and genre table exported for this version of the model, if any
+			filenames = [model.vectors_filename, model.genre_table_filename]
+			model_files = gcs.download_model_files(
+				self.manifest, [filename for filename in filenames if filename in self.manifest["files"]]
+			)
+			if model.vectors_filename in model_files:
+				model.load_vectors(model_files[model.vectors_filename])
+			if model.genre_table_filename in model_files:
+				model.load_genre_table(model_files[model.genre_table_filename])
+			logger.info("Semantic context enabled for description generation.")
+
+		logger.info("Loaded model %s", name)
+		return model
+
+	def _model_data(self, filename):
+		"""Get a model carved out of the bundle, or the path to the downloaded model file."""
+		if self._has_bundle():
+			bundle = self._get_bundle()
+			if filename in bundle:
+				return bundle.get(filename)
+		return gcs.download_model_files(self.manifest, [filename])[filename]
+
+	def _has_bundle(self):
+		"""Whether to load models from the bundle rather than the model files.
+
+		Only a compressed bundle is faster to download than the model files: an uncompressed
+		one streams the large description model over a single connection. The bundle also
+		holds every description model, so it is fetched as a whole on startup.
+		"""
+		entry = self.manifest["files"].get(model_bundle.FILENAME)
+		return entry is not None and entry.get("compression") == "zstd" and model_bundle.zstandard is not None
+
+	def _get_bundle(self):
+		"""Download and memory map the model bundle on first use."""
+		if self._bundle is None:
+			with self._bundle_lock:
+				if self._bundle is None:
+					model_files = gcs.download_model_files(self.manifest, [model_bundle.FILENAME])
+					self._bundle = model_bundle.ModelBundle.open(model_files[model_bundle.FILENAME])
+		return self._bundle
+
+class _LazyGenerators():
+	"""Namespace of Generators from a ModelRegistry, loaded on attribute access."""
+
+	def __init__(self, registry, models, **namespaces):
+		self._registry = registry
+		self._models = models
+		self.__dict__.update(namespaces)
+
+	def __getattr__(self, attr):
+		try:
+			name = self._models[attr]
+		except KeyError:
+			raise AttributeError(attr) from None
+		return self._registry.get(name)
+
+def _output_version(manifest, semantic_context):
+	"""Identify the output of a DescriptionGenerator for a seed: the model version and
+	a hash of the files listed in the manifest and the semantic context flag. Exporting
+	word vectors republishes a model version with new files, which changes the output
+	when semantic context is enabled.
+	Args:
+		manifest (dict): manifest of the models
+		semantic_context (bool): whether semantic context is enabled
+	Return:
+		the version as a string
+	"""
+	listing = json.dumps([manifest["files"], bool(semantic_context)], sort_keys=True, default=str)
+	return f"{manifest['version']}-{hashlib.sha256(listing.encode()).hexdigest()[:12]}"
+
+def get_screenshot_pool():
+	"""Return the list of screenshot blobs, listing the image bucket on first use."""
+	global screenshot_pool
+	if screenshot_pool is None:
+		with screenshot_pool_lock:
+			if screenshot_pool is None:
+				screenshot_pool = gcs.list_image_bucket()
+	return screenshot_pool
+
+def create_description_config(rng=random):
 	"""Create a randomized description config for what the generated content
 	should include.
 	
@@ -247,26 +454,28 @@ def create_description_config():
 	
 	Optional system requirements include a sound card and additional notes.
 
+	Args:
+		rng (random.Random): random number generator, defaults to the random module
 	Return:
 		a DescriptionConfig instance
 	"""
 	# randomly determine whether to add a list of features or subsections
-	num_features = random.randint(2,5) if random.randint(0,1) else 0
-	num_subsections = random.randint(1,2) if num_features == 0 else 0
+	num_features = rng.randint(2,5) if rng.randint(0,1) else 0
+	num_subsections = rng.randint(1,2) if num_features == 0 else 0
 
 	return model_specs.DescriptionConfig(
-		extended_title=random.randint(0,1),
-        num_paragraphs=random.randint(1,2),
+		extended_title=rng.randint(0,1),
+        num_paragraphs=rng.randint(1,2),
         num_features=num_features,
         num_subsections=num_subsections,
-        tagline=random.randint(0,1),
+        tagline=rng.randint(0,1),
         system_requirements=model_specs._SystemRequirementsConfig(
-            sound_card=random.random() > 0.75,
-			additional_notes=random.random() > 0.75
+            sound_card=rng.random() > 0.75,
+			additional_notes=rng.random() > 0.75
 		)
     )
 
-def _render_template(template):
+def _render_template(template, rng=random):
 	"""Fill a POS tagged template string.
 
 	Uses a static POS map extracted from nltk corpus.
@@ -278,6 +487,7 @@ def _render_template(template):
 
 	Args:
 		template (str): the template to fill
+		rng (random.Random): random number generator, defaults to the random module
 	Return
 		the rendered template
 	"""
@@ -286,27 +496,27 @@ def _render_template(template):
 
 	# empty token; select 1-n random tags
 	if "{{}}" in template:
-		k = random.randint(1,2)
+		k = rng.randint(1,2)
 		# select random tags with replacement
-		tags = random.choices(VALID_TAGS, k=k)
+		tags = rng.choices(VALID_TAGS, k=k)
 
 		# select 1 word from each tag
 		new_words = []
 		for tag in tags:
-			word = random.choice(pos_map[tag])
+			word = rng.choice(pos_map[tag])
 			new_words.append(word)
 
 		template = template.replace("{{}}", " ".join(new_words))
 
 	# ?; select 0-1 random tags
 	if "{{?}}" in template:
-		k = random.randint(0,1)
-		tags = random.choices(VALID_TAGS, k=k)
+		k = rng.randint(0,1)
+		tags = rng.choices(VALID_TAGS, k=k)
 
 		if not tags:
 			word = ""
 		else:
-			word = random.choice(pos_map[tags[0]])
+			word = rng.choice(pos_map[tags[0]])
 
 		template = template.replace("{{?}}", word).strip()
 
@@ -314,27 +524,30 @@ def _render_template(template):
 	for tag_template in re.findall("{{[A-Z]+}}", template):
 		tag = tag_template[2:-2]  # tag name within {{ }}
 
-		k = random.randint(1,2)
-		new_words = random.sample(pos_map[tag], k)
+		k = rng.randint(1,2)
+		new_words = rng.sample(pos_map[tag], k)
 		template = template.replace(tag_template, " ".join(new_words))
 
 	return template
 
-def generate_developer():
+def generate_developer(rng=random):
 	"""Generate a developer name by filling a random developer template.
 
+	Args:
+		rng (random.Random): random number generator, defaults to the random module
 	Return:
 		the rendered developer name
 	"""
-	template = random.choice(data_files.DEVELOPER_TEMPLATES).rstrip()
-	return _render_template(template).strip("- ").title()
+	template = rng.choice(data_files.DEVELOPER_TEMPLATES).rstrip()
+	return _render_template(template, rng).strip("- ").title()
 
-def select_screenshots(screenshot_pool, tags):
+def select_screenshots(screenshot_pool, tags, rng=random):
 	"""Select screenshots from the screenshot pool matching given tags.
 	
 	Args:
 		screenshot_pool (list): a list of image blobs
 		tags (TagSet): content tags
+		rng (random.Random): random number generator, defaults to the random module
 
 	Return:
 		a list of image blobs. The first item is an artwork blob (if available),
@@ -357,10 +570,10 @@ def select_screenshots(screenshot_pool, tags):
 	artwork_blobs = [b for b in screenshot_blobs if "/art/" in b.name]
 	screenshot_blobs = [b for b in screenshot_blobs if "/art/" not in b.name]
 
-	SIZE = min(random.randint(1,2), len(screenshot_blobs))
-	screenshots = random.sample(screenshot_blobs, SIZE)
+	SIZE = min(rng.randint(1,2), len(screenshot_blobs))
+	screenshots = rng.sample(screenshot_blobs, SIZE)
 	if artwork_blobs:
 		logger.debug("Found matching artwork.")
-		screenshots = [random.choice(artwork_blobs)] + screenshots
+		screenshots = [rng.choice(artwork_blobs)] + screenshots
 
 	return screenshots
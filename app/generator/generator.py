@@ -1,29 +1,169 @@
+import functools
 import logging
+import math
+import os
 import random
 import pickle
 
+import numpy as np
+
+from app import nlp
+from app.generator import markov_model, word_vectors
 from app.utils import common
 
 
 DEFAULT_TEXT_LENGTH = 25
+# Hard limits on the number of words added past the requested size
+MAX_SENTENCE_COMPLETION_WORDS = 40
+MAX_CONTINUATION_WORDS = 10
+STOPWORDS = ("as", "a", "is", "of", "or", "the", "and", "under", "over", "your", "with")
 logger = logging.getLogger("app")
 
 
+class GenerationState:
+	"""Mutable state of a single walk over a model: the current key and the
+	random number generator to use.
+	"""
+	__slots__ = ("key_index", "rng")
+
+	def __init__(self, key_index, rng=random):
+		"""Args:
+			key_index (int): index of the current key in the model
+			rng (random.Random): random number generator, defaults to the random module
+		"""
+		self.key_index = key_index
+		self.rng = rng
+
+
+class SemanticContext:
+	"""Semantic context resolved once for a text: its word vector and its
+	row in the genre table of a Generator, if any.
+	"""
+	__slots__ = ("text", "vector", "genre")
+
+	def __init__(self, text, vector=None, genre=None):
+		"""Args:
+			text (str): the context text
+			vector (numpy.ndarray): unit length context vector
+			genre (int): row of the text in the genre table
+		"""
+		self.text = text
+		self.vector = vector
+		self.genre = genre
+
+
 class Generator:
-	"""A Generator creates text based on a pre-trained Markov model."""
+	"""A Generator creates text based on a pre-trained Markov model.
+
+	The model is immutable and a Generator keeps no generation state of its own:
+	each walk over the model is tracked in a GenerationState. A Generator
+	can thus be shared between threads.
+	"""
 
-	def __init__(self, model_data, name=None):
+	def __init__(self, model_data, name=None, vectors=None, genre_table=None):
 		"""Initialize the Generator with model data.
 
 		Args:
-			model_data (bytes): A pickle serialized pre-trained raw model data.
+			model_data (bytes | str): A serialized pre-trained model, either in the compact
+				MarkovModel format or a legacy pickled dict, or a path (os.PathLike) to a local model file.
+				Model files are memory mapped and used in place.
 			name (str): Optional name for the Generator instance.
+			vectors (numpy.ndarray | os.PathLike): Optional word vectors of the model vocabulary
+				for semantic context matching, or a path to a .npy file to memory map.
+				See word_vectors.export_word_vectors.
+			genre_table (word_vectors.GenreTable | os.PathLike): Optional precomputed successor
+				choices for genre contexts, or a path to a .npz file.
 		"""
-		self.model = pickle.loads(model_data)
+		if isinstance(model_data, os.PathLike):
+			model_data = markov_model.map_file(model_data)
+
+		if markov_model.is_compact_model(model_data):
+			self.model = markov_model.MarkovModel(model_data)
+		else:
+			# Models trained before the compact format are pickled dicts;
+			# convert on load.
+			self.model = markov_model.MarkovModel.from_dict(pickle.loads(model_data))
 		self.name = name
+		self.vectors = None
+		self.genre_table = None
+		if vectors is not None:
+			self.load_vectors(vectors)
+		if genre_table is not None:
+			self.load_genre_table(genre_table)
+
+	@property
+	def vectors_filename(self):
+		"""Name of the word vector file exported for this model, see word_vectors.vectors_filename."""
+		return word_vectors.vectors_filename(self.name, self.model)
+
+	@property
+	def genre_table_filename(self):
+		"""Name of the genre table file exported for this model."""
+		return word_vectors.genre_table_filename(self.name, self.model)
+
+	def load_vectors(self, vectors):
+		"""Load word vectors of the model vocabulary for semantic context matching.
+		Vectors not matching the vocabulary size are ignored.
+		Args:
+			vectors (numpy.ndarray | os.PathLike): the vectors or a path to a .npy file to memory map
+		"""
+		if isinstance(vectors, os.PathLike):
+			vectors = word_vectors.load(vectors)
+
+		if len(vectors) != self.model.vocab_size:
+			logger.warning("Word vectors do not match the vocabulary of model %s, ignoring.", self.name)
+			return
+		self.vectors = vectors
+
+	def load_genre_table(self, genre_table):
+		"""Load precomputed successor choices for genre contexts.
+		Args:
+			genre_table (word_vectors.GenreTable | os.PathLike): the table or a path to a .npz file
+		"""
+		if isinstance(genre_table, os.PathLike):
+			genre_table = word_vectors.GenreTable.load(genre_table)
+		self.genre_table = genre_table
+
+	@functools.cached_property
+	def _short_words(self):
+		return word_vectors.short_words(self.model)
+
+	def context_vector(self, text):
+		"""Compute a unit length context vector for semantic context matching,
+		see word_vectors.text_vector. Requires word vectors to be loaded.
+		Args:
+			text (str): the context, eg. a genre
+		Return:
+			the context vector, or None if the text has no vector
+		"""
+		return word_vectors.text_vector(text, self.model, self.vectors, nlp)
+
+	def semantic_context(self, text):
+		"""Resolve a context text for generation: look up its row in the genre table
+		and compute its context vector, if available.
+		Args:
+			text (str): the context, eg. a genre
+		Return:
+			a SemanticContext
+		"""
+		context = SemanticContext(text)
+		if self.genre_table is not None:
+			context.genre = self.genre_table.genres.get(text)
+		if self.vectors is not None:
+			context.vector = self.context_vector(text)
+		return context
 
-		# Set the initial key to start the text generation to a random key in the model
-		self._key = random.choice(list(self.model))
+	def new_state(self, rng=random):
+		"""Create a state for a new walk starting from a random sentence break.
+		Args:
+			rng (random.Random): random number generator to use for the walk
+		Return:
+			a GenerationState
+		"""
+		index = self.model.random_sentence_start(rng)
+		if index is None:
+			index = self.model.random_key(rng)
+		return GenerationState(index, rng)
 
 	def generate(
 		self,
@@ -32,6 +172,7 @@ class Generator:
 		complete_sentence=False,
 		continue_until_valid=False,
 		context=None,
+		state=None,
 	):
 		"""Generates a string of size words by randomly selecting words from the successor dictionary using the
 		previous n-1 words as the key.
@@ -39,13 +180,23 @@ class Generator:
 			seed (str): initial text to start generting from. If None, a random key is chosen from the model data
 			size (int): minimum number of words the text should contain.
 			complete_sentence (boolean): continue adding words past the specified minimum size until a punctuation
-					character or a whitelisted conjunction is encountered.
+					character or a whitelisted conjunction is encountered. Word selection is steered towards
+					the end of a sentence and at most MAX_SENTENCE_COMPLETION_WORDS are added.
 			continue_until_valid (boolean): continue adding words until a non-blacklisted word is encountered.
-			context (str): optional word to use as context for generation; used to look for semantically
-				similar words when multiple choices available. 
+					At most MAX_CONTINUATION_WORDS are added.
+			context (str | SemanticContext): optional word to use as context for generation; used to look for
+				semantically similar words when multiple choices available. A str context is resolved
+				once per call, see semantic_context().
+			state (GenerationState): state to continue generating from. If None, a new walk is started.
 		Return:
 			the generated text
 		"""
+		if state is None:
+			state = self.new_state()
+
+		if isinstance(context, str) and context:
+			context = self.semantic_context(context)
+
 		# Ensure size is positive
 		if size <= 0:
 			logger.warning("Cannot create text with length %s, defaulting to %s", size, DEFAULT_TEXT_LENGTH)
@@ -56,29 +207,28 @@ class Generator:
 		# If a seed was provided and it is found in the model, initialize text with it and
 		# use the last n-1 (ie. key length) words as the key.
 		if seed:
-			model_keys = list(self.model.keys())
 			seed_tokens = seed.split()
-			key_length = len(model_keys[0])
-			key = tuple(seed_tokens[-key_length:])
+			key = tuple(seed_tokens[-self.model.key_length:])
 
-			if key in self.model:
-				self._key = key
+			index = self.model.find_key(key)
+			if index is not None:
+				state.key_index = index
 				words.extend(seed_tokens)
 
 		# Keep generating words until length condition is satisfied
 		while len(words) < size:
-			word = self.get_word(context)
+			word = self.get_word(state, context)
 			words.append(word)
 
 		# To complete a sentence, keep adding words until a we encounter one ending in punctuation or
 		# until the next word is a conjunction.
 		if complete_sentence:
-			while True:
-				word = self.get_word()
+			for _ in range(MAX_SENTENCE_COMPLETION_WORDS):
+				word = self.get_word(state, steer_to_sentence_end=True)
 				words.append(word)
 
 				# break on punctuation
-				if word.endswith((".", "!", "?", "...", "…")):
+				if word.endswith(markov_model.SENTENCE_TERMINALS):
 					break
 
 				# for conjunctions, break the sentence by adding punctuation to the previous word and excluding the current word
@@ -86,60 +236,215 @@ class Generator:
 					words.pop()
 					words[-1] = words[-1] + "."
 					break
+			else:
+				# No sentence end within the budget; end the sentence here.
+				words[-1] = words[-1].rstrip(",;:-") + "."
 
 		if continue_until_valid:
-			word = words[-1]
-			while word.lower() in ("as", "a", "is", "of", "or", "the", "and", "under", "over", "your", "with"):
-				word = self.get_word()
-				words.append(word)
+			for _ in range(MAX_CONTINUATION_WORDS):
+				if words[-1].lower() not in STOPWORDS:
+					break
+				words.append(self.get_word(state))
+			else:
+				# Drop trailing stopwords left over after the budget
+				while len(words) > 1 and words[-1].lower() in STOPWORDS:
+					words.pop()
 
 		return self.cleanup(words)
 
-	def get_word(self, context=None):
+	def generate_many(self, n, size=DEFAULT_TEXT_LENGTH, complete_sentence=False, rng=None):
+		"""Generate n texts in a single batch.
+
+		All n walks are advanced together one step at a time, drawing the random
+		numbers for a step in one call and indexing the model arrays with NumPy.
+		The per word cost is thus independent of Python overhead, apart from
+		decoding the final words.
+
+		Every text starts from a random sentence break. Unlike generate(), seeds,
+		semantic context and conjunction breaks are not supported.
+
+		Args:
+			n (int): number of texts to generate
+			size (int): minimum number of words in each text; as in generate(), a fractional
+				size is rounded up and a non-positive size defaults to DEFAULT_TEXT_LENGTH.
+			complete_sentence (boolean): continue adding words past size until a sentence
+				ends, steering towards the end of a sentence for at most
+				MAX_SENTENCE_COMPLETION_WORDS words.
+			rng (numpy.random.Generator): random number generator to use, defaults to a new
+				unseeded generator.
+		Return:
+			a list of the generated texts
+		"""
+		if n <= 0:
+			return []
+
+		# Ensure size is a positive number of words
+		if size <= 0:
+			logger.warning("Cannot create text with length %s, defaulting to %s", size, DEFAULT_TEXT_LENGTH)
+			size = DEFAULT_TEXT_LENGTH
+		size = math.ceil(size)
+
+		if rng is None:
+			rng = np.random.default_rng()
+
+		arrays = self.model.arrays
+		max_length = size + (MAX_SENTENCE_COMPLETION_WORDS if complete_sentence else 0)
+		tokens = np.zeros((n, max_length), dtype=np.uint32)
+		lengths = np.full(n, size)
+
+		if len(arrays.sentence_starts):
+			state = arrays.sentence_starts[rng.integers(len(arrays.sentence_starts), size=n)].astype(np.int64)
+		else:
+			state = rng.integers(self.model.num_keys, size=n)
+
+		active = np.arange(n)
+		for step in range(max_length):
+			if step >= size:
+				# Sentence completion: walks whose last word ended a sentence are done.
+				active = active[arrays.sentence_distance[state[active]] != 0]
+				if not len(active):
+					break
+				lengths[active] = step + 1
+
+			current = state[active]
+			start = arrays.successor_offsets[current].astype(np.int64)
+			degree = arrays.successor_offsets[current + 1] - start
+
+			# Alias sampling
+			u = rng.random(len(active)) * degree
+			column = u.astype(np.int64)
+			edge = start + column
+			rejected = (u - column) >= arrays.alias_probability[edge]
+			edge[rejected] = start[rejected] + arrays.alias[edge[rejected]]
+
+			if step >= size:
+				# Steer towards a sentence end; use the shortest path successor
+				# whenever the sampled one does not get closer.
+				distance = arrays.sentence_distance
+				detour = distance[arrays.next_key[edge]] >= distance[current]
+				edge[detour] = arrays.sentence_edge[current[detour]]
+
+			tokens[active, step] = arrays.successors[edge]
+			state[active] = arrays.next_key[edge]
+
+		# Decode each distinct token once
+		words = {token_id: self.model.word(token_id) for token_id in np.unique(tokens[:, :lengths.max()]).tolist()}
+
+		texts = []
+		for row, length in zip(tokens.tolist(), lengths.tolist()):
+			text_words = [words[token_id] for token_id in row[:length]]
+			if complete_sentence and not text_words[-1].endswith(markov_model.SENTENCE_TERMINALS):
+				text_words[-1] = text_words[-1].rstrip(",;:-") + "."
+			texts.append(self.cleanup(text_words))
+
+		return texts
+
+	def get_word(self, state, context=None, steer_to_sentence_end=False):
 		"""Choose a random successor word from the model matching the current state key. 
+		Successors are weighted by how often they followed the key in the training data.
 		Updates the state by joining the new word with the tail end of the old key.
 		Args:
-			context (str): optional word to use as context; used to look for semantically
-				similar words when multiple choices available. 
+			state (GenerationState): the walk to advance
+			context (SemanticContext | str): optional context; used to look for semantically
+				similar words when multiple choices available. For keys in the genre table,
+				the precomputed choice for the context genre is used. Otherwise, the most
+				similar successor is found with word vectors or, lacking those, with spaCy.
+			steer_to_sentence_end (boolean): only choose successors bringing the generator
+				closer to the end of a sentence.
 		Return
 			a randomly chosen successor
 		"""
-		try:
-			choices = self.model[self._key]
-		except KeyError:
-			# In rare cases the model may not contain the key.
-			# Choose a random key and try again.
-			logger.warning("No successor for %s. Model: %s. Choosing a new seed.", self._key, self.name)
-			self._key = random.choice(list(self.model))
-			choices = self.model[self._key]
+		model = self.model
+		start = model._successor_offsets[state.key_index]
+		num_choices = model._successor_offsets[state.key_index + 1] - start
 
 		# If there is only one choice, avoid 
 		# invoking random unnecessarily.
-		if len(choices) == 1:
-			next_word = next(iter(choices))
-		elif len(choices) > 1 and context:
-			next_word = common.get_closest_word_match(context, choices)
+		if num_choices == 1:
+			edge = start
+		elif steer_to_sentence_end:
+			edge = self._sample_towards_sentence_end(state)
+		elif context:
+			if isinstance(context, str):
+				context = self.semantic_context(context)
+			edge = self._closest_successor(state.key_index, context)
+			if edge is None:
+				edge = model.sample_successor(state.key_index, state.rng)
 		else:
-			next_word = random.choice(list(choices))
-
-		# Update current key: shift to the right once and add the chosen word
-		self._key = (*self._key[1:], next_word)
+			edge = model.sample_successor(state.key_index, state.rng)
 
-		# If the new key is not in the model, choose a random key.
-		# TODO: Find out why this happens.
-		if self._key not in self.model:
-			logger.warning("Key %s not found in model %s. Choosing a new seed.", self._key, self.name)
-			self._key = random.choice(list(self.model))
+		next_word = model.word(model._successors[edge])
 
+		# Update current key: the model stores the index of the key formed by
+		# shifting the old key to the right once and adding the chosen word.
+		state.key_index = model._next_key[edge]
 		return next_word
 
-	def ff_to_next_sentence(self):
-		"""Fast forward the model to a 'natural' sentence break. Fetch a new word 
-		ignoring the output until the key ends with punctuation.
+	def _closest_successor(self, key_index, context):
+		"""Find the successor of a key most similar to a context.
+
+		Keys in the genre table are a lookup. Otherwise, similarities of all successors
+		to the context vector are computed in one matrix-vector product over the unit
+		length word vectors. Without word vectors, spaCy is used, unless a genre table
+		is available: spaCy is then not expected at serving time.
+
+		Args:
+			key_index (int): index of the key in the model
+			context (SemanticContext): the context
+		Return:
+			the position of the successor in the model successor arrays, or
+			None if there is no way to match the context
+		"""
+		if context.genre is not None:
+			edge = self.genre_table.edge(key_index, context.genre)
+			if edge is not None:
+				return edge
+
+		arrays = self.model.arrays
+		start = int(arrays.successor_offsets[key_index])
+		end = int(arrays.successor_offsets[key_index + 1])
+
+		if context.vector is not None:
+			token_ids = arrays.successors[start:end]
+			scores = self.vectors[token_ids] @ context.vector
+			# Penalize short words, as in common.get_closest_word_match
+			scores[self._short_words[token_ids]] = -5
+			return start + int(scores.argmax())
+
+		if self.genre_table is None and self.vectors is None:
+			choices = self.model.successors(key_index)
+			return start + choices.index(common.get_closest_word_match(context.text, choices))
+
+		return None
+
+	def _sample_towards_sentence_end(self, state, max_tries=3):
+		"""Sample a successor of the state key that leads closer to the end of a sentence.
+		Rejection samples from the successor distribution a few times before falling back
+		to the precomputed successor closest to a sentence end.
+		Return:
+			the position of the chosen successor in the model successor arrays
+		"""
+		model = self.model
+		distance = model._sentence_distance
+		current = distance[state.key_index]
+
+		for _ in range(max_tries):
+			edge = model.sample_successor(state.key_index, state.rng)
+			if distance[model._next_key[edge]] < current:
+				return edge
+
+		return model.sentence_edge(state.key_index)
+
+	def ff_to_next_sentence(self, state):
+		"""Fast forward a walk to a 'natural' sentence break. Jumps to a random key
+		ending with punctuation from the sentence break index stored in the model.
 		Thus, the next word generated corresponds to a sentence break in the training data.
+		Args:
+			state (GenerationState): the walk to fast forward
 		"""
-		while not self._key[-1].endswith((".", "!", "?", "...", "…")):
-			self.get_word()
+		index = self.model.random_sentence_start(state.rng)
+		if index is not None:
+			state.key_index = index
 
 	def cleanup(self, tokens):
 		"""cleanup a sentence by capitalizing the first letter, remove certain characters such as
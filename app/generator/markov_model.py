@@ -0,0 +1,513 @@
+"""Compact, array backed representation of a trained Markov model.
+
+A trained model is a mapping of (n-1)-word keys to their successors. Stored as a
+Python dict of tuples and sets every key, word and successor set becomes a separate
+heap object, which makes large models slow to unpickle and expensive to keep in memory.
+
+This module packs the same mapping into a handful of flat integer arrays:
+ * a sorted vocabulary; every distinct word is stored once as UTF-8 and referred to
+   by its integer token id. A hash index maps words back to their ids,
+ * the keys as packed token id tuples together with an open addressing hash index
+   for looking up a key by its words,
+ * the successors in CSR style: an offsets array with one entry per key pointing
+   to a slice in a flat successor id array,
+ * the number of times each successor followed its key in the training data, and an
+   alias table (Vose's method) per key for sampling successors by frequency in constant time,
+ * for every successor, the index of the key the model transitions to after emitting it,
+   so every successor always leads to a valid key,
+ * the indices of keys ending a sentence; generating from such a key starts a new sentence,
+ * for every key, the minimum number of words to generate to reach the end of a sentence
+   and the successor on that shortest path.
+
+The serialized form is a small JSON header followed by the raw arrays. A MarkovModel
+reads the arrays in place from any buffer without copying them. In particular, a model
+file can be memory mapped, in which case processes using the same file share a single
+copy of the model in the page cache.
+"""
+
+import array
+import collections
+import functools
+import json
+import mmap
+import random
+import struct
+import sys
+import types
+import zlib
+
+import numpy as np
+
+
+MAGIC = b"SGDMODEL"
+FORMAT_VERSION = 1
+SENTENCE_TERMINALS = (".", "!", "?", "...", "…")
+# Sentence distance of keys from which no sentence end can be reached
+UNREACHABLE = 0xFFFF
+
+# Section name -> array typecode
+_SECTION_TYPES = {
+	"vocab_offsets": "I",
+	"vocab": "B",
+	"vocab_index": "i",
+	"keys": "I",
+	"key_index": "i",
+	"successor_offsets": "I",
+	"successors": "I",
+	"successor_counts": "I",
+	"alias_probability": "f",
+	"alias": "I",
+	"next_key": "I",
+	"sentence_starts": "I",
+	"sentence_distance": "H",
+	"sentence_edge": "I",
+}
+_ALIGNMENT = 8
+_EMPTY_SLOT = -1
+_MASK32 = 0xFFFFFFFF
+
+
+def _hash_ids(ids):
+	"""Hash a sequence of token ids to a 32 bit integer.
+	A deterministic hash is needed as the index is computed at training time
+	and probed in other processes.
+	"""
+	h = 0
+	for token_id in ids:
+		h = (h * 0x9E3779B1 + token_id + 1) & _MASK32
+
+	# murmur3 finalizer to spread the bits before masking to the table size
+	h ^= h >> 16
+	h = (h * 0x85EBCA6B) & _MASK32
+	h ^= h >> 13
+	h = (h * 0xC2B2AE35) & _MASK32
+	h ^= h >> 16
+	return h
+
+def is_compact_model(data):
+	"""Check whether data is a serialized MarkovModel."""
+	return isinstance(data, (bytes, bytearray, memoryview, mmap.mmap)) and bytes(data[:len(MAGIC)]) == MAGIC
+
+def map_file(path):
+	"""Memory map a model file read-only.
+	Args:
+		path (str): path to the model file
+	Return:
+		the mapped file as a mmap object
+	"""
+	with open(path, "rb") as f:
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MarkovModel:
+	"""Read-only view of a serialized Markov model.
+
+	Keys are referred to by their integer index in the model and words by their
+	token id. The arrays are memoryviews into the buffer the model was created from.
+	"""
+
+	def __init__(self, buffer):
+		"""Create a model from a serialized buffer.
+
+		Args:
+			buffer (bytes-like): serialized model as created by serialize()
+		"""
+		if not is_compact_model(buffer):
+			raise ValueError("Not a serialized Markov model")
+
+		self._buffer = memoryview(buffer)
+		header_start = len(MAGIC) + 4
+		(header_length,) = struct.unpack_from("<I", self._buffer, len(MAGIC))
+		self.metadata = json.loads(bytes(self._buffer[header_start: header_start + header_length]))
+
+		if self.metadata["format_version"] != FORMAT_VERSION:
+			raise ValueError(f"Unsupported model format version {self.metadata['format_version']}")
+
+		self.key_length = self.metadata["key_length"]
+		self.num_keys = self.metadata["num_keys"]
+		self.vocab_size = self.metadata["vocab_size"]
+		self.num_successors = self.metadata["num_successors"]
+
+		if self.metadata["byteorder"] != sys.byteorder:
+			raise ValueError(f"Model was serialized on a {self.metadata['byteorder']} endian platform")
+
+		data_start = _align(header_start + header_length)
+		for name, (offset, length, typecode) in self.metadata["sections"].items():
+			section = self._buffer[data_start + offset: data_start + offset + length]
+			setattr(self, "_" + name, section.cast(typecode) if typecode != "B" else section)
+
+		self._key_index_mask = len(self._key_index) - 1
+		self._vocab_index_mask = len(self._vocab_index) - 1
+
+	@classmethod
+	def from_dict(cls, model):
+		"""Create a MarkovModel from a dict of (n-1)-gram keys to successor words."""
+		return cls(serialize(model))
+
+	def __len__(self):
+		return self.num_keys
+
+	def __contains__(self, key):
+		return self.find_key(key) is not None
+
+	@functools.cached_property
+	def arrays(self):
+		"""NumPy views of the model arrays for vectorized access. The views share
+		memory with the model buffer.
+		"""
+		return types.SimpleNamespace(**{
+			name: np.asarray(getattr(self, "_" + name)) for name in self.metadata["sections"]
+		})
+
+	@property
+	def nbytes(self):
+		"""Size of the serialized model in bytes."""
+		return self._buffer.nbytes
+
+	def word(self, token_id):
+		"""Decode a token id to its word."""
+		return str(self._vocab[self._vocab_offsets[token_id]: self._vocab_offsets[token_id + 1]], "utf-8")
+
+	def word_id(self, word):
+		"""Find the token id of a word.
+		Return:
+			the token id or None if the word is not in the vocabulary
+		"""
+		encoded = word.encode("utf-8")
+		slot = zlib.crc32(encoded) & self._vocab_index_mask
+		while True:
+			token_id = self._vocab_index[slot]
+			if token_id == _EMPTY_SLOT:
+				return None
+			if self._vocab[self._vocab_offsets[token_id]: self._vocab_offsets[token_id + 1]] == encoded:
+				return token_id
+			slot = (slot + 1) & self._vocab_index_mask
+
+	def key_ids(self, index):
+		"""Return the token ids of a key as a memoryview."""
+		start = index * self.key_length
+		return self._keys[start: start + self.key_length]
+
+	def key(self, index):
+		"""Decode the key at index to a tuple of words."""
+		return tuple(self.word(token_id) for token_id in self.key_ids(index))
+
+	def find_key(self, key):
+		"""Look up the index of a key given as a tuple of words.
+		Return:
+			the key index or None if the key is not in the model
+		"""
+		if len(key) != self.key_length:
+			return None
+
+		ids = []
+		for word in key:
+			token_id = self.word_id(word)
+			if token_id is None:
+				return None
+			ids.append(token_id)
+
+		slot = _hash_ids(ids) & self._key_index_mask
+		while True:
+			index = self._key_index[slot]
+			if index == _EMPTY_SLOT:
+				return None
+			if self.key_ids(index).tolist() == ids:
+				return index
+			slot = (slot + 1) & self._key_index_mask
+
+	def degree(self, index):
+		"""Number of distinct successors of the key at index."""
+		return self._successor_offsets[index + 1] - self._successor_offsets[index]
+
+	def successors(self, index):
+		"""Decode the successors of the key at index to a list of words."""
+		start = self._successor_offsets[index]
+		end = self._successor_offsets[index + 1]
+		return [self.word(token_id) for token_id in self._successors[start:end]]
+
+	def successor_counts(self, index):
+		"""Return the successors of the key at index as a Counter of words."""
+		start = self._successor_offsets[index]
+		end = self._successor_offsets[index + 1]
+		return collections.Counter(
+			{self.word(token_id): count for token_id, count in zip(self._successors[start:end], self._successor_counts[start:end])}
+		)
+
+	def sample_successor(self, index, rng=random):
+		"""Sample a successor of the key at index weighted by its count.
+		Return:
+			the position of the sampled successor in the successor arrays
+		"""
+		start = self._successor_offsets[index]
+		u = rng.random() * (self._successor_offsets[index + 1] - start)
+		column = int(u)
+		if u - column >= self._alias_probability[start + column]:
+			column = self._alias[start + column]
+		return start + column
+
+	def sentence_distance(self, index):
+		"""Minimum number of words to generate from the key at index until a word
+		ending a sentence is generated, or UNREACHABLE.
+		"""
+		return self._sentence_distance[index]
+
+	def sentence_edge(self, index):
+		"""Position of the successor of the key at index leading closest to the end of a sentence."""
+		return self._sentence_edge[index]
+
+	def random_key(self, rng=random):
+		"""Choose a random key index."""
+		return rng.randrange(self.num_keys)
+
+	def random_sentence_start(self, rng=random):
+		"""Choose a random key ending a sentence, ie. a state from which the next
+		word generated starts a new sentence.
+		Return:
+			the key index or None if the model has no sentence breaks
+		"""
+		if not len(self._sentence_starts):
+			return None
+		return self._sentence_starts[rng.randrange(len(self._sentence_starts))]
+
+	def to_dict(self):
+		"""Decode the model back to a dict of key tuples to successor Counters."""
+		return {self.key(i): self.successor_counts(i) for i in range(self.num_keys)}
+
+
+def serialize(model):
+	"""Serialize a model dict to the compact binary format.
+
+	Successors leading to a key not in the model are linked to a random sentence
+	break instead (see Trainer.close_dead_ends for closing the model at training time).
+
+	Args:
+		model (dict): mapping of (n-1)-gram key tuples to successor words. Successors
+			are either a mapping of words to counts or an iterable of words, in which
+			case each successor is weighted equally.
+	Return:
+		the serialized model as bytes
+	"""
+	# Keys without successors can never be sampled from; drop them so
+	# every key index is a valid generator state.
+	model = {key: successors for key, successors in model.items() if successors}
+	if not model:
+		raise ValueError("Cannot serialize an empty model")
+
+	key_length = len(next(iter(model)))
+
+	words = set()
+	for key, successors in model.items():
+		words.update(key)
+		words.update(successors)
+
+	vocab = sorted(words)
+	word_ids = {word: i for i, word in enumerate(vocab)}
+
+	vocab_offsets = array.array("I", [0])
+	encoded = bytearray()
+	word_hashes = []
+	for word in vocab:
+		encoded_word = word.encode("utf-8")
+		encoded += encoded_word
+		vocab_offsets.append(len(encoded))
+		word_hashes.append(zlib.crc32(encoded_word))
+
+	key_indices = {key: i for i, key in enumerate(model)}
+	sentence_starts = array.array("I", (i for i, key in enumerate(model) if key[-1].endswith(SENTENCE_TERMINALS)))
+
+	# Fixed seed for reproducible dead end links
+	rng = random.Random(0)
+	restart_keys = sentence_starts or range(len(model))
+	relinked = 0
+
+	keys = array.array("I")
+	successor_offsets = array.array("I", [0])
+	successor_ids = array.array("I")
+	successor_counts = array.array("I")
+	alias_probability = array.array("f")
+	alias = array.array("I")
+	next_key = array.array("I")
+
+	for key, successors in model.items():
+		if not isinstance(successors, dict):
+			successors = dict.fromkeys(successors, 1)
+
+		keys.extend(word_ids[word] for word in key)
+		words = sorted(successors)
+		counts = [successors[word] for word in words]
+		probability, aliases = _alias_table(counts)
+
+		for word in words:
+			successor_ids.append(word_ids[word])
+			next_index = key_indices.get((*key[1:], word))
+			if next_index is None:
+				next_index = rng.choice(restart_keys)
+				relinked += 1
+			next_key.append(next_index)
+		successor_counts.extend(counts)
+		alias_probability.extend(probability)
+		alias.extend(aliases)
+		successor_offsets.append(len(successor_ids))
+
+	key_index = _build_index(_hash_ids([word_ids[word] for word in key]) for key in model)
+	sentence_distance = _sentence_distances(successor_offsets, next_key, sentence_starts)
+	sentence_edge = array.array("I", (
+		min(range(successor_offsets[i], successor_offsets[i + 1]), key=lambda e: sentence_distance[next_key[e]])
+		for i in range(len(model))
+	))
+	sections = {
+		"vocab_offsets": vocab_offsets,
+		"vocab": encoded,
+		"vocab_index": _build_index(word_hashes),
+		"keys": keys,
+		"key_index": key_index,
+		"successor_offsets": successor_offsets,
+		"successors": successor_ids,
+		"successor_counts": successor_counts,
+		"alias_probability": alias_probability,
+		"alias": alias,
+		"next_key": next_key,
+		"sentence_starts": sentence_starts,
+		"sentence_distance": sentence_distance,
+		"sentence_edge": sentence_edge,
+	}
+	metadata = {
+		"format_version": FORMAT_VERSION,
+		"key_length": key_length,
+		"num_keys": len(model),
+		"vocab_size": len(vocab),
+		"num_successors": len(successor_ids),
+		"vocab_checksum": zlib.crc32(encoded),
+		"relinked_dead_ends": relinked,
+	}
+	return _pack(metadata, sections)
+
+def _sentence_distances(successor_offsets, next_key, sentence_starts):
+	"""Compute the minimum number of words to generate from each key to end a sentence.
+
+	Keys ending a sentence have distance 0. Distances are found by a breadth first
+	search from these keys over the reversed transitions.
+
+	Args:
+		successor_offsets (array): CSR offsets of the successors of each key
+		next_key (array): key index each successor transitions to
+		sentence_starts (array): indices of keys ending a sentence
+	Return:
+		the distances as an array of unsigned shorts, capped to UNREACHABLE
+	"""
+	num_keys = len(successor_offsets) - 1
+	predecessors = [[] for _ in range(num_keys)]
+	for index in range(num_keys):
+		for edge in range(successor_offsets[index], successor_offsets[index + 1]):
+			predecessors[next_key[edge]].append(index)
+
+	distance = array.array("H", [UNREACHABLE]) * num_keys
+	queue = collections.deque()
+	for index in sentence_starts:
+		distance[index] = 0
+		queue.append(index)
+
+	while queue:
+		index = queue.popleft()
+		next_distance = min(distance[index] + 1, UNREACHABLE)
+		for predecessor in predecessors[index]:
+			if distance[predecessor] == UNREACHABLE:
+				distance[predecessor] = next_distance
+				queue.append(predecessor)
+
+	return distance
+
+def _alias_table(weights):
+	"""Build an alias table for sampling from a discrete distribution in constant time
+	using Vose's alias method.
+
+	To sample, pick a column i uniformly and a uniform u in [0, 1): the result
+	is i if u < probability[i] and alias[i] otherwise.
+
+	Args:
+		weights (list): non-negative weight of each outcome
+	Return:
+		a tuple of (probability, alias) lists
+	"""
+	n = len(weights)
+	probability = [1.0] * n
+	alias = list(range(n))
+
+	# Uniform weights need no aliasing.
+	if min(weights) == max(weights):
+		return probability, alias
+
+	total = sum(weights)
+	scaled = [w * n / total for w in weights]
+	small = [i for i, p in enumerate(scaled) if p < 1]
+	large = [i for i, p in enumerate(scaled) if p >= 1]
+
+	while small and large:
+		s = small.pop()
+		l = large.pop()
+		probability[s] = scaled[s]
+		alias[s] = l
+		scaled[l] = scaled[l] + scaled[s] - 1
+		if scaled[l] < 1:
+			small.append(l)
+		else:
+			large.append(l)
+
+	# Remaining columns are full up to rounding errors.
+	for i in small + large:
+		probability[i] = 1.0
+
+	return probability, alias
+
+def _build_index(hashes):
+	"""Build an open addressing hash index with linear probing.
+	Args:
+		hashes (iterable): hash value of each item, in item order
+	Return:
+		the index as an array of item indices with -1 marking empty slots
+	"""
+	hashes = list(hashes)
+
+	# Size to a power of two with a load factor <= 0.5
+	index_size = 1
+	while index_size < 2 * len(hashes):
+		index_size *= 2
+
+	index = array.array("i", [_EMPTY_SLOT]) * index_size
+	mask = index_size - 1
+	for i, h in enumerate(hashes):
+		slot = h & mask
+		while index[slot] != _EMPTY_SLOT:
+			slot = (slot + 1) & mask
+		index[slot] = i
+
+	return index
+
+def _pack(metadata, sections):
+	"""Lay out the header and the section arrays into a single buffer.
+	Section offsets are stored relative to the aligned end of the header.
+	"""
+	layout = {}
+	offset = 0
+	for name, data in sections.items():
+		length = len(data) * (data.itemsize if isinstance(data, array.array) else 1)
+		layout[name] = [offset, length, _SECTION_TYPES[name]]
+		offset = _align(offset + length)
+
+	header = json.dumps({**metadata, "byteorder": sys.byteorder, "sections": layout}).encode()
+	data_start = _align(len(MAGIC) + 4 + len(header))
+
+	buffer = bytearray(data_start + offset)
+	buffer[:len(MAGIC)] = MAGIC
+	struct.pack_into("<I", buffer, len(MAGIC), len(header))
+	buffer[len(MAGIC) + 4: len(MAGIC) + 4 + len(header)] = header
+	for name, data in sections.items():
+		section_offset, length, _ = layout[name]
+		start = data_start + section_offset
+		buffer[start: start + length] = data.tobytes() if isinstance(data, array.array) else data
+
+	return bytes(buffer)
+
+def _align(offset):
+	return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
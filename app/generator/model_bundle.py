@@ -0,0 +1,136 @@
+"""A single file bundle of serialized models.
+
+Serving needs a dozen models, most of them tiny system requirement models. Stored as
+separate objects, loading them costs a request each, and request latency rather than
+bandwidth dominates the download time. A bundle packs all models into one file:
+ * a small JSON header indexing the offset and length of each model,
+ * the models as sections, each aligned to 8 bytes so the arrays of a MarkovModel
+   can be read in place.
+
+Uncompressed sections are carved out of the bundle as memoryviews without copying,
+so a memory mapped bundle is shared between processes like loose model files.
+Sections can optionally be compressed with zstd, if the zstandard package is installed,
+trading a smaller download for decompressing each model into memory.
+"""
+
+import json
+import mmap
+import struct
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+
+MAGIC = b"SGDBUNDL"
+FORMAT_VERSION = 1
+# Name of the bundle in the model manifest
+FILENAME = "models.bundle"
+COMPRESSIONS = ("zstd",)
+_ALIGNMENT = 8
+
+
+class ModelBundle:
+	"""Read-only view of a model bundle."""
+
+	def __init__(self, buffer):
+		"""Read the index of a bundle.
+
+		Args:
+			buffer (bytes-like): the bundle as created by pack()
+		"""
+		self._buffer = memoryview(buffer)
+		if bytes(self._buffer[:len(MAGIC)]) != MAGIC:
+			raise ValueError("Not a model bundle")
+
+		header_start = len(MAGIC) + 4
+		(header_length,) = struct.unpack_from("<I", self._buffer, len(MAGIC))
+		header = json.loads(bytes(self._buffer[header_start: header_start + header_length]))
+
+		if header["format_version"] != FORMAT_VERSION:
+			raise ValueError(f"Unsupported bundle format version {header['format_version']}")
+
+		self._data_start = _align(header_start + header_length)
+		self.sections = header["sections"]
+
+	@classmethod
+	def open(cls, path):
+		"""Memory map a bundle file.
+		Args:
+			path (str): path to the bundle
+		Return:
+			the ModelBundle
+		"""
+		with open(path, "rb") as f:
+			return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+	def __contains__(self, name):
+		return name in self.sections
+
+	def __iter__(self):
+		return iter(self.sections)
+
+	def get(self, name):
+		"""Get the data of a model in the bundle.
+
+		Uncompressed models are returned as a memoryview into the bundle;
+		compressed models are decompressed into a new buffer.
+
+		Args:
+			name (str): name of the model, eg. description.pkl
+		Return:
+			the serialized model as a bytes-like object
+		"""
+		section = self.sections[name]
+		start = self._data_start + section["offset"]
+		data = self._buffer[start: start + section["length"]]
+
+		if section["compression"] is None:
+			return data
+
+		if zstandard is None:
+			raise RuntimeError(f"Bundle section {name} is compressed with zstd; install the zstandard package")
+		return zstandard.ZstdDecompressor().decompress(data)
+
+
+def pack(models, compression=None):
+	"""Pack serialized models to a bundle.
+
+	Args:
+		models (dict): mapping of model names to serialized models
+		compression (str): section compression, None or "zstd"
+	Return:
+		the bundle as bytes
+	"""
+	if compression is not None and compression not in COMPRESSIONS:
+		raise ValueError(f"Unsupported compression {compression}")
+	if compression == "zstd" and zstandard is None:
+		raise RuntimeError("zstd compression requires the zstandard package")
+
+	compressor = zstandard.ZstdCompressor() if compression == "zstd" else None
+
+	sections = {}
+	layout = {}
+	offset = 0
+	for name, data in models.items():
+		data = compressor.compress(data) if compressor else bytes(data)
+		sections[name] = data
+		layout[name] = {"offset": offset, "length": len(data), "compression": compression}
+		offset = _align(offset + len(data))
+
+	header = json.dumps({"format_version": FORMAT_VERSION, "sections": layout}).encode()
+	data_start = _align(len(MAGIC) + 4 + len(header))
+
+	buffer = bytearray(data_start + offset)
+	buffer[:len(MAGIC)] = MAGIC
+	struct.pack_into("<I", buffer, len(MAGIC), len(header))
+	buffer[len(MAGIC) + 4: len(MAGIC) + 4 + len(header)] = header
+	for name, data in sections.items():
+		start = data_start + layout[name]["offset"]
+		buffer[start: start + len(data)] = data
+
+	return bytes(buffer)
+
+def _align(offset):
+	return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
@@ -1,10 +1,9 @@
 import collections
 import statistics
 import logging
-import pickle
 import sys
 
-from app.utils import gcs
+from app.generator import markov_model
 
 
 logger = logging.getLogger("app")
@@ -12,8 +11,9 @@ logger = logging.getLogger("app")
 
 class Trainer():
 	"""Trainer creates a Markov text chain model by splitting source text into ngrams
-	and keeping track of which n-1 word chains is followed by the remaining word. Trainers are
-	stored in Google Cloud Storage bucket for later access.
+	and keeping track of which n-1 word chains is followed by the remaining word. Trained models
+	are serialized in the compact MarkovModel format and stored in Google Cloud Storage bucket for later access,
+	see setup_gcs_models.setup.
 
 	A separate Generator instance can then use this to generate new text where every n consecutive
 	words appear somewhere in the original source text.
@@ -33,33 +33,76 @@ class Trainer():
 		self.filename = filename
 		self.character_level = character_level
 		self.model = None
+		self.model_data = None
+		self.dead_ends = 0
+		self.statistics = None
 
 	def run(self):
-		"""Train a new model and upload to data bucket."""
+		"""Train a new model and serialize it for storing, see setup_gcs_models.setup.
+		Statistics of the model are computed to self.statistics.
+		Return:
+			the serialized model
+		"""
 		if len(self.train_text_data) < 100:
 			raise RuntimeError("Cannot train a model with source data of length < 100")
 
 		self.train()
+		self.close_dead_ends()
 		self.compute_statistics()
 
-		model = pickle.dumps(self.model)
-		gcs.upload_to_gcs(model, gcs.DATA_BUCKET, gcs.MODEL_PREFIX + self.filename)
+		self.model_data = markov_model.serialize(self.model)
+		logger.info("Serialized model size: %.2fMB", len(self.model_data) / 10**6)
+		return self.model_data
 
 	def train(self):
 		"""Train the model with the input text.
 		
 		Splits the text into ngrams and store as a dict of (n-1)-gram keys
-		and 1-gram successor as values. Duplicate successors are ignored.
+		and Counters of 1-gram successors as values. Duplicate successors
+		are counted so the generator can sample successors by frequency.
 		"""
-		data = collections.defaultdict(set)
+		data = collections.defaultdict(collections.Counter)
 		for ngram in self.create_ngrams():
 			key = tuple(ngram[:-1])  # convert to a hashable dictionary key
-			data[key].add(ngram[-1])
+			data[key][ngram[-1]] += 1
 
 		# Convert back to a regular dictionary to prevent
 		# silently adding new keys during lookup.
 		self.model = dict(data)
 
+	def close_dead_ends(self):
+		"""Ensure every successor leads to a key in the model.
+
+		The key formed by the last n-1 words of the training data is not
+		in the model, as no word follows it. A generator emitting the final
+		word would be left without a valid key. Close the model by adding links
+		from such keys to the start of the training data, as if the text wrapped around.
+		"""
+		start_tokens = self.tokenize()[:self.n - 1]
+		missing_keys = {
+			(*key[1:], word)
+			for key, successors in self.model.items()
+			for word in successors
+			if (*key[1:], word) not in self.model
+		}
+
+		for key in missing_keys:
+			for token in start_tokens:
+				if key in self.model:
+					break
+				self.model[key] = collections.Counter({token: 1})
+				key = (*key[1:], token)
+
+		self.dead_ends = len(missing_keys)
+
+	def tokenize(self):
+		"""Split input training data to tokens: characters or words
+		depending on the model level.
+		"""
+		if self.character_level:
+			return self.train_text_data
+		return self.train_text_data.split()
+
 	def create_ngrams(self):
 		"""Split input training data into ngrams.
 		
@@ -70,10 +113,7 @@ class Trainer():
 		Return:
 			a generator yielding the ngrams as list of length n
 		"""
-		if self.character_level:
-			train_data = self.train_text_data
-		else:
-			train_data = self.train_text_data.split()
+		train_data = self.tokenize()
 
 		if len(train_data) < self.n:
 			raise RuntimeError(f"Not enough words to split; received {len(train_data)}, need {self.n}")
@@ -87,6 +127,7 @@ class Trainer():
 		 * the median degree: the median number of successors for keys
 		 * unit ngram rate: the % of keys having degree 1
 		 * size in megabytes
+		 * number of dead ends fixed by close_dead_ends()
 		"""
 		size = len(self.model)
 		degrees = [ len(self.model[key]) for key in self.model ]
@@ -95,6 +136,15 @@ class Trainer():
 		empty = degrees.count(0)
 		mb_size = sys.getsizeof(self.model) / 10**6
 
-		logger.info("Model statistics: total keys: %d, median degree: %s, unit ngram rate: %.2f, size: %.2fMB", size, median, units, mb_size)
+		logger.info(
+			"Model statistics: total keys: %d, median degree: %s, unit ngram rate: %.2f, size: %.2fMB, dead ends fixed: %d",
+			size, median, units, mb_size, self.dead_ends
+		)
+		self.statistics = {
+			"keys": size,
+			"median_degree": median,
+			"unit_ngram_rate": round(units, 4),
+			"dead_ends_fixed": self.dead_ends
+		}
 		if empty:
 			logging.warning("Detected %d keys wihtout successors", empty)
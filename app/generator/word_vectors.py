@@ -0,0 +1,189 @@
+"""Precomputed word vectors for semantic context matching.
+
+With semantic context enabled, the generator chooses the successor most similar
+to a context word. Rather than running spaCy for every candidate successor, the
+vectors of the whole model vocabulary are exported once as a NumPy matrix with a
+unit length row per token id. Similarity of every candidate to a context vector is
+then a single matrix-vector product.
+
+For the primary genres, which are used as context for every description, the choice
+can be made ahead of time: a genre table stores the successor closest to each genre
+for all keys with at least GENRE_TABLE_MIN_DEGREE successors. Genre context is then
+a table lookup.
+
+Vectors and genre tables are stored as .npy and .npz files named after the vocabulary
+checksum of their model, so a retrained model is never paired with the tables of another
+vocabulary.
+"""
+
+import io
+import logging
+
+import numpy as np
+
+
+logger = logging.getLogger("app")
+GENRE_TABLE_MIN_DEGREE = 8
+# Successors shorter than this are penalized in similarity matching
+MIN_CONTEXT_WORD_LENGTH = 4
+
+
+class GenreTable:
+	"""Precomputed successor choices of a model for a set of genres."""
+
+	def __init__(self, genres, hubs, edges):
+		"""Args:
+			genres (list): genre names
+			hubs (numpy.ndarray): sorted indices of the keys in the table
+			edges (numpy.ndarray): a row per genre of the chosen successor position for each hub key
+		"""
+		self.genres = {genre: row for row, genre in enumerate(genres)}
+		self.hubs = hubs
+		self.edges = edges
+
+	@classmethod
+	def load(cls, path):
+		"""Load a genre table from a .npz file."""
+		with np.load(path) as data:
+			return cls(data["genres"].tolist(), data["hubs"], data["edges"])
+
+	def to_bytes(self):
+		"""Serialize the table in .npz format."""
+		buffer = io.BytesIO()
+		np.savez(buffer, genres=np.array(list(self.genres)), hubs=self.hubs, edges=self.edges)
+		return buffer.getvalue()
+
+	def edge(self, key_index, genre):
+		"""Look up the successor chosen for a key and genre.
+		Args:
+			key_index (int): index of the key in the model
+			genre (int): row of the genre, see GenreTable.genres
+		Return:
+			the position of the successor in the model successor arrays,
+			or None if the key is not in the table
+		"""
+		position = self.hubs.searchsorted(key_index)
+		if position < len(self.hubs) and self.hubs[position] == key_index:
+			return int(self.edges[genre, position])
+		return None
+
+
+def vectors_filename(model_name, model):
+	"""Name of the word vector file matching a model.
+	Args:
+		model_name (str): name of the model, eg. "description"
+		model (MarkovModel): the model
+	Return:
+		the filename
+	"""
+	return f"{model_name}_vectors_{model.metadata['vocab_checksum']:08x}.npy"
+
+def genre_table_filename(model_name, model):
+	"""Name of the genre table file matching a model."""
+	return f"{model_name}_genres_{model.metadata['vocab_checksum']:08x}.npz"
+
+def export_word_vectors(model, nlp):
+	"""Create a matrix of unit length word vectors for the vocabulary of a model.
+
+	Vectors are looked up from the static vectors of a spaCy pipeline. Words
+	without a vector get a zero row, ie. zero similarity to any context.
+
+	Args:
+		model (MarkovModel): the model
+		nlp (spacy.Language): a spaCy pipeline with word vectors
+	Return:
+		a float32 matrix with a row per token id
+	"""
+	vectors = np.zeros((model.vocab_size, nlp.vocab.vectors_length), dtype=np.float32)
+	for token_id in range(model.vocab_size):
+		# make_doc only tokenizes; the doc vector is the average of its token vectors
+		vectors[token_id] = nlp.make_doc(model.word(token_id)).vector
+
+	norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+	np.divide(vectors, norms, out=vectors, where=norms > 0)
+	return vectors
+
+def text_vector(text, model, vectors, nlp=None):
+	"""Compute a unit length vector for a text.
+
+	The vector is the average of the word vectors of the words in text found in the model
+	vocabulary. If none are found, the text is vectorized with spaCy, if available.
+
+	Args:
+		text (str): the text, eg. a genre
+		model (MarkovModel): the model
+		vectors (numpy.ndarray): word vectors of the model vocabulary
+		nlp (spacy.Language): optional spaCy pipeline
+	Return:
+		the vector, or None if the text has no vector
+	"""
+	token_ids = []
+	for word in text.split():
+		token_id = model.word_id(word)
+		if token_id is None:
+			token_id = model.word_id(word.lower())
+		if token_id is not None:
+			token_ids.append(token_id)
+
+	vector = vectors[token_ids].sum(axis=0) if token_ids else None
+	if (vector is None or not vector.any()) and nlp:
+		vector = nlp.make_doc(text).vector
+	if vector is None:
+		return None
+
+	norm = np.linalg.norm(vector)
+	return (vector / norm).astype(np.float32) if norm else None
+
+def short_words(model):
+	"""Boolean mask of vocabulary words shorter than MIN_CONTEXT_WORD_LENGTH characters,
+	as penalized by common.get_closest_word_match.
+	"""
+	arrays = model.arrays
+	# Count characters rather than UTF-8 bytes: continuation bytes do not start a character
+	char_starts = (arrays.vocab & 0xC0) != 0x80
+	char_offsets = np.concatenate(([0], np.cumsum(char_starts)))[arrays.vocab_offsets]
+	return np.diff(char_offsets) < MIN_CONTEXT_WORD_LENGTH
+
+def export_genre_table(model, vectors, genres, nlp=None, min_degree=GENRE_TABLE_MIN_DEGREE):
+	"""Precompute the successor closest to each genre for the high fan-out keys of a model.
+	Args:
+		model (MarkovModel): the model
+		vectors (numpy.ndarray): word vectors of the model vocabulary
+		genres (list): genre names
+		nlp (spacy.Language): optional spaCy pipeline for genres not in the vocabulary
+		min_degree (int): minimum number of successors of a key to include in the table
+	Return:
+		a GenreTable
+	"""
+	genre_vectors = []
+	for genre in genres:
+		vector = text_vector(genre, model, vectors, nlp)
+		genre_vectors.append(vector if vector is not None else np.zeros(vectors.shape[1], dtype=np.float32))
+	genre_vectors = np.array(genre_vectors).T
+
+	arrays = model.arrays
+	degrees = np.diff(arrays.successor_offsets)
+	hubs = np.flatnonzero(degrees >= min_degree).astype(np.uint32)
+	edges = np.empty((len(genres), len(hubs)), dtype=np.uint32)
+	short = short_words(model)
+
+	for position, key_index in enumerate(hubs.tolist()):
+		start = int(arrays.successor_offsets[key_index])
+		token_ids = arrays.successors[start:start + degrees[key_index]]
+
+		# Similarity of each successor to each genre
+		scores = vectors[token_ids] @ genre_vectors
+		scores[short[token_ids]] = -5
+		edges[:, position] = start + scores.argmax(axis=0)
+
+	return GenreTable(genres, hubs, edges)
+
+def to_bytes(vectors):
+	"""Serialize a vector matrix in .npy format."""
+	buffer = io.BytesIO()
+	np.save(buffer, vectors)
+	return buffer.getvalue()
+
+def load(path):
+	"""Memory map a vector matrix from a .npy file."""
+	return np.load(path, mmap_mode="r")
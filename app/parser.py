@@ -11,9 +11,12 @@
 # otherwise the server will respond with a "null" and the status code 400 Bad Request.
 # If you use multiple appids and try to use multiple filters or any other filter, the server will respond with null.
 # This might be a bug from steam's server side.
+# Such bulk price_overview queries are used to find which random app ids exist before requesting
+# their full details, see find_app_ids.
 #
 # The API is rate limited (possibly 200 requests per 5 minute window?)
 # https://www.reddit.com/r/Steam/comments/304dft/steam_store_api_is_there_a_throttling_limit_on/
+# Requests are made concurrently but throttled to stay within that limit, see app.utils.rate_limit.
 
 
 import json
@@ -22,74 +25,187 @@ import os
 import random
 import requests
 import string
+import time
 from collections import defaultdict
 from datetime import datetime
 
 from bs4 import BeautifulSoup
 
-from app.utils import json_set_encoder, gcs
+from app.utils import json_set_encoder, gcs, rate_limit
 
 
 logger = logging.getLogger("app")
 
 API_ENDPOINT = "https://store.steampowered.com/api/appdetails"
-
-
-def upload_description_batch(batch_size=200):
+# Requests allowed per window of seconds
+RATE_LIMIT = 200
+RATE_LIMIT_WINDOW = 300
+# Requests that can be made at once. A scheduled batch, including its prefilter requests,
+# fits in the burst and is not throttled; the margin is left for retries.
+RATE_LIMIT_BURST = 180
+# Number of concurrent requests; a few are enough to hide the latency at the rate limit
+FETCH_WORKERS = 4
+# Number of candidate app ids checked per price_overview request. The ids are sent in
+# the query string, so the URL length sets the limit.
+PREFILTER_CHUNK_SIZE = 250
+PREFILTER_MAX_REQUESTS = 20
+# Number of parsed descriptions uploaded at a time
+UPLOAD_CHUNK_SIZE = 25
+
+
+def upload_description_batch(batch_size=200, prefilter=True):
 	"""Upload a randomly selected batch of Steam game descriptions to the data bucket.
+	App details are fetched concurrently within the API rate limit and descriptions
+	are uploaded concurrently in chunks as they are parsed. A batch within the burst
+	of the rate limit is not throttled; larger batches slow down to the rate limit.
 	Args:
 		batch_size (int): sample size of descriptions to parse.
+		prefilter (bool): whether to spend app details requests only on app ids
+			confirmed to exist, see find_app_ids. Otherwise random candidate ids
+			are queried directly.
 	"""
-	app_id_batch = get_app_id_batch(batch_size)
+	start = time.perf_counter()
 
 	logger.info("Parsing %s descriptions", batch_size)
 	with requests.Session() as s:
 		s.params = {"cc": "us", "l": "english"}
+		limiter = rate_limit.TokenBucket.for_quota(RATE_LIMIT, RATE_LIMIT_WINDOW, burst=RATE_LIMIT_BURST)
+		fetcher = rate_limit.RateLimitedFetcher(s, limiter, workers=FETCH_WORKERS)
+
+		uploads = []
+		uploaded = 0
+		try:
+			app_id_batch = find_app_ids(fetcher, batch_size) if prefilter else get_app_id_batch(batch_size)
+			params_list = [{"appids": app_id} for app_id in app_id_batch]
+			for params, response in fetcher.fetch_many(API_ENDPOINT, params_list):
+				app_id = params["appids"]
+				if isinstance(response, Exception):
+					logger.warning("Failed to fetch appid: %s, skipping... (%s)", app_id, response)
+					continue
 
-		success = 0
-		for app_id in app_id_batch:
-			logger.debug("Querying %s?appids=%s", API_ENDPOINT, app_id)
-			r = s.get(API_ENDPOINT, params={"appids": app_id})
-			r.raise_for_status()
+				upload = _parse_app_details(app_id, response)
+				if upload:
+					uploads.append(upload)
+
+				# Upload in chunks as descriptions are parsed, so a batch stopped
+				# by a timeout keeps most of its descriptions
+				if len(uploads) >= UPLOAD_CHUNK_SIZE:
+					uploaded += _upload_descriptions(uploads)
+					uploads = []
+		finally:
+			# Upload the descriptions parsed so far even if the batch is interrupted
+			if uploads:
+				uploaded += _upload_descriptions(uploads)
+			logger.info(
+				"Succesfully uploaded %s descriptions to %s/%s in %.1fs",
+				uploaded,
+				gcs.DATA_BUCKET,
+				gcs.TRAINING_DATA_PREFIX,
+				time.perf_counter() - start
+			)
+			logger.info(
+				"Yield: %.2f descriptions per request (%s requests, %s retries)",
+				uploaded / max(fetcher.requests, 1),
+				fetcher.requests,
+				fetcher.retries
+			)
 
-			if not r.json()[str(app_id)]["success"]:
-				logger.info("Unsuccesful request, appid: %s, skipping...", app_id)
-				continue
+def find_app_ids(fetcher, count, chunk_size=PREFILTER_CHUNK_SIZE, max_requests=PREFILTER_MAX_REQUESTS):
+	"""Find ids of existing Steam apps by checking random candidate ids in bulk.
 
-			data = r.json()[str(app_id)]["data"]
-			description = data.get("detailed_description")
-			if not description:
-				logger.info("No description detected, appid: %s, skipping...", app_id)
-				continue
+	Most ids from get_app_id_batch are not apps. Querying appdetails for many app ids
+	with filters=price_overview returns only prices, but it marks each existing app as
+	successful, so chunk_size candidates are checked for the cost of a single request.
+	Free apps succeed with empty data.
 
-			if data["type"].lower() not in ("game", "dlc", "demo", "advertising", "mod"):
-				logger.info("Excluding type: '%s', appid: %s", data["type"], app_id)
+	Args:
+		fetcher (RateLimitedFetcher): fetcher for the requests
+		count (int): number of app ids to find
+		chunk_size (int): number of candidate ids per request
+		max_requests (int): maximum number of requests to make
+	Return:
+		a list of at most count app ids
+	"""
+	found = []
+	checked = set()
+	made = 0
+	while len(found) < count and made < max_requests:
+		# A round of concurrent requests, one per worker
+		candidates = [
+			app_id
+			for app_id in get_app_id_batch(chunk_size * min(fetcher.workers, max_requests - made))
+			if app_id not in checked
+		]
+		if not candidates:
+			break
+		checked.update(candidates)
+
+		params_list = [
+			{"appids": ",".join(map(str, candidates[i: i + chunk_size])), "filters": "price_overview"}
+			for i in range(0, len(candidates), chunk_size)
+		]
+		for params, response in fetcher.fetch_many(API_ENDPOINT, params_list):
+			made += 1
+			if isinstance(response, Exception):
+				logger.warning("Failed to check app ids, skipping %s ids... (%s)", params["appids"].count(",") + 1, response)
 				continue
 
-			if "english" not in data.get("supported_languages", "english").lower():
-				logger.info("English not in supported languages, appid: %s, skipping...", app_id)
-				continue
+			# The response is null for malformed queries
+			found.extend(int(app_id) for app_id, result in (response or {}).items() if result and result["success"])
 
-			# extract selected keys from the response and convert html string descriptions
-			# to plain strings.
-			snapshot = format_data_dict(data)
-			ds = datetime.today().strftime("%Y-%m-%d")
-			name = data["name"].replace("/", "-") # Replace / to avoid issues with Cloud Storage prefixes
-			path = f"{gcs.TRAINING_DATA_PREFIX}{ds}/{name}.json"
-			gcs.upload_to_gcs(
-				json.dumps(snapshot, cls=json_set_encoder.SetEncoder),
-				gcs.DATA_BUCKET,
-				path,
-				content_type="application/json",
-			)
-			success += 1
-
-	logger.info(
-		"Succesfully uploaded %s descriptions to %s/%s",
-		success,
-		gcs.DATA_BUCKET,
-		gcs.TRAINING_DATA_PREFIX,
-	)
+	logger.info("Found %s apps in %s candidate ids with %s requests", len(found), len(checked), made)
+	return found[:count]
+
+def _parse_app_details(app_id, response):
+	"""Parse an appdetails response to a training data description.
+	Args:
+		app_id (int): the queried app id
+		response (dict): decoded JSON response
+	Return:
+		a (path, JSON string) pair to upload, or None if the app is not usable
+		as training data
+	"""
+	# The response is null for malformed queries
+	result = (response or {}).get(str(app_id))
+	if not result or not result["success"]:
+		logger.info("Unsuccesful request, appid: %s, skipping...", app_id)
+		return None
+
+	data = result["data"]
+	description = data.get("detailed_description")
+	if not description:
+		logger.info("No description detected, appid: %s, skipping...", app_id)
+		return None
+
+	if data["type"].lower() not in ("game", "dlc", "demo", "advertising", "mod"):
+		logger.info("Excluding type: '%s', appid: %s", data["type"], app_id)
+		return None
+
+	if "english" not in data.get("supported_languages", "english").lower():
+		logger.info("English not in supported languages, appid: %s, skipping...", app_id)
+		return None
+
+	# extract selected keys from the response and convert html string descriptions
+	# to plain strings.
+	snapshot = format_data_dict(data)
+	ds = datetime.today().strftime("%Y-%m-%d")
+	name = data["name"].replace("/", "-") # Replace / to avoid issues with Cloud Storage prefixes
+	path = f"{gcs.TRAINING_DATA_PREFIX}{ds}/{name}.json"
+	return path, json.dumps(snapshot, cls=json_set_encoder.SetEncoder)
+
+def _upload_descriptions(uploads):
+	"""Upload parsed descriptions concurrently.
+	Args:
+		uploads (list): (path, JSON string) pairs
+	Return:
+		the number of descriptions uploaded
+	"""
+	results = gcs.upload_many(gcs.DATA_BUCKET, uploads, content_type="application/json")
+	for (path, _), result in zip(uploads, results):
+		if isinstance(result, Exception):
+			logger.error("Failed to upload %s: %s", path, result)
+
+	return sum(result is None for result in results)
 
 def get_app_id_batch(batch_size):
 	"""Get a batch of pseudo Steam app ids.
@@ -1,40 +1,69 @@
+import datetime
 import logging
 import os
+import time
 from collections import defaultdict
 
-from app import parser, utils, BASE
-from app.generator import trainer
+from app import generate_description, parser, utils, BASE, nlp
+from app.generator import model_bundle, trainer
+from app.tools import export_word_vectors
 
 
 logger = logging.getLogger("app")
+# Compression of the model bundle sections, none or zstd
+BUNDLE_COMPRESSION = os.environ.get("MODEL_BUNDLE_COMPRESSION") or None
 
 
 def setup():
     """Train new generator models and store in Cloud Storage bucket.
-    Existing models will be overwritten.
+
+    Models are stored under a new version prefix. Once all models are uploaded,
+    a manifest listing the files along with their sizes, hashes and statistics
+    is published; serving loads models only through the manifest. A failed run
+    thus leaves the current models untouched.
+
+    With MODEL_BUNDLE_COMPRESSION set, the models used for descriptions are also packed
+    into a single compressed bundle file, which serving downloads instead of the separate
+    model files.
     """
+    start = time.perf_counter()
+    version = utils.gcs.new_model_version()
+    manifest = {
+        "version": version,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "training_data": utils.gcs.training_data_window(),
+        "files": {}
+    }
+    models = {}
+    statistics = {}
+
+    # Train a model; all models are uploaded at once when trained
+    def add_model(t):
+        models[t.filename] = t.run()
+        statistics[t.filename] = t.statistics
+
     logger.info("Downloading source files... ")
     source_data_list = utils.gcs.download_all_source_files()
 
     logger.info("Creating description model...")
     description_text = " ".join([item["detailed_description"] for item in source_data_list])
     t = trainer.Trainer(description_text, "description.pkl")
-    t.run()
+    add_model(t)
 
     logger.info("Creating character level description model...")
     description_text = " ".join([item["detailed_description"] for item in source_data_list])
     t = trainer.Trainer(description_text, "names.pkl", n=4, character_level=True)
-    t.run()
+    add_model(t)
 
     logger.info("Creating feature model...")
     feature_text = utils.common.get_text_file(os.path.join(BASE, "data", "features.txt"))
     t = trainer.Trainer(feature_text, "feature.pkl")
-    t.run()
+    add_model(t)
 
     logger.info("Creating tagline model...")
     taglines_text = utils.common.get_text_file(os.path.join(BASE, "data", "taglines.txt"))
     t = trainer.Trainer(taglines_text, "tagline.pkl")
-    t.run()
+    add_model(t)
 
     # Train a dedicated model for each system requirement category
     logger.info("Creating system requirement models:")
@@ -43,7 +72,7 @@ def setup():
         logger.info(" # %s:", key)
         text_data = " ".join(extracted_requirement_map[key])
         t = trainer.Trainer(text_data, f"requirements_{key.replace(' ', '_')}.pkl")
-        t.run()
+        add_model(t)
 
     logger.info("Creating ratings model...")
     # join individual ratings within a single item
@@ -52,9 +81,43 @@ def setup():
     # join ratings across all items
     ratings_text = " ".join(ratings)
     t = trainer.Trainer(ratings_text, "ratings.pkl")
-    t.run()
+    add_model(t)
+
+    files = dict(models)
+    # An uncompressed bundle is slower to download than the model files
+    if BUNDLE_COMPRESSION:
+        logger.info("Creating model bundle...")
+        files[model_bundle.FILENAME] = model_bundle.pack(
+            {filename: data for filename, data in models.items() if filename in BUNDLED_MODELS},
+            compression=BUNDLE_COMPRESSION
+        )
+        logger.info("Bundle size: %.2fMB", len(files[model_bundle.FILENAME]) / 10**6)
+
+    entries = utils.gcs.upload_model_files(files, version)
+    for filename, entry in entries.items():
+        manifest["files"][filename] = {**entry, "stats": statistics[filename]} if filename in statistics else entry
+    if model_bundle.FILENAME in entries:
+        manifest["files"][model_bundle.FILENAME]["compression"] = BUNDLE_COMPRESSION
+
+    # Word vectors are tied to the model vocabulary; re-export on each training run
+    if nlp:
+        logger.info("Exporting description word vectors...")
+        export_word_vectors.export_model_vectors("description", manifest)
+
+    # Publish the new models; serving instances reload on the change
+    utils.gcs.publish_manifest(manifest)
+    logger.info(
+        "Models saved in gs://%s/%s%s in %.1fs",
+        utils.gcs.DATA_BUCKET, utils.gcs.MODEL_PREFIX, version, time.perf_counter() - start
+    )
 
-    logger.info("Models saved in gs://%s", utils.gcs.DATA_BUCKET)
+# Models included in the bundle: the ones used for descriptions
+BUNDLED_MODELS = [
+    name + ".pkl" for name in [
+        *generate_description.DESCRIPTION_MODELS.values(),
+        *generate_description.SYSTEM_REQUIREMENT_MODELS.values()
+    ]
+]
 
 def _merge_requirements(source_data_list):
     """Merge a list of requirement dicts.
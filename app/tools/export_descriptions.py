@@ -0,0 +1,51 @@
+import gzip
+import json
+import multiprocessing
+import time
+
+from app import generate_description
+
+
+# Generator used by the worker processes
+_generator = None
+
+
+def export_descriptions(generator, count, path, workers=None, seed=0):
+    """Generate descriptions in parallel and write them to a JSON lines file.
+
+    The generator and the screenshot pool are loaded in the parent process and
+    shared with forked worker processes; memory mapped models are shared between
+    all workers. Description i is generated with seed + i, so the output only
+    depends on the seed and the models. Descriptions are written in order.
+
+    Args:
+        generator (DescriptionGenerator): the generator to use
+        count (int): number of descriptions to generate
+        path (str): output file; compressed with gzip if the name ends with .gz
+        workers (int): number of worker processes, defaults to the number of CPUs
+        seed (int): seed of the first description
+    Return:
+        the time taken in seconds
+    """
+    global _generator
+    _generator = generator
+    generate_description.get_screenshot_pool()
+
+    workers = workers or multiprocessing.cpu_count()
+    # Large enough chunks to amortize inter-process communication
+    chunksize = max(1, min(100, count // (workers * 8)))
+
+    start = time.perf_counter()
+    open_ = gzip.open if str(path).endswith(".gz") else open
+    with (
+        open_(path, "wt", encoding="utf8") as f,
+        multiprocessing.get_context("fork").Pool(workers) as pool
+    ):
+        for line in pool.imap(_generate, range(seed, seed + count), chunksize=chunksize):
+            f.write(line + "\n")
+
+    return time.perf_counter() - start
+
+def _generate(seed):
+    """Generate a serialized description in a worker process."""
+    return json.dumps(_generator(seed=seed))
@@ -0,0 +1,36 @@
+import logging
+
+from app import nlp
+from app.generator import markov_model, word_vectors
+from app.utils import gcs, data_files
+
+
+logger = logging.getLogger("app")
+
+
+def export_model_vectors(model_name, manifest):
+    """Export word vectors for the vocabulary of a model in Cloud Storage
+    and a genre table for the primary genres. The files are uploaded under
+    the version of the model and added to its manifest.
+    Requires the "spacy" optional dependencies to be installed.
+
+    Args:
+        model_name (str): name of the model to export vectors for
+        manifest (dict): manifest of the models, see setup_gcs_models.setup
+    """
+    if nlp is None:
+        raise RuntimeError("Exporting word vectors requires spaCy and the en_core_web_md model")
+
+    version = manifest["version"]
+    model_data = gcs.download_from_gcs(gcs.DATA_BUCKET, manifest["files"][model_name + ".pkl"]["path"])
+    model = markov_model.MarkovModel(model_data)
+
+    vectors = word_vectors.export_word_vectors(model, nlp)
+    filename = word_vectors.vectors_filename(model_name, model)
+    manifest["files"][filename] = gcs.upload_model_file(word_vectors.to_bytes(vectors), version, filename)
+    logger.info("Exported word vectors for %d words to %s", len(vectors), filename)
+
+    genre_table = word_vectors.export_genre_table(model, vectors, list(data_files.GENRES["Primary"]), nlp)
+    filename = word_vectors.genre_table_filename(model_name, model)
+    manifest["files"][filename] = gcs.upload_model_file(genre_table.to_bytes(), version, filename)
+    logger.info("Exported genre table for %d keys to %s", len(genre_table.hubs), filename)
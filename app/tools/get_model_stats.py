@@ -1,8 +1,7 @@
-import pickle
 import statistics
-import sys
 import textwrap
 
+from app.generator import markov_model
 from app.utils import gcs
 
 
@@ -10,23 +9,25 @@ def show_current_model_stats():
     """Compute statistics for the current description model
     in Cloud Storage.
     """
-    filename = "models/description.pkl"
-    model_data = gcs.download_from_gcs(gcs.MODEL_BUCKET, filename)
-    model = pickle.loads(model_data)
+    manifest = gcs.get_manifest()
+    filename = manifest["files"]["description.pkl"]["path"]
+    model_data = gcs.download_from_gcs(gcs.DATA_BUCKET, filename)
+    model = markov_model.MarkovModel(model_data)
 
-    degrees = []
-    for key in model:
-        d = len(model[key])
-        degrees.append(d)
+    degrees = [model.degree(i) for i in range(model.num_keys)]
 
     median = statistics.median(degrees)
     units = degrees.count(1) / len(degrees)
-    mb_size = sys.getsizeof(model_data) / 10**6
+    mb_size = model.nbytes / 10**6
 
     print(textwrap.dedent(f"""\
             Current description model statistics:
-            filepath: {gcs.MODEL_BUCKET}/{filename} 
+            version: {manifest["version"]}
+            training data: {manifest["training_data"]}
+            filepath: {gcs.DATA_BUCKET}/{filename} 
+            total keys: {model.num_keys}
+            vocabulary size: {model.vocab_size}
             median degree: {median}
             unit ngram rate: {units:.2f}
             size: {mb_size:.2f}MB""")
-    )
\ No newline at end of file
+    )
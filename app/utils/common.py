@@ -1,45 +1,57 @@
 # Common utility functions
 
+import functools
+import os
 import random
 
+import numpy as np
+
 from app.utils.data_files import GENRES
 from app import nlp, model_specs
 
 
+# Max number of entries in the similarity cache of get_closest_word_match
+SIMILARITY_CACHE_SIZE = int(os.getenv("SIMILARITY_CACHE_SIZE", 100_000))
+# Max number of unit word vectors cached for get_closest_word_match; each takes
+# about 1 kB with the 300 dimensional vectors of en_core_web_md
+VECTOR_CACHE_SIZE = int(os.getenv("VECTOR_CACHE_SIZE", 10_000))
+
 def get_text_file(filename):
     """Get contents from a text file."""
     with open(filename) as f:
         return f.read().strip()
     
-def select_tags():
+def select_tags(rng=random):
     """Randomly select a group of tags from a static file.
     Tags include:
      * 1 genre tag
      * 1-2 genre dependant tags to be used as context for text and image generation
      * 0-2 additional tags to be used as display only
+    Args:
+        rng (random.Random): random number generator, defaults to the random module
     Return:
         a TagSet instance with the selected tags.
     """
-    genre, genre_tags = random.choice(list(GENRES["Primary"].items()))
+    genre, genre_tags = rng.choice(list(GENRES["Primary"].items()))
 
     # initialize tags with the genre and 1 matching primary tag
     tags_envelope = {
         "genre": genre,
-        "context": [random.choice(genre_tags)],
+        "context": [rng.choice(genre_tags)],
         "extra": []
     }
 
     # optionally add 1 common context tag for image prompt
-    if random.random() <= 0.5:
-         tags_envelope["context"].append(random.choice(GENRES["Common"]))
+    if rng.random() <= 0.5:
+         tags_envelope["context"].append(rng.choice(GENRES["Common"]))
 
     # add 0-2 more text-only tags
-    r = random.random()
+    r = rng.random()
     if r < 0.52:
-        tags_envelope["extra"].append(random.choice(GENRES["Other"]))
+        tags_envelope["extra"].append(rng.choice(GENRES["Other"]))
 
     elif r > 0.8:
-        tags_envelope["extra"].extend(random.choices(GENRES["Other"], k=2))
+        tags_envelope["extra"].extend(rng.choices(GENRES["Other"], k=2))
 
     return model_specs.TagSet(**tags_envelope)
 
@@ -48,6 +60,10 @@ def get_closest_word_match(context, choices):
     to it.
     Requires the "spacy" optional dependencies to be installed.
 
+    Contexts and candidates come from a small set of genres and frequent words,
+    so similarities and the unit vectors of the texts are cached in bounded LRU caches.
+    See similarity_cache_info() for cache statistics.
+
     Args:
         context (str): the word to find a match for
         choices (list): the list to look for the match
@@ -59,6 +75,37 @@ def get_closest_word_match(context, choices):
     def _similarity_key(item):
         if len(item) < 4:
             return -5
-        return nlp(context).similarity(nlp(item))
+        return _similarity(context, item)
 
     return sorted(choices, key=_similarity_key)[-1]
+
+@functools.lru_cache(maxsize=SIMILARITY_CACHE_SIZE)
+def _similarity(context, item):
+    """Semantic similarity of two texts: the cosine similarity of their vectors,
+    as in spaCy's Doc.similarity. Texts without a vector have a similarity of 0.
+    """
+    context_vector = _vector(context)
+    item_vector = _vector(item)
+    if context_vector is None or item_vector is None:
+        return 0.0
+    return float(np.dot(context_vector, item_vector))
+
+@functools.lru_cache(maxsize=VECTOR_CACHE_SIZE)
+def _vector(text):
+    """Process a text with spaCy and get its unit length vector, or None if it has no vector.
+    Only the vector is kept: a Doc also holds its tokens and tensors.
+    """
+    doc = nlp(text)
+    if not doc.vector_norm:
+        return None
+    return doc.vector / doc.vector_norm
+
+def similarity_cache_info():
+    """Get hit and miss counts and current sizes of the similarity and vector caches.
+    Return:
+        a dict of cache name to functools cache info named tuples
+    """
+    return {
+        "similarity": _similarity.cache_info(),
+        "vector": _vector.cache_info()
+    }
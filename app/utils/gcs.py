@@ -1,13 +1,20 @@
-# Helper functions for storing and retrieving data from Google Cloud Storage.
+# Helper functions for storing and retrieving data from the data and image buckets.
+# Objects are stored through the storage backend selected by STORAGE_BACKEND,
+# Google Cloud Storage by default, see storage.py.
 
-import io
+import datetime
+import fcntl
+import hashlib
 import json
 import logging
 import os
-import random
+import pathlib
+import pickle
+import tempfile
+import time
 
-from google.cloud import storage
-from google.cloud.storage import transfer_manager
+from app.generator import markov_model
+from app.utils import storage
 
 
 logger = logging.getLogger("app")
@@ -17,89 +24,384 @@ TRAINING_DATA_PREFIX = os.environ["TRAINING_DATA_PREFIX"]
 MODEL_PREFIX = os.environ["MODEL_PREFIX"]
 IMG_BUCKET = os.environ["IMG_BUCKET"]
 
-gcs_client = storage.Client()
+# Local directory for downloaded model files. Model files are memory mapped from here,
+# so all worker processes on the same host share a single copy.
+LOCAL_MODEL_DIR = os.environ.get(
+    "LOCAL_MODEL_DIR",
+    os.path.join(tempfile.gettempdir(), "steam-game-descriptor", "models")
+)
 
+# Lists the files of the current models. Models of each training run are stored
+# under a versioned prefix and the manifest is published once they are all uploaded.
+MODEL_MANIFEST = MODEL_PREFIX + "manifest.json"
+MODEL_VERSIONS_TO_KEEP = 3
+# Seconds a local model file not in the current manifest is kept after it was last used.
+# Other worker processes may still be loading files of the previous manifest.
+MODEL_FILE_GRACE_PERIOD = 600
+# Version of models stored directly under the model prefix, before the manifest
+LEGACY_MODEL_VERSION = "legacy"
 
-def upload_to_gcs(data, bucket, path, **kwargs):
-    """Upload string data to bucket."""
-    bucket = gcs_client.get_bucket(bucket)
-    blob = bucket.blob(path)
-    blob.upload_from_string(data, **kwargs)
+
+def upload_to_gcs(data, bucket, path, content_type=None):
+    """Upload string or bytes data to bucket."""
+    if isinstance(data, str):
+        data = data.encode("utf8")
+    storage.get_backend().put(bucket, path, data, content_type=content_type)
 
 def download_from_gcs(bucket, path):
     """Download a file from bucket."""
-    bucket = gcs_client.get_bucket(bucket)
-    blob = bucket.get_blob(path)
-    return blob.download_as_bytes()
+    return storage.get_backend().get(bucket, path)
 
-def download_all_source_files():
-    """Download (serially) all model training source files from the temp bucket.
+def upload_many(bucket, items, content_type=None, max_workers=None):
+    """Upload files to bucket concurrently.
+    Args:
+        bucket (str): name of the bucket
+        items (list): (path, data) pairs; data as string or bytes
+        content_type (str): content type of all files
+        max_workers (int): number of concurrent uploads, defaults to storage.MAX_WORKERS
+    Return:
+        a list of None or the exception raised by each upload, in the order of items
+    """
+    items = [(path, data.encode("utf8") if isinstance(data, str) else data) for path, data in items]
+
+    start = time.perf_counter()
+    results = storage.get_backend().put_many(bucket, items, content_type=content_type, max_workers=max_workers)
+    failed = sum(isinstance(result, Exception) for result in results)
+    logger.info(
+        "Uploaded %d files to gs://%s in %.2fs, %d failed",
+        len(items) - failed, bucket, time.perf_counter() - start, failed
+    )
+    return results
+
+def download_many(bucket, paths, max_workers=None):
+    """Download files from bucket concurrently.
+    Args:
+        bucket (str): name of the bucket
+        paths (list): paths of the files
+        max_workers (int): number of concurrent downloads, defaults to storage.MAX_WORKERS
+    Return:
+        a list of bytes or the exception raised by each download, in the order of paths
+    """
+    start = time.perf_counter()
+    results = storage.get_backend().get_many(bucket, paths, max_workers=max_workers)
+    logger.info("Downloaded %d files from gs://%s in %.2fs", len(paths), bucket, time.perf_counter() - start)
+    return results
 
-    This will take a while depending on the number of files in the bucket.
-    In practice this has little performance implications as this method
-    is only called when re-training the models.
+def download_all_source_files():
+    """Download all model training source files from the data bucket.
+    Files are downloaded concurrently.
 
     Return:
         a list of dicts loaded from the file contents
     """
     logger.info("Loading data files from gs://%s/%s", DATA_BUCKET, TRAINING_DATA_PREFIX)
 
-    blobs = gcs_client.list_blobs(DATA_BUCKET, prefix=TRAINING_DATA_PREFIX)
+    names = [obj.name for obj in storage.get_backend().list(DATA_BUCKET, prefix=TRAINING_DATA_PREFIX)]
+
     results = []
+    for data in download_many(DATA_BUCKET, names):
+        if isinstance(data, Exception):
+            raise data
+        results.append(json.loads(data.decode("utf8")))
 
-    count = 0
-    for blob in blobs:
-        count += 1
-        data = blob.download_as_bytes().decode("utf8")
-        results.append(json.loads(data))
-    
-    logger.info("Loaded %d files", count)
+    logger.info("Loaded %d files", len(results))
     return results
 
-def _download_all_model_files():
-    """Download all pre-trained model files from Cloud Storage.
+def new_model_version():
+    """Create a version identifier for a new set of models."""
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
 
-    Uses the transfer_manager module for better throughput and
-    concurrent downloads.
+def upload_model_file(data, version, filename):
+    """Upload a model file under the prefix of a model version.
+    Args:
+        data (bytes): file contents
+        version (str): the model version
+        filename (str): name of the file
+    Return:
+        a manifest entry for the file: its path in the data bucket, size and SHA-256 hash
+    """
+    return upload_model_files({filename: data}, version)[filename]
 
-    Returns:
-        dict: A dictionary mapping model basenames to model data as bytes.
+def upload_model_files(files, version):
+    """Upload model files concurrently under the prefix of a model version.
+    Args:
+        files (dict): mapping of file names to file contents as bytes
+        version (str): the model version
+    Return:
+        a dict of manifest entries by file name, see upload_model_file
+    Raises:
+        the exception of the first failed upload, if any
     """
-    logger.info("Loading models from gs://%s/%s", DATA_BUCKET, MODEL_PREFIX)
-    
-    blobs = list(gcs_client.list_blobs(DATA_BUCKET, prefix=MODEL_PREFIX, match_glob="**.pkl"))
-    
-    # Prepare blob-file pairs for transfer_manager
-    blob_file_pairs = [(blob, io.BytesIO()) for blob in blobs]
-    
-    # Download all files concurrently
-    results = transfer_manager.download_many(
-        blob_file_pairs,
-        max_workers=8,
-        worker_type=transfer_manager.THREAD
-    )
-    
-    models = {}
-    for (blob, file_obj), result in zip(blob_file_pairs, results):
+    paths = {filename: f"{MODEL_PREFIX}{version}/{filename}" for filename in files}
+    results = upload_many(DATA_BUCKET, [(paths[filename], data) for filename, data in files.items()])
+    for result in results:
         if isinstance(result, Exception):
-            logger.error("Failed to download %s: %s", blob.name, result)
-            continue
-        
-        # Read the downloaded data from the BytesIO object
-        file_obj.seek(0)
-        model_base_name = blob.name.split("/")[-1]
-        models[model_base_name] = file_obj.read()
-    
-    logger.info("Loaded %d model files", len(models))
-    return models
+            raise result
+
+    return {
+        filename: {"path": paths[filename], "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+        for filename, data in files.items()
+    }
+
+def publish_manifest(manifest, keep=MODEL_VERSIONS_TO_KEEP):
+    """Publish a set of models by uploading their manifest. Model files should
+    be uploaded first: serving processes only load models listed in the manifest.
+    Files of all but the keep most recent model versions are deleted.
+
+    Args:
+        manifest (dict): the manifest, see setup_gcs_models.setup
+        keep (int): number of model versions to keep
+    """
+    upload_to_gcs(json.dumps(manifest, indent=2), DATA_BUCKET, MODEL_MANIFEST, content_type="application/json")
+    logger.info("Published models version %s", manifest["version"])
+
+    backend = storage.get_backend()
+    # Model files are stored in version folders under the model prefix
+    versions = {}
+    for obj in backend.list(DATA_BUCKET, prefix=MODEL_PREFIX):
+        version, _, filename = obj.name[len(MODEL_PREFIX):].partition("/")
+        if filename:
+            versions.setdefault(version, []).append(obj.name)
+
+    for version in sorted(versions)[:-keep]:
+        for name in versions[version]:
+            backend.delete(DATA_BUCKET, name)
+
+def get_manifest():
+    """Download the manifest of the current models.
+    Return:
+        the manifest as a dict, or None if no models have been published
+    """
+    try:
+        return json.loads(download_from_gcs(DATA_BUCKET, MODEL_MANIFEST))
+    except FileNotFoundError:
+        return None
+
+def _get_cached_manifest(destination):
+    """Get the manifest of the current models, using a local copy if it is current.
+    A current copy is validated with a single metadata request.
+    Args:
+        destination (str): local model directory
+    Return:
+        the manifest as a dict, or None if no models have been published
+    """
+    obj = storage.get_backend().stat(DATA_BUCKET, MODEL_MANIFEST)
+    if obj is None:
+        return None
+
+    path = os.path.join(destination, "manifest.json")
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached["generation"] == obj.generation:
+            return cached["manifest"]
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    manifest = json.loads(download_from_gcs(DATA_BUCKET, MODEL_MANIFEST))
+    with open(path + ".download", "w") as f:
+        json.dump({"generation": obj.generation, "manifest": manifest}, f)
+    os.replace(path + ".download", path)
+    return manifest
+
+def _get_legacy_manifest(destination, filenames=None):
+    """Create a manifest for models stored before versioned models: pickled model dicts
+    directly under the model prefix.
+
+    Each legacy model is downloaded and converted to the compact format once and stored in
+    the local model directory, so worker processes memory map the converted files like any
+    other model file. The manifest is kept in the local directory along with the generations
+    of the legacy files, and reused while they are unchanged.
+
+    Serves the models of the last training run until the models are retrained.
+    Args:
+        destination (str): local model directory
+        filenames (list): names of the model files to use, defaults to all legacy model files
+    Return:
+        the manifest as a dict
+    """
+    objects = {
+        obj.name[len(MODEL_PREFIX):]: obj
+        for obj in storage.get_backend().list(DATA_BUCKET, prefix=MODEL_PREFIX)
+        if obj.name.endswith(".pkl") and "/" not in obj.name[len(MODEL_PREFIX):]
+    }
+    if filenames is not None:
+        objects = {filename: obj for filename, obj in objects.items() if filename in filenames}
+    if not objects:
+        raise RuntimeError(f"No models found at gs://{DATA_BUCKET}/{MODEL_PREFIX}, train the models first")
+
+    logger.warning("No model manifest found at gs://%s/%s, using legacy model files", DATA_BUCKET, MODEL_MANIFEST)
+    generations = {filename: obj.generation for filename, obj in objects.items()}
+    objects_dir = os.path.join(destination, "objects")
+    path = os.path.join(destination, "legacy_manifest.json")
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached["generations"] == generations and all(
+            _is_current(os.path.join(objects_dir, entry["sha256"]), entry) for entry in cached["manifest"]["files"].values()
+        ):
+            return cached["manifest"]
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    files = {}
+    names = [obj.name for obj in objects.values()]
+    for filename, name, data in zip(objects, names, download_many(DATA_BUCKET, names)):
+        if isinstance(data, Exception):
+            raise data
+
+        logger.info("Converting legacy model %s", filename)
+        data = markov_model.serialize(pickle.loads(data))
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = os.path.join(objects_dir, digest)
+        with open(object_path + ".download", "wb") as f:
+            f.write(data)
+        os.replace(object_path + ".download", object_path)
+        files[filename] = {"path": name, "size": len(data), "sha256": digest}
+
+    manifest = {"version": LEGACY_MODEL_VERSION, "files": files}
+    with open(path + ".download", "w") as f:
+        json.dump({"generations": generations, "manifest": manifest}, f)
+    os.replace(path + ".download", path)
+    return manifest
+
+def get_model_version():
+    """Get the generation of the current manifest. The generation changes
+    whenever a manifest is published.
+    Return:
+        the generation number of the manifest, or None if there is no manifest
+    """
+    obj = storage.get_backend().stat(DATA_BUCKET, MODEL_MANIFEST)
+    return obj.generation if obj else None
+
+def training_data_window():
+    """Describe the training data in the data bucket: the number of source files
+    and the range of dates they were parsed on.
+    Return:
+        a dict of the file count and the first and last date
+    """
+    dates = [
+        obj.name[len(TRAINING_DATA_PREFIX):].split("/")[0]
+        for obj in storage.get_backend().list(DATA_BUCKET, prefix=TRAINING_DATA_PREFIX)
+    ]
+    return {
+        "files": len(dates),
+        "first": min(dates, default=None),
+        "last": max(dates, default=None)
+    }
+
+def get_model_manifest(destination=LOCAL_MODEL_DIR, legacy_filenames=None):
+    """Get the manifest of the current models for loading them from the local model directory.
+
+    The local directory is a cache of files keyed by their hash, so files unchanged between
+    model versions are only downloaded once. A local copy of the manifest is validated with
+    a single metadata request. Files not in the current manifest are removed once they
+    have not been used for MODEL_FILE_GRACE_PERIOD, see download_model_files.
+
+    If no manifest has been published, the legacy model files directly under the model
+    prefix are used instead, see _get_legacy_manifest.
+
+    Args:
+        destination (str): local model directory
+        legacy_filenames (list): names of the legacy model files to use without a manifest,
+            defaults to all of them
+    Return:
+        the manifest as a dict
+    """
+    objects_dir = os.path.join(destination, "objects")
+    os.makedirs(objects_dir, exist_ok=True)
+
+    with open(os.path.join(destination, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = _get_cached_manifest(destination) or _get_legacy_manifest(destination, legacy_filenames)
+
+        # Files of other versions may still be mapped by other processes;
+        # their memory is released once unmapped. Recently used files may be
+        # about to be mapped by processes still using the previous manifest.
+        current = {entry["sha256"] for entry in manifest["files"].values()}
+        expired = time.time() - MODEL_FILE_GRACE_PERIOD
+        for entry in os.scandir(objects_dir):
+            if entry.name not in current and entry.stat().st_mtime <= expired:
+                os.remove(entry.path)
+
+    logger.info("Using models version %s from gs://%s/%s", manifest["version"], DATA_BUCKET, MODEL_PREFIX)
+    return manifest
+
+def download_model_files(manifest, names, destination=LOCAL_MODEL_DIR):
+    """Download model files listed in a manifest to the local model directory.
+
+    Files are downloaded concurrently and written directly to disk;
+    they are meant to be memory mapped rather than read into memory.
+
+    Downloads are guarded by a file lock so concurrent worker processes download
+    each file only once, and verified against the hashes in the manifest.
+    Files already in the local directory are not downloaded again, but their
+    modification time is updated to mark them as used.
+
+    Args:
+        manifest (dict): the manifest, see get_model_manifest
+        names (list): names of the files to download
+        destination (str): local model directory
+    Returns:
+        dict: A dictionary mapping the file names to local file paths as pathlib.Path.
+            Files that failed to download are left out.
+    """
+    objects_dir = os.path.join(destination, "objects")
+    os.makedirs(objects_dir, exist_ok=True)
+
+    files = {name: manifest["files"][name] for name in names}
+    paths = {name: os.path.join(objects_dir, entry["sha256"]) for name, entry in files.items()}
+
+    with open(os.path.join(destination, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        # Cached files never change: a complete local file is current.
+        stale = [name for name in files if not _is_current(paths[name], files[name])]
+        # Mark the files as used, so they are not removed before they are mapped
+        for name in files:
+            if name not in stale:
+                os.utime(paths[name])
+
+        # Download to temporary files and move in place once complete and verified.
+        name_path_pairs = [(files[name]["path"], paths[name] + ".download") for name in stale]
+        results = storage.get_backend().download_many(DATA_BUCKET, name_path_pairs)
+
+        for name, (_, download_path), result in zip(stale, name_path_pairs, results):
+            if not isinstance(result, Exception) and _sha256(download_path) != files[name]["sha256"]:
+                result = ValueError("hash mismatch")
+
+            if isinstance(result, Exception):
+                logger.error("Failed to download %s: %s", name, result)
+                paths.pop(name)
+                continue
+
+            os.replace(download_path, paths[name])
+
+    logger.info("Loaded %d model files, %d downloaded", len(paths), len(stale))
+    return {name: pathlib.Path(path) for name, path in paths.items()}
+
+def _is_current(path, entry):
+    """Check whether a local copy of a model file is complete."""
+    try:
+        return os.stat(path).st_size == entry["size"]
+    except FileNotFoundError:
+        return False
+
+def _sha256(path):
+    """Compute the SHA-256 hash of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 def list_image_bucket():
-    """List all blobs in the image bucket.
+    """List all images in the image bucket.
     Return:
-        a list of blobs
+        a list of storage.StoredObjects
     """
     # Always list the contents from the production bucket
     image_bucket = IMG_BUCKET.replace("dev_", "prod_")
     logger.info("Loading screenshots from gs://%s", image_bucket)
 
-    return list(gcs_client.list_blobs(image_bucket))
+    return storage.get_backend().list(image_bucket)
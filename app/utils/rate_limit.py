@@ -0,0 +1,194 @@
+# Client side rate limiting for HTTP APIs with a request quota.
+#
+# Requests are made concurrently from a thread pool, each worker taking a token from a
+# shared token bucket before a request. Rate limited (429) and server error responses
+# are retried with exponential backoff and full jitter; a 429 also pauses the bucket
+# so all workers back off together.
+
+import concurrent.futures
+import logging
+import random
+import threading
+import time
+
+import requests
+
+
+logger = logging.getLogger("app")
+
+# Response status codes worth retrying: rate limited or a transient server error
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Token bucket rate limiter shared between threads.
+
+    Tokens are added at a fixed rate up to a capacity and each request takes one,
+    waiting for the next token when the bucket is empty. The capacity allows a
+    short burst at full speed.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        """Args:
+            rate (float): tokens added per second
+            capacity (int): maximum number of tokens, and the initial number of tokens
+            clock (callable): monotonic clock in seconds
+            sleep (callable): sleep function, taking seconds
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._paused_until = self._updated
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_quota(cls, limit, window, burst=10, **kwargs):
+        """Create a bucket never exceeding limit requests in any window of seconds:
+        a full bucket plus the tokens added over a window is at most the limit.
+        Args:
+            limit (int): number of requests allowed per window
+            window (float): length of the window in seconds
+            burst (int): capacity of the bucket
+        Return:
+            the TokenBucket
+        """
+        if burst >= limit:
+            raise ValueError("burst must be smaller than the limit")
+        return cls((limit - burst) / window, burst, **kwargs)
+
+    def acquire(self):
+        """Take a token, waiting until one is available."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                # Tolerate rounding errors, which would otherwise wait for a vanishing fraction of a token
+                if now >= self._paused_until and self._tokens >= 1 - 1e-9:
+                    self._tokens = max(self._tokens - 1, 0)
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            self._sleep(wait)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a number of seconds. Tokens left in the bucket
+        are kept: with a large burst the base rate is slow, and resuming at it would
+        stall the requests left long after the pause.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._paused_until = max(self._paused_until, now + seconds)
+            # No tokens are added during the pause
+            self._updated = self._paused_until
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+
+class RateLimitedFetcher:
+    """Fetches JSON documents from an HTTP API with concurrent requests within
+    the rate limit of a TokenBucket.
+    """
+
+    def __init__(self, session, limiter, workers=4, max_retries=4, backoff=2.0, max_backoff=60.0, timeout=30):
+        """Args:
+            session (requests.Session): session shared by the workers
+            limiter (TokenBucket): limiter taken from before each request, including retries
+            workers (int): number of concurrent requests
+            max_retries (int): number of retries of a request before giving up
+            backoff (float): base delay of the exponential backoff in seconds
+            max_backoff (float): maximum delay between retries in seconds
+            timeout (float): request timeout in seconds
+        """
+        self.session = session
+        self.limiter = limiter
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        # Request counts for reporting
+        self.requests = 0
+        self.retries = 0
+        self._count_lock = threading.Lock()
+
+    def get_json(self, url, params=None):
+        """GET a JSON document, retrying rate limited and failed requests.
+        Args:
+            url (str): the URL
+            params (dict): query parameters, added to those of the session
+        Return:
+            the decoded JSON document
+        Raises:
+            requests.RequestException when the request fails after all retries
+            or with a status code not worth retrying.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            self._count("requests")
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                self._retry(attempt, f"{type(e).__name__} from {url}")
+                continue
+
+            if r.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                self._retry(attempt, f"{r.status_code} from {url}", r)
+                continue
+
+            r.raise_for_status()
+            return r.json()
+
+    def fetch_many(self, url, params_list):
+        """Fetch JSON documents concurrently. A failed request does not stop the others.
+        Args:
+            url (str): the URL
+            params_list (list): query parameters of each request
+        Return:
+            an iterator of (params, JSON document or exception) pairs, in the order
+            the requests complete
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.get_json, url, params): params for params in params_list}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    yield futures[future], e
+
+    def _retry(self, attempt, reason, response=None):
+        """Sleep before a retry: a random delay up to an exponentially growing
+        limit, at least as long as a Retry-After header requests.
+        """
+        self._count("retries")
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is not None:
+            delay = max(delay, _retry_after(response))
+            if response.status_code == 429:
+                # The quota is shared: slow down every worker, not just this one
+                self.limiter.pause(delay)
+
+        logger.warning("%s, retrying in %.1fs", reason, delay)
+        time.sleep(delay)
+
+    def _count(self, name):
+        with self._count_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+def _retry_after(response):
+    """Get the delay requested by a Retry-After header in seconds, or 0.
+    Only the delay-seconds form of the header is supported.
+    """
+    try:
+        return max(float(response.headers.get("Retry-After", 0)), 0)
+    except ValueError:
+        return 0
@@ -0,0 +1,305 @@
+# Storage backends for the data and image buckets.
+#
+# In production, training data, models and screenshots are stored in Google Cloud Storage.
+# The local directory and in-memory backends store the same objects without network
+# access: for serving models from a prebuilt local directory, for tests and for benchmarks.
+# The backend is selected with the STORAGE_BACKEND environment variable and created on
+# first use, so importing the app does not require Cloud Storage credentials.
+
+import abc
+import concurrent.futures
+import dataclasses
+import io
+import itertools
+import logging
+import os
+import pathlib
+import threading
+
+from google.api_core.exceptions import NotFound
+from google.cloud import storage as google_storage
+from google.cloud.storage import transfer_manager
+
+
+logger = logging.getLogger("app")
+
+# One of gcs, local or memory
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "gcs")
+# Root directory of the local backend; each bucket is a subdirectory
+LOCAL_STORAGE_DIR = os.environ.get("LOCAL_STORAGE_DIR", "storage")
+# Default number of concurrent requests of bulk operations
+MAX_WORKERS = int(os.environ.get("STORAGE_MAX_WORKERS", 8))
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+@dataclasses.dataclass(frozen=True)
+class StoredObject:
+    """Metadata of a stored object."""
+    bucket: str
+    name: str
+    size: int
+    # Changes whenever the object is overwritten
+    generation: int
+    public_url: str
+
+
+class StorageBackend(abc.ABC):
+    """Interface of a storage backend. Objects are addressed by a bucket and a name;
+    names may contain slashes to group objects by prefix. Reading a missing object
+    raises FileNotFoundError.
+
+    Bulk operations return a result per item rather than raising: the exception
+    raised for an item is returned in its place.
+    """
+
+    @abc.abstractmethod
+    def get(self, bucket, name):
+        """Get the contents of an object as bytes."""
+
+    @abc.abstractmethod
+    def put(self, bucket, name, data, content_type=None):
+        """Store bytes as an object, replacing any existing object."""
+
+    @abc.abstractmethod
+    def stat(self, bucket, name):
+        """Get the metadata of an object as a StoredObject, or None if it does not exist."""
+
+    @abc.abstractmethod
+    def list(self, bucket, prefix=""):
+        """List the objects with a name starting with prefix as StoredObjects."""
+
+    @abc.abstractmethod
+    def delete(self, bucket, name):
+        """Delete an object."""
+
+    def get_many(self, bucket, names, max_workers=None):
+        """Get the contents of objects concurrently.
+        Args:
+            names (list): names of the objects
+            max_workers (int): number of concurrent requests, defaults to MAX_WORKERS
+        Return:
+            a list of bytes or exceptions, in the order of names
+        """
+        return _map(lambda name: self.get(bucket, name), names, max_workers)
+
+    def put_many(self, bucket, items, content_type=None, max_workers=None):
+        """Store objects concurrently.
+        Args:
+            items (list): (name, data) pairs
+            content_type (str): content type of all objects
+            max_workers (int): number of concurrent requests, defaults to MAX_WORKERS
+        Return:
+            a list of None or exceptions, in the order of items
+        """
+        return _map(lambda item: self.put(bucket, *item, content_type=content_type), items, max_workers)
+
+    def download_many(self, bucket, name_path_pairs, max_workers=None):
+        """Download objects concurrently to local files.
+        Args:
+            name_path_pairs (list): (object name, local file path) pairs
+            max_workers (int): number of concurrent requests, defaults to MAX_WORKERS
+        Return:
+            a list of None or exceptions, in the order of name_path_pairs
+        """
+        def download(pair):
+            name, path = pair
+            with open(path, "wb") as f:
+                f.write(self.get(bucket, name))
+
+        return _map(download, name_path_pairs, max_workers)
+
+
+class GCSBackend(StorageBackend):
+    """Google Cloud Storage. Bucket handles are created once per bucket; objects
+    are accessed without bucket metadata requests. Bulk operations use the
+    transfer_manager module.
+    """
+
+    def __init__(self):
+        self.client = google_storage.Client()
+        self._buckets = {}
+
+    def get(self, bucket, name):
+        try:
+            return self._bucket(bucket).blob(name).download_as_bytes()
+        except NotFound:
+            raise FileNotFoundError(f"gs://{bucket}/{name}") from None
+
+    def put(self, bucket, name, data, content_type=None):
+        self._bucket(bucket).blob(name).upload_from_string(data, content_type=content_type)
+
+    def stat(self, bucket, name):
+        blob = self._bucket(bucket).get_blob(name)
+        return self._stored_object(blob) if blob else None
+
+    def list(self, bucket, prefix=""):
+        return [self._stored_object(blob) for blob in self.client.list_blobs(bucket, prefix=prefix)]
+
+    def delete(self, bucket, name):
+        try:
+            self._bucket(bucket).blob(name).delete()
+        except NotFound:
+            raise FileNotFoundError(f"gs://{bucket}/{name}") from None
+
+    def get_many(self, bucket, names, max_workers=None):
+        buffers = [io.BytesIO() for _ in names]
+        results = self._download_many(bucket, names, buffers, max_workers)
+        return [result or buffer.getvalue() for result, buffer in zip(results, buffers)]
+
+    def put_many(self, bucket, items, content_type=None, max_workers=None):
+        bucket = self._bucket(bucket)
+        return transfer_manager.upload_many(
+            [(io.BytesIO(data), bucket.blob(name)) for name, data in items],
+            upload_kwargs={"content_type": content_type},
+            max_workers=max_workers or MAX_WORKERS,
+            worker_type=transfer_manager.THREAD
+        )
+
+    def download_many(self, bucket, name_path_pairs, max_workers=None):
+        names = [name for name, _ in name_path_pairs]
+        return self._download_many(bucket, names, [path for _, path in name_path_pairs], max_workers)
+
+    def _download_many(self, bucket, names, destinations, max_workers):
+        """Download blobs to files or file objects with transfer_manager."""
+        bucket = self._bucket(bucket)
+        results = transfer_manager.download_many(
+            [(bucket.blob(name), destination) for name, destination in zip(names, destinations)],
+            max_workers=max_workers or MAX_WORKERS,
+            worker_type=transfer_manager.THREAD
+        )
+        return [
+            FileNotFoundError(f"gs://{bucket.name}/{name}") if isinstance(result, NotFound) else result
+            for name, result in zip(names, results)
+        ]
+
+    def _bucket(self, name):
+        """Get a cached bucket handle."""
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            bucket = self._buckets.setdefault(name, self.client.bucket(name))
+        return bucket
+
+    @staticmethod
+    def _stored_object(blob):
+        return StoredObject(blob.bucket.name, blob.name, blob.size, blob.generation, blob.public_url)
+
+
+class LocalBackend(StorageBackend):
+    """A local directory with a subdirectory per bucket."""
+
+    def __init__(self, root):
+        """Args:
+            root (str): root directory of the buckets
+        """
+        self.root = pathlib.Path(root)
+
+    def get(self, bucket, name):
+        return self._path(bucket, name).read_bytes()
+
+    def put(self, bucket, name, data, content_type=None):
+        path = self._path(bucket, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file so readers never see a partial object
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def stat(self, bucket, name):
+        path = self._path(bucket, name)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return StoredObject(bucket, name, stat.st_size, stat.st_mtime_ns, path.absolute().as_uri())
+
+    def list(self, bucket, prefix=""):
+        bucket_dir = self.root / bucket
+        names = sorted(
+            path.relative_to(bucket_dir).as_posix()
+            for path in bucket_dir.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+        )
+        return [self.stat(bucket, name) for name in names if name.startswith(prefix)]
+
+    def delete(self, bucket, name):
+        self._path(bucket, name).unlink()
+
+    def _path(self, bucket, name):
+        return self.root / bucket / name
+
+
+class MemoryBackend(StorageBackend):
+    """Objects kept in a dict. Thread safe."""
+
+    def __init__(self):
+        self.objects = {}
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def get(self, bucket, name):
+        with self._lock:
+            try:
+                return self.objects[bucket, name][0]
+            except KeyError:
+                raise FileNotFoundError(f"memory://{bucket}/{name}") from None
+
+    def put(self, bucket, name, data, content_type=None):
+        with self._lock:
+            self.objects[bucket, name] = (bytes(data), next(self._generations))
+
+    def stat(self, bucket, name):
+        with self._lock:
+            if (bucket, name) not in self.objects:
+                return None
+            return self._stored_object(bucket, name)
+
+    def list(self, bucket, prefix=""):
+        with self._lock:
+            names = sorted(name for b, name in self.objects if b == bucket and name.startswith(prefix))
+            return [self._stored_object(bucket, name) for name in names]
+
+    def delete(self, bucket, name):
+        with self._lock:
+            try:
+                del self.objects[bucket, name]
+            except KeyError:
+                raise FileNotFoundError(f"memory://{bucket}/{name}") from None
+
+    def _stored_object(self, bucket, name):
+        data, generation = self.objects[bucket, name]
+        return StoredObject(bucket, name, len(data), generation, f"memory://{bucket}/{name}")
+
+
+def get_backend():
+    """Return the storage backend selected by STORAGE_BACKEND, creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend(STORAGE_BACKEND)
+                logger.info("Using %s storage backend", STORAGE_BACKEND)
+    return _backend
+
+def create_backend(name):
+    """Create a storage backend by name: gcs, local or memory."""
+    if name == "gcs":
+        return GCSBackend()
+    if name == "local":
+        return LocalBackend(LOCAL_STORAGE_DIR)
+    if name == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown storage backend {name}")
+
+def _map(func, items, max_workers=None):
+    """Apply func to items in a thread pool, returning exceptions in place of results."""
+    def call(item):
+        try:
+            return func(item)
+        except Exception as e:
+            return e
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or MAX_WORKERS) as executor:
+        return list(executor.map(call, items))
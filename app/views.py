@@ -1,15 +1,21 @@
+import collections
 import logging
+import threading
+import time
 
 from flask import (
     abort,
     Flask,
     jsonify,
     render_template,
-    request
+    request,
+    Response
 )
 
+from app.utils import gcs
 from app.utils.verify_oidc import verify_oidc_token
 from app import (
+    description_pool,
     generate_description,
     parser,
     setup_gcs_models,
@@ -20,14 +26,132 @@ from app import (
 app = Flask(__name__)
 app.config.from_prefixed_env()
 
+logger = logging.getLogger("app")
+
 # Set the logging level to DEBUG if Flask is in debug mode.
 if app.debug:
-    logger = logging.getLogger("app")
     logger.setLevel(logging.DEBUG)
 
 
 # Initialize global variables for lazy loading
 generator = None
+pool = None
+generator_lock = threading.Lock()
+# Serialized seeded descriptions by model version and seed, least recently used first
+response_cache = collections.OrderedDict()
+response_cache_lock = threading.Lock()
+
+
+def get_generator():
+    """Return the shared DescriptionGenerator, creating it on first use.
+    Concurrent first requests wait for a single instance to be created.
+
+    If DESCRIPTION_POOL_SIZE is set, a pool of pre-generated descriptions
+    is started along with the generator. If MODEL_RELOAD_INTERVAL is set, a
+    background thread checks for new models at that interval in seconds.
+
+    Models not needed by every description are loaded in the background.
+    """
+    if generator is None:
+        with generator_lock:
+            if generator is None:
+                # Read the version before loading, so models published
+                # during loading are picked up by the next check.
+                reload_interval = app.config.get("MODEL_RELOAD_INTERVAL", 0)
+                version = gcs.get_model_version() if reload_interval > 0 else None
+
+                description_generator = generate_description.DescriptionGenerator(app.config)
+                _swap_generator(description_generator)
+                threading.Thread(
+                    target=preload_models, args=(description_generator,), name="model-preload", daemon=True
+                ).start()
+
+                if reload_interval > 0:
+                    threading.Thread(
+                        target=watch_models, args=(reload_interval, version), name="model-reloader", daemon=True
+                    ).start()
+    return generator
+
+def preload_models(description_generator):
+    """Load the models of a generator not loaded on startup."""
+    try:
+        description_generator.load_all()
+    except Exception:
+        logger.exception("Failed to preload models")
+
+def _swap_generator(description_generator):
+    """Replace the shared generator and its pool.
+    Requests in flight finish with the old generator; its models are released
+    once the last reference is gone.
+    """
+    global generator, pool
+    old_pool = pool
+
+    pool_size = app.config.get("DESCRIPTION_POOL_SIZE", 0)
+    new_pool = description_pool.DescriptionPool(description_generator, pool_size) if pool_size > 0 else None
+    generator, pool = description_generator, new_pool
+
+    if old_pool is not None:
+        old_pool.close()
+
+def watch_models(interval, version):
+    """Reload the models whenever the model version marker changes.
+    Args:
+        interval (int): seconds between checks
+        version (int): version of the currently loaded models
+    """
+    while True:
+        time.sleep(interval)
+        version = check_for_new_models(version)
+
+def check_for_new_models(version):
+    """Load new models off the request path and swap them in if the version has changed.
+    Args:
+        version (int): version of the currently loaded models
+    Return:
+        the version of the models in use after the check
+    """
+    try:
+        latest = gcs.get_model_version()
+        if latest is None or latest == version:
+            return version
+
+        logger.info("Loading new models, version %s", latest)
+        description_generator = generate_description.DescriptionGenerator(app.config)
+        description_generator.load_all()
+        _swap_generator(description_generator)
+        return latest
+    except Exception:
+        logger.exception("Failed to reload models")
+        return version
+
+
+def render_seeded_description(description_generator, seed):
+    """Generate and serialize the description for a seed.
+    Cached by model version and seed; the output for a seed only changes with the models.
+
+    Args:
+        description_generator (DescriptionGenerator): the generator of the request. A reload
+            may swap the shared generator during the request, so the version of the cache
+            key is taken from the generator that renders the description.
+        seed (int): the seed
+    Return:
+        the description as a JSON string
+    """
+    key = (description_generator.version, seed)
+    with response_cache_lock:
+        body = response_cache.get(key)
+        if body is not None:
+            response_cache.move_to_end(key)
+            return body
+
+    body = app.json.dumps(description_generator(seed=seed))
+    with response_cache_lock:
+        response_cache[key] = body
+        response_cache.move_to_end(key)
+        if len(response_cache) > app.config.get("RESPONSE_CACHE_SIZE", 1024):
+            response_cache.popitem(last=False)
+    return body
 
 
 @app.route("/")
@@ -36,20 +160,76 @@ def index():
 
 @app.route("/_generate")
 def generate_game_description():
-    """Endpoint for generating a description."""
+    """Endpoint for generating a description.
+
+    With an integer seed query parameter, the description is reproducible:
+    the same seed always gives the same description for a version of the models,
+    apart from the screenshots, which are selected from the current screenshot pool.
+    Seeded responses are cached and carry a weak ETag of the output version of the
+    generator and the seed, see DescriptionGenerator.version.
+    """
     # Only respond, if a custom header was set
     if "X-Button-Callback" in request.headers:
+        description_generator = get_generator()
 
-        # Instantiate a new generator if one doesn't already exist
-        global generator
-        if generator is None:
-            generator = generate_description.DescriptionGenerator(app.config)
+        seed = request.args.get("seed")
+        if seed is not None:
+            try:
+                seed = int(seed)
+            except ValueError:
+                abort(400, "Invalid seed")
 
-        description = generator()
+            body = render_seeded_description(description_generator, seed)
+            response = app.response_class(body, mimetype="application/json")
+            # Weak: screenshots come from the screenshot pool of each instance
+            response.set_etag(f"{description_generator.version}-{seed}", weak=True)
+            # Cacheable, but revalidate as the output changes with the models
+            response.cache_control.public = True
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+
+        if pool is not None:
+            description = pool.get()
+        else:
+            description = description_generator()
         return jsonify(description)
 
     abort(500, "Bad request")
 
+@app.route("/_generate_stream")
+@verify_oidc_token
+def generate_description_stream():
+    """Stream count descriptions as newline delimited JSON.
+
+    Descriptions are generated one at a time as the client reads the response,
+    so memory use does not depend on count. count is capped by STREAM_MAX_COUNT.
+    With an integer seed query parameter, description i is generated with seed + i.
+    """
+    max_count = app.config.get("STREAM_MAX_COUNT", 10_000)
+    try:
+        count = int(request.args["count"])
+    except (KeyError, ValueError):
+        abort(400, "Expected an integer count")
+
+    seed = request.args.get("seed")
+    if seed is not None:
+        try:
+            seed = int(seed)
+        except ValueError:
+            abort(400, "Invalid seed")
+
+    if not 0 < count <= max_count:
+        abort(400, f"count should be between 1 and {max_count}")
+
+    description_generator = get_generator()
+
+    def generate():
+        for i in range(count):
+            description = description_generator(seed=seed + i if seed is not None else None)
+            yield app.json.dumps(description) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
 @app.route("/_train", methods=["POST"])
 @verify_oidc_token
 def train_model():
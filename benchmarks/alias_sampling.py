@@ -0,0 +1,56 @@
+# Cost of sampling one successor for high fan-out keys, such as ("the", "game")
+# in the description model. Compares the legacy uniform random.choice(list(set)),
+# a linear time weighted random.choices and the alias table of the compact model.
+#
+# Usage:
+#   uv run python -m benchmarks.alias_sampling
+
+import argparse
+import random
+from collections import Counter
+
+from app.generator import markov_model
+from benchmarks import common
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--degrees", type=int, nargs="+", default=[2, 10, 100, 1000, 10_000],
+        help="successor counts of the synthetic keys"
+    )
+    arg_parser.add_argument("--words", type=int, default=500_000, help="size of the synthetic training corpus")
+    args = arg_parser.parse_args()
+
+    # Synthetic keys with Zipf distributed successor counts
+    keys = {}
+    for degree in args.degrees:
+        keys[("degree", str(degree))] = Counter({f"word{i}": 1000 // (i + 1) + 1 for i in range(degree)})
+
+    # The highest fan-out key of a trained model
+    model_dict = common.train_model(common.synthetic_corpus(args.words))
+    key = max(model_dict, key=lambda k: len(model_dict[k]))
+    keys[key] = model_dict[key]
+
+    model = markov_model.MarkovModel.from_dict(keys)
+
+    print(f"{'key':<24}{'degree':>8}{'choice(list(set))':>20}{'choices(weights)':>18}{'alias':>8}  (µs per sample)")
+    for key, counts in keys.items():
+        successors = set(counts)
+        words = list(counts)
+        weights = list(counts.values())
+        index = model.find_key(key)
+
+        timings = [
+            common.best_of(func, number=2000) * 10**6
+            for func in (
+                lambda: random.choice(list(successors)),
+                lambda: random.choices(words, weights),
+                lambda: model.sample_successor(index),
+            )
+        ]
+        print(f"{' '.join(key):<24}{len(counts):>8}{timings[0]:>20.2f}{timings[1]:>18.2f}{timings[2]:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
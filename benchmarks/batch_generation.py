@@ -0,0 +1,39 @@
+# Throughput of batched Generator.generate_many against a loop of Generator.generate calls.
+#
+# Usage:
+#   uv run python -m benchmarks.batch_generation
+
+import argparse
+import time
+
+from app.generator import generator, markov_model
+from benchmarks import common
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--words", type=int, default=500_000, help="size of the synthetic training corpus")
+    arg_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 100, 1000, 10_000], help="texts per batch")
+    arg_parser.add_argument("--size", type=int, default=15, help="requested text size")
+    args = arg_parser.parse_args()
+
+    g = generator.Generator(markov_model.serialize(common.train_model(common.synthetic_corpus(args.words))))
+    g.generate_many(1)  # warm up the NumPy views
+
+    print(f"{'texts':>8}{'complete':>10}{'generate words/s':>18}{'generate_many words/s':>23}")
+    for n in args.batch_sizes:
+        for complete_sentence in (False, True):
+            start = time.perf_counter()
+            words = sum(len(g.generate(size=args.size, complete_sentence=complete_sentence).split()) for _ in range(n))
+            loop_rate = words / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            texts = g.generate_many(n, size=args.size, complete_sentence=complete_sentence)
+            words = sum(len(text.split()) for text in texts)
+            batch_rate = words / (time.perf_counter() - start)
+
+            print(f"{n:>8}{str(complete_sentence):>10}{loop_rate:>18.0f}{batch_rate:>23.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Wall-clock time of uploading the files of a job one at a time vs. with a
+# single bulk upload:
+#   * parser: a batch of JSON descriptions,
+#   * training: the model files of a training run,
+#   * images: a screenshot and an artwork.
+#
+# Cloud Storage is simulated by an in-memory storage backend with a fixed
+# latency per request and a fixed bandwidth, see the options.
+#
+# Usage:
+#   uv run python -m benchmarks.bulk_upload
+
+import argparse
+import os
+import time
+
+from benchmarks import common
+
+
+def upload_serially(backend, items):
+    for name, data in items:
+        backend.put("bucket", name, data)
+
+def upload_in_bulk(backend, items, max_workers):
+    backend.put_many("bucket", items, max_workers=max_workers)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    arg_parser.add_argument("--bandwidth", type=float, default=50, help="MB per second per request")
+    arg_parser.add_argument("--workers", type=int, default=8, help="concurrent uploads")
+    args = arg_parser.parse_args()
+
+    jobs = {
+        "parser": [(f"train/{i}.json", os.urandom(20_000)) for i in range(150)],
+        "training": [("description.pkl", os.urandom(20 * 10**6))] + [(f"model_{i}.pkl", os.urandom(200_000)) for i in range(12)],
+        "images": [("screenshot.png", os.urandom(400_000)), ("art.png", os.urandom(400_000))],
+    }
+    backend = common.SimulatedBackend(args.latency, args.bandwidth * 10**6)
+
+    print(f"{'':<10}{'files':>6}{'MB':>8}{'serial':>10}{'bulk':>10}")
+    for name, items in jobs.items():
+        start = time.perf_counter()
+        upload_serially(backend, items)
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        upload_in_bulk(backend, items, args.workers)
+        bulk = time.perf_counter() - start
+
+        size = sum(len(data) for _, data in items) / 10**6
+        print(f"{name:<10}{len(items):>6}{size:>8.1f}{serial:>10.2f}{bulk:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Cold start time of loading the models: fetching the manifest, downloading
+# the model files and creating a Generator for each. Compares
+#   * no cache: every file downloaded into memory on each start,
+#   * cold cache: an empty local model directory,
+#   * warm cache: a current local model directory,
+#   * new version: a current local model directory after retraining, where
+#     only the description model changed.
+#
+# Cloud Storage is simulated by an in-memory storage backend with a fixed
+# latency per request and a fixed bandwidth, see the options.
+#
+# Usage:
+#   uv run python -m benchmarks.cold_start
+
+import argparse
+import hashlib
+import json
+import tempfile
+import time
+from unittest.mock import patch
+
+from app.generator import generator, markov_model
+from app.utils import gcs, storage
+from benchmarks import common
+
+
+def publish(backend, version, models):
+    """Upload models and their manifest to a simulated bucket."""
+    files = {}
+    for name, data in models.items():
+        path = f"{gcs.MODEL_PREFIX}{version}/{name}"
+        backend.put(gcs.DATA_BUCKET, path, data)
+        files[name] = {"path": path, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+    backend.put(gcs.DATA_BUCKET, gcs.MODEL_MANIFEST, json.dumps({"version": version, "files": files}).encode())
+
+def load_without_cache(backend):
+    """Download the manifest and every model file into memory."""
+    manifest = json.loads(backend.get(gcs.DATA_BUCKET, gcs.MODEL_MANIFEST))
+    paths = [entry["path"] for entry in manifest["files"].values()]
+    return [generator.Generator(data) for data in backend.get_many(gcs.DATA_BUCKET, paths)]
+
+def load_with_cache(destination):
+    """Download the model files to a local directory and memory map them."""
+    manifest = gcs.get_model_manifest(destination)
+    paths = gcs.download_model_files(manifest, manifest["files"], destination)
+    return [generator.Generator(path) for path in paths.values()]
+
+def timed(backend, func, *args):
+    backend.requests = 0
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start, backend.requests
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--latency", type=float, default=0.03, help="seconds per request")
+    arg_parser.add_argument("--bandwidth", type=float, default=100, help="MB per second per request")
+    arg_parser.add_argument("--words", type=int, default=1_000_000, help="size of the description training corpus")
+    args = arg_parser.parse_args()
+
+    # A large description model and small models for the other components,
+    # as the requirement models are
+    models = {"description.pkl": markov_model.serialize(common.train_model(common.synthetic_corpus(args.words)))}
+    for i, name in enumerate([
+        "names.pkl", "feature.pkl", "tagline.pkl", "requirements_OS.pkl", "requirements_Processor.pkl",
+        "requirements_Memory.pkl", "requirements_Graphics.pkl", "requirements_Storage.pkl",
+        "requirements_Sound_Card.pkl", "requirements_Additional_Notes.pkl"
+    ]):
+        models[name] = markov_model.serialize(common.train_model(common.synthetic_corpus(20_000, seed=i + 1)))
+    print(f"{len(models)} models, {sum(map(len, models.values())) / 10**6:.1f}MB")
+
+    backend = common.SimulatedBackend(args.latency, args.bandwidth * 10**6)
+    publish(backend, "v1", models)
+
+    print(f"{'':<14}{'seconds':>10}{'requests':>10}")
+    with (
+        patch.object(storage, "get_backend", return_value=backend),
+        tempfile.TemporaryDirectory() as destination
+    ):
+        results = {
+            "no cache": timed(backend, load_without_cache, backend),
+            "cold cache": timed(backend, load_with_cache, destination),
+            "warm cache": timed(backend, load_with_cache, destination),
+        }
+
+        models["description.pkl"] = markov_model.serialize(
+            common.train_model(common.synthetic_corpus(args.words, seed=100))
+        )
+        publish(backend, "v2", models)
+        results["new version"] = timed(backend, load_with_cache, destination)
+
+    for name, (seconds, requests) in results.items():
+        print(f"{name:<14}{seconds:>10.3f}{requests:>10}")
+
+
+if __name__ == "__main__":
+    main()
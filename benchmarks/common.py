@@ -0,0 +1,116 @@
+# Shared helpers for the benchmark scripts.
+#
+# Benchmarks run offline against a synthetic training corpus so results are
+# reproducible without access to the Cloud Storage buckets.
+
+import itertools
+import random
+import threading
+import time
+
+import numpy as np
+
+from app.generator import trainer
+from app.utils import data_files, storage
+
+try:
+    import spacy
+except ImportError:
+    spacy = None
+
+
+def synthetic_corpus(num_words, vocab_size=50_000, sentence_length=12, seed=0):
+    """Create a synthetic training text with a Zipf distributed vocabulary.
+
+    Words are drawn from the nltk POS map so the vocabulary has realistic word
+    lengths, and a sentence terminator is added on average every sentence_length words.
+
+    Args:
+        num_words (int): number of words to generate
+        vocab_size (int): number of distinct words to draw from
+        sentence_length (int): average number of words per sentence
+        seed (int): random seed
+    Return:
+        the corpus as a single string
+    """
+    rng = random.Random(seed)
+    vocabulary = sorted({word for words in data_files.POS_MAP.values() for word in words if word.isalpha()})
+    vocabulary = rng.sample(vocabulary, min(vocab_size, len(vocabulary)))
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    words = rng.choices(vocabulary, cum_weights=list(itertools.accumulate(weights)), k=num_words)
+    for i in range(0, num_words, sentence_length):
+        i += rng.randrange(sentence_length)
+        if i < num_words:
+            words[i] += rng.choice(".!?")
+
+    return " ".join(words)
+
+def train_model(text, n=3):
+    """Train a model dict from text."""
+    t = trainer.Trainer(text, "benchmark.pkl", n=n)
+    t.train()
+    return t.model
+
+def synthetic_pipeline(words, dimensions=300, seed=0):
+    """Create a blank spaCy pipeline with random vectors for words.
+    Stands in for en_core_web_md when it is not installed.
+    """
+    pipeline = spacy.blank("en")
+    rng = np.random.default_rng(seed)
+    for word in words:
+        pipeline.vocab.set_vector(word, rng.standard_normal(dimensions).astype(np.float32))
+    return pipeline
+
+def best_of(func, repeat=5, number=1):
+    """Time func and return the best average time per call in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+class SimulatedBackend(storage.MemoryBackend):
+    """In-memory storage backend simulating Cloud Storage with a fixed latency
+    per request and a fixed bandwidth per request.
+    """
+
+    def __init__(self, latency, bandwidth):
+        """Args:
+            latency (float): seconds per request
+            bandwidth (float): bytes per second per request
+        """
+        super().__init__()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self._requests_lock = threading.Lock()
+
+    def request(self, size=0):
+        with self._requests_lock:
+            self.requests += 1
+        time.sleep(self.latency + size / self.bandwidth)
+
+    def get(self, bucket, name):
+        data = super().get(bucket, name)
+        self.request(len(data))
+        return data
+
+    def put(self, bucket, name, data, content_type=None):
+        self.request(len(data))
+        super().put(bucket, name, data, content_type)
+
+    def stat(self, bucket, name):
+        self.request()
+        return super().stat(bucket, name)
+
+    def list(self, bucket, prefix=""):
+        self.request()
+        return super().list(bucket, prefix)
+
+    def delete(self, bucket, name):
+        self.request()
+        super().delete(bucket, name)
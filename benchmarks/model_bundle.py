@@ -0,0 +1,88 @@
+# Time to download and load the serving models as separate model files vs. a
+# single model bundle, uncompressed and zstd compressed. Reports the time spent
+# downloading, decompressing and creating a Generator for each model.
+#
+# Cloud Storage is simulated by an in-memory storage backend with a fixed
+# latency per request and a fixed bandwidth. Per request latency dominates for
+# the many small system requirement models.
+#
+# Usage:
+#   uv run python -m benchmarks.model_bundle
+
+import argparse
+import time
+
+from app.generator import generator, markov_model, model_bundle
+from benchmarks import common
+
+
+BUCKET = "models"
+
+
+def load_files(backend, names):
+    """Download each model file with concurrent requests and load the models."""
+    start = time.perf_counter()
+    models = backend.get_many(BUCKET, names)
+    downloaded = time.perf_counter()
+
+    for data in models:
+        generator.Generator(data)
+    return downloaded - start, 0.0, time.perf_counter() - downloaded
+
+def load_bundle(backend, name):
+    """Download a bundle and load the models carved out of it."""
+    start = time.perf_counter()
+    bundle = model_bundle.ModelBundle(backend.get(BUCKET, name))
+    downloaded = time.perf_counter()
+
+    models = [bundle.get(model) for model in bundle]
+    decompressed = time.perf_counter()
+
+    for data in models:
+        generator.Generator(data)
+    return downloaded - start, decompressed - downloaded, time.perf_counter() - decompressed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--latency", type=float, default=0.03, help="seconds per request")
+    arg_parser.add_argument("--bandwidth", type=float, default=100, help="MB per second per request")
+    arg_parser.add_argument("--words", type=int, default=1_000_000, help="size of the description training corpus")
+    args = arg_parser.parse_args()
+
+    # A large description model and small models for the other components
+    models = {"description.pkl": markov_model.serialize(common.train_model(common.synthetic_corpus(args.words)))}
+    for i, name in enumerate([
+        "names.pkl", "feature.pkl", "tagline.pkl", "requirements_OS.pkl", "requirements_Processor.pkl",
+        "requirements_Memory.pkl", "requirements_Graphics.pkl", "requirements_Storage.pkl",
+        "requirements_Sound_Card.pkl", "requirements_Additional_Notes.pkl"
+    ]):
+        models[name] = markov_model.serialize(common.train_model(common.synthetic_corpus(20_000, seed=i + 1)))
+
+    backend = common.SimulatedBackend(args.latency, args.bandwidth * 10**6)
+    backend.put_many(BUCKET, list(models.items()))
+    backend.put(BUCKET, "models.bundle", model_bundle.pack(models))
+
+    scenarios = {"model files": lambda: load_files(backend, list(models)), "bundle": lambda: load_bundle(backend, "models.bundle")}
+    sizes = {"model files": sum(map(len, models.values())), "bundle": len(backend.objects[BUCKET, "models.bundle"][0])}
+    if model_bundle.zstandard is not None:
+        backend.put(BUCKET, "models.zstd.bundle", model_bundle.pack(models, compression="zstd"))
+        scenarios["bundle, zstd"] = lambda: load_bundle(backend, "models.zstd.bundle")
+        sizes["bundle, zstd"] = len(backend.objects[BUCKET, "models.zstd.bundle"][0])
+    else:
+        print("zstandard is not installed; skipping the compressed bundle")
+
+    print(f"{len(models)} models")
+    print(f"{'':<14}{'MB':>8}{'requests':>10}{'download':>10}{'decompress':>12}{'load':>8}{'total':>8}")
+    for name, load in scenarios.items():
+        backend.requests = 0
+        # Best of 3 runs by total time
+        download, decompress, load_time = min((load() for _ in range(3)), key=sum)
+        print(
+            f"{name:<14}{sizes[name] / 10**6:>8.1f}{backend.requests // 3:>10}{download:>10.3f}"
+            f"{decompress:>12.3f}{load_time:>8.3f}{download + decompress + load_time:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
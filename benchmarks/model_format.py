@@ -0,0 +1,87 @@
+# Compare the compact MarkovModel format against the legacy pickled dict-of-sets
+# format: serialized size, load time, resident memory and word sampling speed.
+#
+# Usage:
+#   uv run python -m benchmarks.model_format --words 2000000
+
+import argparse
+import gc
+import pickle
+import random
+import tracemalloc
+
+from app.generator import generator, markov_model
+from benchmarks import common
+
+
+def legacy_get_word(model, key):
+    """The dict-of-sets sampling step as implemented before the compact format."""
+    choices = model[key]
+    if len(choices) == 1:
+        next_word = next(iter(choices))
+    else:
+        next_word = random.choice(list(choices))
+
+    key = (*key[1:], next_word)
+    if key not in model:
+        key = random.choice(list(model))
+    return next_word, key
+
+def measure_memory(func):
+    """Return the result of func and the memory it left allocated in MB."""
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / 10**6
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--words", type=int, default=1_000_000, help="size of the synthetic training corpus")
+    arg_parser.add_argument("--samples", type=int, default=200_000, help="number of words to sample")
+    args = arg_parser.parse_args()
+
+    model_dict = common.train_model(common.synthetic_corpus(args.words))
+    # Models before the compact format were dicts of successor sets; train_model
+    # counts successors for the weighted sampling of the compact format
+    legacy_data = pickle.dumps({key: set(successors) for key, successors in model_dict.items()})
+    compact_data = markov_model.serialize(model_dict)
+    del model_dict
+
+    print(f"keys: {len(pickle.loads(legacy_data))}")
+    print(f"{'':<10}{'size MB':>10}{'load ms':>10}{'memory MB':>12}{'words/s':>12}")
+
+    legacy_model, legacy_memory = measure_memory(lambda: pickle.loads(legacy_data))
+    legacy_load = common.best_of(lambda: pickle.loads(legacy_data), repeat=3)
+
+    def sample_legacy():
+        key = next(iter(legacy_model))
+        for _ in range(args.samples):
+            _, key = legacy_get_word(legacy_model, key)
+
+    legacy_rate = args.samples / common.best_of(sample_legacy, repeat=3)
+    print(f"{'legacy':<10}{len(legacy_data) / 10**6:>10.2f}{legacy_load * 1000:>10.1f}{legacy_memory:>12.2f}{legacy_rate:>12.0f}")
+    del legacy_model
+
+    g, compact_memory = measure_memory(lambda: generator.Generator(compact_data))
+    compact_load = common.best_of(lambda: markov_model.MarkovModel(compact_data), repeat=3)
+
+    def sample_compact():
+        state = g.new_state()
+        for _ in range(args.samples):
+            g.get_word(state)
+
+    compact_rate = args.samples / common.best_of(sample_compact, repeat=3)
+    print(f"{'compact':<10}{len(compact_data) / 10**6:>10.2f}{compact_load * 1000:>10.1f}{compact_memory:>12.2f}{compact_rate:>12.0f}")
+
+    # The compact model is a view over the serialized buffer; count the buffer as its memory
+    # when comparing against the unpickled dict.
+    print(f"\ncompact resident memory including the buffer: {(compact_memory + len(compact_data) / 10**6):.2f}MB")
+
+    _, sampling_allocations = measure_memory(sample_compact)
+    print(f"memory retained after sampling {args.samples} words: {sampling_allocations:.3f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Per-call latency of choosing a random restart key and looking up a seed key
+# as the model grows. Compares the legacy dict model, which copies all keys to
+# a list on every call, against the key array of the compact model.
+#
+# Usage:
+#   uv run python -m benchmarks.restart_latency
+
+import argparse
+import random
+
+from app.generator import markov_model
+from benchmarks import common
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+        help="synthetic corpus sizes in words"
+    )
+    args = arg_parser.parse_args()
+
+    print(f"{'keys':>10}{'legacy restart':>16}{'legacy seed':>14}{'restart':>10}{'seed':>10}  (µs per call)")
+    for size in args.sizes:
+        model_dict = common.train_model(common.synthetic_corpus(size))
+        model = markov_model.MarkovModel.from_dict(model_dict)
+        seed = " ".join(random.choice(list(model_dict)))
+
+        def legacy_restart():
+            return random.choice(list(model_dict))
+
+        def legacy_seed():
+            key_length = len(list(model_dict.keys())[0])
+            key = tuple(seed.split()[-key_length:])
+            return key in model_dict
+
+        def restart():
+            return model.random_key()
+
+        def seed_lookup():
+            key = tuple(seed.split()[-model.key_length:])
+            return model.find_key(key)
+
+        timings = [
+            common.best_of(func, number=number) * 10**6
+            for func, number in (
+                (legacy_restart, 20),
+                (legacy_seed, 20),
+                (restart, 10_000),
+                (seed_lookup, 10_000)
+            )
+        ]
+        print(f"{len(model_dict):>10}{timings[0]:>16.1f}{timings[1]:>14.1f}{timings[2]:>10.2f}{timings[3]:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
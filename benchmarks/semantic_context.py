@@ -0,0 +1,125 @@
+# Cost of semantic context matching, per generated word as the number of
+# successors grows, and per request for the paragraphs of a description.
+# Compares the legacy spaCy similarity search of common.get_closest_word_match,
+# the precomputed word vector table and the precomputed genre table.
+#
+# Uses the en_core_web_md pipeline if installed. Otherwise, a blank spaCy pipeline
+# with random vectors is used: similarity inference of the real pipeline is
+# slower still, as it also runs its tagger and lemmatizer for every doc.
+#
+# Usage:
+#   uv run python -m benchmarks.semantic_context
+
+import argparse
+import random
+import time
+import warnings
+from unittest.mock import patch
+
+import numpy as np
+
+from app import nlp
+from app.generator import generator, markov_model, word_vectors
+from app.utils import common as app_common, data_files
+from benchmarks import common
+
+
+def legacy_similarity(pipeline):
+    """Patch common.get_closest_word_match to use a pipeline."""
+    patcher = patch.object(app_common, "nlp", pipeline)
+    patcher.start()
+    # Successors such as "!" have no vector
+    warnings.filterwarnings("ignore", message=r"\[W008\]")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--degrees", type=int, nargs="+", default=[2, 10, 100, 1000], help="successor counts of the keys")
+    arg_parser.add_argument("--words", type=int, default=300_000, help="size of the synthetic training corpus")
+    arg_parser.add_argument("--requests", type=int, default=20, help="number of requests to time")
+    args = arg_parser.parse_args()
+
+    model_data = markov_model.serialize(common.train_model(common.synthetic_corpus(args.words)))
+    model = markov_model.MarkovModel(model_data)
+    vocabulary = [model.word(token_id) for token_id in range(model.vocab_size)]
+    genres = list(data_files.GENRES["Primary"])
+
+    pipeline = nlp
+    if pipeline is None and common.spacy is not None:
+        print("en_core_web_md not installed, using a blank spaCy pipeline with random vectors")
+        pipeline = common.synthetic_pipeline(vocabulary + genres)
+
+    if pipeline is not None:
+        start = time.perf_counter()
+        vectors = word_vectors.export_word_vectors(model, pipeline)
+        seconds = time.perf_counter() - start
+        print(f"Exported {vectors.shape[0]} x {vectors.shape[1]} vectors in {seconds:.2f}s ({vectors.nbytes / 10**6:.1f}MB)")
+        legacy_similarity(pipeline)
+    else:
+        print("spaCy not installed, skipping the legacy comparison; using random vectors")
+        vectors = np.random.default_rng(0).standard_normal((model.vocab_size, 300)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    genre_table = word_vectors.export_genre_table(model, vectors, genres, pipeline)
+    seconds = time.perf_counter() - start
+    table_size = genre_table.edges.nbytes + genre_table.hubs.nbytes
+    print(f"Exported genre table of {len(genre_table.hubs)} keys in {seconds:.2f}s ({table_size / 10**6:.1f}MB)")
+
+    generators = {
+        "spaCy similarity": generator.Generator(model_data) if pipeline is not None else None,
+        "vector table": generator.Generator(model_data, vectors=vectors),
+        "genre table": generator.Generator(model_data, genre_table=genre_table),
+    }
+    contexts = {
+        name: g.semantic_context(genres[0])
+        for name, g in generators.items() if g is not None
+    }
+
+    # Keys with the successor count closest to each requested degree
+    degrees = np.diff(model.arrays.successor_offsets)
+
+    print()
+    print("".join(f"{column:>18}" for column in ["degree", *generators]) + "  (µs per word)")
+    for target in args.degrees:
+        index = int(np.abs(degrees - target).argmin())
+        state = generator.GenerationState(index)
+
+        timings = []
+        for name, g in generators.items():
+            if g is None:
+                timings.append(float("nan"))
+                continue
+
+            def match():
+                state.key_index = index
+                g.get_word(state, contexts[name])
+
+            number = max(1, 2000 // int(degrees[index])) if name == "spaCy similarity" else 200
+            timings.append(common.best_of(match, repeat=3, number=number) * 10**6)
+
+        print(f"{degrees[index]:>18}" + "".join(f"{timing:>18.1f}" for timing in timings))
+
+    # Description paragraphs of a request: 1-2 paragraphs of ~15 words
+    # with sentence completion, generated with the genre as context.
+    print()
+    print(f"{'':>18}{'p50':>10}{'p99':>10}  (ms per request)")
+    for name, g in [("no context", generators["vector table"]), *generators.items()]:
+        if g is None:
+            continue
+        rng = random.Random(0)
+        timings = []
+        for _ in range(args.requests):
+            genre = rng.choice(genres)
+            start = time.perf_counter()
+            context = g.semantic_context(genre) if name != "no context" else None
+            for _ in range(rng.randint(1, 2)):
+                g.generate(size=int(abs(rng.gauss(15, 3))), complete_sentence=True, context=context, state=g.new_state(rng))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        p50, p99 = np.percentile(timings, [50, 99])
+        print(f"{name:>18}{p50:>10.2f}{p99:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
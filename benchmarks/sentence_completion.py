@@ -0,0 +1,66 @@
+# Word count and latency distribution of Generator.generate(complete_sentence=True)
+# before and after steering towards sentence ends with a step budget.
+# "before" reproduces the previous unbounded completion loop.
+#
+# Usage:
+#   uv run python -m benchmarks.sentence_completion
+
+import argparse
+import statistics
+import time
+
+from app.generator import generator, markov_model
+from benchmarks import common
+
+
+def complete_sentence_unbounded(g, size):
+    """Sentence completion as implemented before the distance table."""
+    state = g.new_state()
+    words = [g.get_word(state) for _ in range(size)]
+    while True:
+        word = g.get_word(state)
+        words.append(word)
+        if word.endswith(markov_model.SENTENCE_TERMINALS):
+            break
+        if word.lower() in ("and", "for", "but"):
+            words.pop()
+            break
+    return words
+
+def percentiles(values):
+    quantiles = statistics.quantiles(values, n=100)
+    return quantiles[49], quantiles[98], max(values)
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--words", type=int, default=500_000, help="size of the synthetic training corpus")
+    arg_parser.add_argument("--sentence-length", type=int, default=30, help="average sentence length of the corpus")
+    arg_parser.add_argument("--size", type=int, default=15, help="requested text size")
+    arg_parser.add_argument("--samples", type=int, default=5000, help="number of texts to generate")
+    args = arg_parser.parse_args()
+
+    text = common.synthetic_corpus(args.words, sentence_length=args.sentence_length)
+    g = generator.Generator(markov_model.serialize(common.train_model(text)))
+
+    def before():
+        return complete_sentence_unbounded(g, args.size)
+
+    def after():
+        return g.generate(size=args.size, complete_sentence=True).split()
+
+    print(f"{'':<8}{'words p50':>10}{'p99':>6}{'max':>6}{'latency p50':>13}{'p99':>8}{'max':>8}  (µs)")
+    for name, func in (("before", before), ("after", after)):
+        word_counts = []
+        latencies = []
+        for _ in range(args.samples):
+            start = time.perf_counter()
+            word_counts.append(len(func()))
+            latencies.append((time.perf_counter() - start) * 10**6)
+
+        words_p50, words_p99, words_max = percentiles(word_counts)
+        latency_p50, latency_p99, latency_max = percentiles(latencies)
+        print(f"{name:<8}{words_p50:>10.0f}{words_p99:>6.0f}{words_max:>6}{latency_p50:>13.0f}{latency_p99:>8.0f}{latency_max:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Hit rate and request latency of the similarity cache of
+# common.get_closest_word_match under ENABLE_SEMANTIC_CONTEXT traffic without
+# exported word vectors: each request generates 1-2 description paragraphs with
+# a random primary genre as context.
+#
+# Uses the en_core_web_md pipeline if installed, otherwise a blank spaCy
+# pipeline with random vectors. Requires spaCy.
+#
+# Usage:
+#   uv run python -m benchmarks.similarity_cache
+
+import argparse
+import random
+import time
+import warnings
+from unittest.mock import patch
+
+import numpy as np
+
+from app import nlp
+from app.generator import generator, markov_model
+from app.utils import common as app_common, data_files
+from benchmarks import common
+
+
+def run_requests(g, genres, num_requests, rng):
+    """Time a number of requests and return the latencies in milliseconds."""
+    timings = []
+    for _ in range(num_requests):
+        genre = rng.choice(genres)
+        start = time.perf_counter()
+        for _ in range(rng.randint(1, 2)):
+            g.generate(size=int(abs(rng.gauss(15, 3))), complete_sentence=True, context=genre, state=g.new_state(rng))
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--words", type=int, default=300_000, help="size of the synthetic training corpus")
+    arg_parser.add_argument("--requests", type=int, default=1000, help="number of requests to run")
+    arg_parser.add_argument("--window", type=int, default=100, help="number of requests per reported window")
+    args = arg_parser.parse_args()
+
+    if common.spacy is None:
+        print("spaCy not installed, nothing to benchmark")
+        return
+
+    g = generator.Generator(markov_model.serialize(common.train_model(common.synthetic_corpus(args.words))))
+    genres = list(data_files.GENRES["Primary"])
+
+    pipeline = nlp
+    if pipeline is None:
+        print("en_core_web_md not installed, using a blank spaCy pipeline with random vectors")
+        pipeline = common.synthetic_pipeline([g.model.word(token_id) for token_id in range(g.model.vocab_size)] + genres)
+
+    rng = random.Random(0)
+    # Successors such as "!" have no vector
+    warnings.filterwarnings("ignore", message=r"\[W008\]")
+    with patch.object(app_common, "nlp", pipeline):
+        # Without the cache: the wrapped functions are called directly
+        with patch.object(app_common, "_similarity", app_common._similarity.__wrapped__), \
+                patch.object(app_common, "_vector", app_common._vector.__wrapped__):
+            uncached = run_requests(g, genres, args.window, rng)
+
+        print(f"cache size: {app_common.SIMILARITY_CACHE_SIZE}")
+        print(f"{'requests':>12}{'hit rate':>10}{'p50':>10}{'p99':>10}  (ms per request)")
+        p50, p99 = np.percentile(uncached, [50, 99])
+        print(f"{'no cache':>12}{'':>10}{p50:>10.2f}{p99:>10.2f}")
+
+        for window in range(0, args.requests, args.window):
+            before = app_common.similarity_cache_info()["similarity"]
+            timings = run_requests(g, genres, args.window, rng)
+            after = app_common.similarity_cache_info()["similarity"]
+
+            hits = after.hits - before.hits
+            lookups = hits + after.misses - before.misses
+            p50, p99 = np.percentile(timings, [50, 99])
+            print(f"{window + args.window:>12}{hits / max(lookups, 1):>10.1%}{p50:>10.2f}{p99:>10.2f}")
+
+    print(app_common.similarity_cache_info())
+
+
+if __name__ == "__main__":
+    main()
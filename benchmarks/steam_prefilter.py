@@ -0,0 +1,90 @@
+# Yield of valid descriptions per Steam API request when parsing a batch of
+# descriptions from random candidate app ids directly vs. prefiltered with
+# bulk price_overview queries. Requests, not time, are the scarce resource:
+# the API allows about 200 requests per 5 minutes.
+#
+# The API is simulated by a local stub server where a fraction of the candidate
+# ids exist, and a fraction of those have a usable English description, see the
+# options. The rate limit is lifted for the benchmark; the time the requests
+# would take at the rate limit is reported instead.
+#
+# Usage:
+#   uv run python -m benchmarks.steam_prefilter
+
+import argparse
+import random
+from unittest.mock import patch
+
+from app import parser
+from app.utils import storage
+from tests.stub_server import StubServer
+
+
+def stub_api(density, valid, seed=0):
+    """Create a handler for the stub server simulating the appdetails endpoint."""
+    def exists(app_id):
+        return random.Random(f"{seed}-{app_id}").random() < density
+
+    def app_details(app_id):
+        rng = random.Random(f"{seed}-{app_id}-details")
+        return {
+            "type": "game",
+            "name": f"Game {app_id}",
+            "steam_appid": int(app_id),
+            "detailed_description": "<strong>A game.</strong>" if rng.random() < valid else "",
+            "supported_languages": "English",
+            "pc_requirements": {"minimum": "<ul><li>OS: Windows 10</li></ul>"},
+            "mac_requirements": [],
+            "linux_requirements": [],
+            "ratings": None,
+        }
+
+    def handler(path, query):
+        app_ids = query["appids"].split(",")
+        if query.get("filters") == "price_overview":
+            return 200, {app_id: {"success": exists(app_id), "data": []} for app_id in app_ids}
+        app_id = app_ids[0]
+        if not exists(app_id):
+            return 200, {app_id: {"success": False}}
+        return 200, {app_id: {"success": True, "data": app_details(app_id)}}
+
+    return handler
+
+def run(handler, batch_size, prefilter):
+    """Parse a batch against the stub server.
+    Return:
+        the number of requests made and the number of descriptions uploaded
+    """
+    backend = storage.MemoryBackend()
+    with (
+        StubServer(handler) as server,
+        patch.object(parser, "API_ENDPOINT", server.url),
+        patch.object(parser, "RATE_LIMIT", 10**9),
+        patch.object(storage, "get_backend", return_value=backend),
+    ):
+        parser.upload_description_batch(batch_size, prefilter=prefilter)
+    return len(server.requests), len(backend.objects)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--batch-size", type=int, default=150, help="app details requests per batch")
+    arg_parser.add_argument("--density", type=float, default=0.15, help="fraction of candidate ids that are apps")
+    arg_parser.add_argument("--valid", type=float, default=0.7, help="fraction of apps with a usable description")
+    args = arg_parser.parse_args()
+
+    handler = stub_api(args.density, args.valid)
+    seconds_per_request = parser.RATE_LIMIT_WINDOW / parser.RATE_LIMIT
+
+    print(f"{'':<12}{'requests':>10}{'descriptions':>14}{'per request':>13}{'minutes at limit':>18}")
+    for name, prefilter in (("random ids", False), ("prefiltered", True)):
+        random.seed(0)
+        requests_made, descriptions = run(handler, args.batch_size, prefilter)
+        print(
+            f"{name:<12}{requests_made:>10}{descriptions:>14}{descriptions / requests_made:>13.2f}"
+            f"{requests_made * seconds_per_request / 60:>18.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""A local HTTP server for testing API clients without network access."""
+
+import http.server
+import json
+import threading
+import urllib.parse
+
+
+class StubServer:
+    """HTTP server answering GET requests with a handler function in a background thread.
+
+    The handler is called with the request path and a dict of query parameters and
+    returns a (status code, JSON document) pair, or a (status code, JSON document,
+    headers) triple. Requests are recorded in requests as (path, query) pairs.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class RequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                with stub._lock:
+                    stub.requests.append((url.path, query))
+
+                status, document, *headers = stub.handler(url.path, query)
+                body = json.dumps(document).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers[0] if headers else {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,55 @@
+import itertools
+import time
+from unittest.mock import patch
+
+from app import description_pool
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_pool_is_filled_to_size():
+    """The pool should be filled up to its size and refilled after use."""
+    counter = itertools.count()
+    pool = description_pool.DescriptionPool(lambda: next(counter), size=3)
+
+    wait_for(lambda: pool.stats()["depth"] == 3)
+    assert pool.get() == 0
+    assert pool.get() == 1
+
+    wait_for(lambda: pool.stats()["depth"] == 3)
+    stats = pool.stats()
+    assert stats["generated"] == 5
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (2, 0, 1.0)
+
+def test_empty_pool_generates_inline():
+    """Descriptions should be generated inline when the pool is empty."""
+    def generate():
+        time.sleep(0.05)
+        return "description"
+
+    pool = description_pool.DescriptionPool(generate, size=1)
+
+    assert pool.get() == "description"
+    stats = pool.stats()
+    assert stats["misses"] == 1
+
+def test_generation_errors_do_not_stop_the_pool():
+    """The producer should keep filling the pool after a failed generation."""
+    results = iter([RuntimeError("failed"), "description"])
+
+    def generate():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    with patch.object(description_pool, "ERROR_BACKOFF", 0):
+        pool = description_pool.DescriptionPool(generate, size=1)
+        wait_for(lambda: pool.stats()["depth"] == 1)
+
+    assert pool.get() == "description"
@@ -0,0 +1,21 @@
+import gzip
+import json
+from unittest.mock import patch
+
+with patch("google.cloud.storage.Client"):
+    from app.tools import export_descriptions
+
+
+class SeededDescriptionGenerator:
+    def __call__(self, seed=None):
+        return {"seed": seed}
+
+
+def test_export_descriptions_in_order(tmp_path):
+    """Descriptions generated by worker processes should be written in seed order."""
+    path = tmp_path / "descriptions.jsonl.gz"
+    with patch("app.generate_description.screenshot_pool", []):
+        export_descriptions.export_descriptions(SeededDescriptionGenerator(), 100, path, workers=3, seed=5)
+
+    with gzip.open(path, "rt") as f:
+        assert [json.loads(line)["seed"] for line in f] == list(range(5, 105))
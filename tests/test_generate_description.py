@@ -1,4 +1,6 @@
+import concurrent.futures
 import json
+from types import SimpleNamespace
 import jsonschema
 from unittest.mock import patch, MagicMock
 
@@ -6,6 +8,8 @@ import pytest
 
 with patch("google.cloud.storage.Client"):
     from app import generate_description
+    from app.generator import markov_model, model_bundle
+    from app.utils import data_files
 
 
 @pytest.fixture
@@ -22,13 +26,18 @@ def test_generated_description_schema(mock_generator):
     """
     # Mock each generator to return a dummy string
     mock_generator().generate.return_value = ""
-    with patch("app.utils.gcs._download_all_model_files") as mock_download_all_model_files:
+    with (
+        patch("app.utils.gcs.get_model_manifest", return_value={"version": "v1", "files": {}}),
+        patch("app.utils.gcs.download_model_files", return_value=MagicMock())
+    ):
         g = generate_description.DescriptionGenerator(MagicMock())
+        g.load_all()
 
     with open("tests/description_schema.json") as f:
         schema = json.load(f)
 
-    jsonschema.validate(instance=g(), schema=schema)
+    with patch.object(generate_description, "screenshot_pool", []):
+        jsonschema.validate(instance=g(), schema=schema)
 
 def test_render_template_with_no_tokens():
     """Template rendering should return the original value
@@ -83,8 +92,12 @@ def test_render_template_with_determined_token(mock_sample):
 def test_title_generation_with_extended_vocabulary(mock_choice, mock_generator):
     """Test title template filling with generated words."""
 
-    with patch("app.utils.gcs._download_all_model_files"):
+    with (
+        patch("app.utils.gcs.get_model_manifest", return_value={"version": "v1", "files": {}}),
+        patch("app.utils.gcs.download_model_files", return_value=MagicMock())
+    ):
         g = generate_description.DescriptionGenerator(MagicMock())
+        g.load_all()
 
     # Template with one token
     mock_generator().generate.side_effect = ["Ad-numbus", "Jessoor"]
@@ -114,3 +127,156 @@ def test_number_of_paragraphs_in_config():
 
         assert c.num_subsections * c.num_features == 0
         assert max(c.num_subsections, c.num_features) > 0
+
+def _write_test_models(tmp_path):
+    """Write a small model for each description component.
+    Return:
+        a dict of model file paths by filename
+    """
+    keys = [
+        "description", "names", "feature", "tagline",
+        "requirements_OS", "requirements_Processor", "requirements_Memory", "requirements_Graphics",
+        "requirements_Storage", "requirements_Sound_Card", "requirements_Additional_Notes"
+    ]
+    words = "Explore a vast world. Build and fight, or trade with friends! Survive the night.".split()
+    model = {(words[i], words[i + 1]): {words[(i + 2) % len(words)]} for i in range(len(words) - 1)}
+    model[(words[-1], words[0])] = {words[1]}
+
+    model_files = {}
+    for key in keys:
+        path = tmp_path / (key + ".pkl")
+        path.write_bytes(markov_model.serialize(model))
+        model_files[key + ".pkl"] = path
+    return model_files
+
+def _screenshots(count):
+    """Create count screenshot blobs for each genre and tag."""
+    return [
+        SimpleNamespace(name=f"{genre}/{tag}/{i}.png", public_url=f"{genre}/{tag}/{i}.png")
+        for genre, tags in data_files.GENRES["Primary"].items() for tag in tags for i in range(count)
+    ]
+
+def test_seeded_descriptions_are_reproducible(tmp_path):
+    """The same seed should always give the same description."""
+    model_files = _write_test_models(tmp_path)
+    screenshots = _screenshots(3)
+
+    with (
+        patch("app.utils.gcs.get_model_manifest", return_value={"version": "v1", "files": model_files}),
+        patch("app.utils.gcs.download_model_files", side_effect=lambda manifest, names: {name: model_files[name] for name in names}),
+        patch.object(generate_description, "screenshot_pool", screenshots)
+    ):
+        g = generate_description.DescriptionGenerator({})
+        for seed in range(20):
+            assert g(seed=seed) == g(seed=seed)
+
+        assert g(seed=1) != g(seed=2)
+        assert any(g(seed=seed)["screenshots"] for seed in range(20))
+
+def test_seeded_descriptions_do_not_depend_on_screenshot_pool(tmp_path):
+    """Adding screenshots should not change the rest of a seeded description."""
+    model_files = _write_test_models(tmp_path)
+
+    with (
+        patch("app.utils.gcs.get_model_manifest", return_value={"version": "v1", "files": model_files}),
+        patch("app.utils.gcs.download_model_files", side_effect=lambda manifest, names: {name: model_files[name] for name in names}),
+    ):
+        g = generate_description.DescriptionGenerator({})
+        with patch.object(generate_description, "screenshot_pool", _screenshots(3)):
+            before = [g(seed=seed) for seed in range(50)]
+        with patch.object(generate_description, "screenshot_pool", _screenshots(4)):
+            after = [g(seed=seed) for seed in range(50)]
+
+    for description in before + after:
+        del description["screenshots"]
+    assert before == after
+
+def test_version_changes_with_model_files(mock_generator):
+    """The version of a generator should change with the listed model files
+    and the semantic context flag, not only with the model version.
+    """
+    def version(files, config):
+        with (
+            patch("app.utils.gcs.get_model_manifest", return_value={"version": "v1", "files": files}),
+            patch("app.utils.gcs.download_model_files", return_value=MagicMock())
+        ):
+            return generate_description.DescriptionGenerator(config).version
+
+    files = {"description.pkl": {"sha256": "abc"}}
+    exported = {**files, "description.vectors.npy": {"sha256": "def"}}
+    assert version(files, {}) == version(dict(files), {})
+    assert version(files, {}).startswith("v1-")
+    assert version(exported, {}) != version(files, {})
+    assert version(files, {"ENABLE_SEMANTIC_CONTEXT": True}) != version(files, {})
+
+def test_models_are_loaded_on_first_use(mock_generator):
+    """Only the models used by every description should be loaded on startup,
+    the rest once on first use.
+    """
+    with (
+        patch("app.utils.gcs.get_model_manifest", return_value={"version": "v1", "files": {}}),
+        patch("app.utils.gcs.download_model_files", return_value=MagicMock()) as mock_download
+    ):
+        g = generate_description.DescriptionGenerator({})
+        loaded = {call.kwargs["name"] for call in mock_generator.call_args_list}
+        assert loaded == set(generate_description.STARTUP_MODELS)
+        # Startup models are downloaded in a single batch
+        assert len(mock_download.call_args_list[0].args[1]) == len(generate_description.STARTUP_MODELS)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: g.generators.system_requirements.sound_card, range(4)))
+        names = [call.kwargs["name"] for call in mock_generator.call_args_list]
+        assert names.count("requirements_Sound_Card") == 1
+
+        g.load_all()
+        names = [call.kwargs["name"] for call in mock_generator.call_args_list]
+        assert "ratings" not in names and "requirements_DirectX" not in names
+        assert sorted(names) == sorted([
+            *generate_description.DESCRIPTION_MODELS.values(),
+            *generate_description.SYSTEM_REQUIREMENT_MODELS.values()
+        ])
+
+def _bundle_registry(tmp_path, compression):
+    """Create a registry for a manifest listing a bundle of the description model
+    and a separate names model file.
+    Return:
+        the registry, the model and the local paths of the files by name
+    """
+    model = {("Windows", "10"): {"or"}, ("10", "or"): {"later."}}
+    paths = {name: tmp_path / name for name in [model_bundle.FILENAME, "description.pkl", "names.pkl"]}
+    paths[model_bundle.FILENAME].write_bytes(
+        model_bundle.pack({"description.pkl": markov_model.serialize(model)}, compression=compression)
+    )
+    paths["description.pkl"].write_bytes(markov_model.serialize(model))
+    paths["names.pkl"].write_bytes(markov_model.serialize(model))
+
+    files = {name: {} for name in paths}
+    files[model_bundle.FILENAME] = {"compression": compression}
+    return generate_description.ModelRegistry({"version": "v1", "files": files}), model, paths
+
+def test_models_are_loaded_from_bundle(tmp_path):
+    """With a compressed bundle in the manifest, models should be carved out of
+    the bundle instead of downloading the model files.
+    """
+    pytest.importorskip("zstandard")
+    registry, model, paths = _bundle_registry(tmp_path, "zstd")
+
+    with patch("app.utils.gcs.download_model_files", side_effect=lambda manifest, names: {name: paths[name] for name in names}) as mock_download:
+        assert registry.get("description").model.to_dict() == markov_model.MarkovModel.from_dict(model).to_dict()
+        # Models missing from the bundle are loaded from their own file
+        assert registry.get("names").model.num_keys == 2
+
+    assert [call.args[1] for call in mock_download.call_args_list] == [[model_bundle.FILENAME], ["names.pkl"]]
+
+def test_uncompressed_bundle_is_not_used(tmp_path):
+    """An uncompressed bundle is slower to download than the model files;
+    models should be loaded from their own files.
+    """
+    registry, model, paths = _bundle_registry(tmp_path, None)
+
+    with patch("app.utils.gcs.download_model_files", side_effect=lambda manifest, names: {name: paths[name] for name in names}) as mock_download:
+        registry.load(["description", "names"])
+        assert registry.get("description").model.to_dict() == markov_model.MarkovModel.from_dict(model).to_dict()
+
+    assert model_bundle.FILENAME not in {name for call in mock_download.call_args_list for name in call.args[1]}
+    assert mock_download.call_args_list[0].args[1] == ["description.pkl", "names.pkl"]
@@ -1,9 +1,11 @@
+import concurrent.futures
 from unittest.mock import patch
 
+import numpy as np
 import pytest
 
 with patch("google.cloud.storage.Client"):
-    from app.generator import generator
+    from app.generator import generator, markov_model, word_vectors
 
 
 
@@ -47,10 +49,10 @@ def test_next_word_selection(input_key, expected_word, expected_output_key):
         }
         g = generator.Generator(mock_load_model.return_value)
         # Fix the initial key so output can be determined
-        g._key = input_key
+        state = generator.GenerationState(g.model.find_key(input_key))
 
-    assert g.get_word() == expected_word
-    assert g._key == expected_output_key
+    assert g.get_word(state) == expected_word
+    assert g.model.key(state.key_index) == expected_output_key
 
 
 @patch("app.generator.generator.Generator.get_word")
@@ -107,6 +109,130 @@ def test_sentence_completion(mock_get_word):
     res = g.generate(complete_sentence=True, size=3)
     assert res == "A b C D E."
 
+def test_sentence_completion_is_steered():
+    """Sentence completion should only choose successors leading closer to a sentence end."""
+    with patch("pickle.loads") as mock_load_model:
+        mock_load_model.return_value = {
+            ('a', 'b'): ['c', 'd'],
+            ('b', 'c'): ['a'],
+            ('c', 'a'): ['b'],
+            ('b', 'd'): ['end.'],
+            ('d', 'end.'): ['a'],
+            ('end.', 'a'): ['b']
+        }
+        g = generator.Generator(mock_load_model.return_value)
+
+    for _ in range(10):
+        state = generator.GenerationState(g.model.find_key(('end.', 'a')))
+        assert g.generate(size=1, complete_sentence=True, state=state) == "B d end."
+
+def test_sentence_completion_budget():
+    """Sentence completion should stop after a fixed number of words
+    when no sentence end is reachable.
+    """
+    with patch("pickle.loads") as mock_load_model:
+        mock_load_model.return_value = {
+            ('a', 'b'): ['a'],
+            ('b', 'a'): ['b']
+        }
+        g = generator.Generator(mock_load_model.return_value)
+
+    res = g.generate(size=3, complete_sentence=True)
+    assert res.endswith(".")
+    assert len(res.split()) == 3 + generator.MAX_SENTENCE_COMPLETION_WORDS
+
+def test_continue_until_valid_budget():
+    """Trailing stopwords should be dropped if no valid word is found within the budget."""
+    with patch("pickle.loads") as mock_load_model:
+        mock_load_model.return_value = {
+            ('Play', 'the'): ['a'],
+            ('the', 'a'): ['the'],
+            ('a', 'the'): ['a']
+        }
+        g = generator.Generator(mock_load_model.return_value)
+
+    res = g.generate(seed="Play the", size=2, continue_until_valid=True)
+    assert res == "Play"
+
+def test_generate_many():
+    """Batch generation should produce n texts of the requested size,
+    reproducibly for a seeded random number generator.
+    """
+    with patch("pickle.loads") as mock_load_model:
+        mock_load_model.return_value = {
+            ('a', 'b'): ['c', 'd'],
+            ('b', 'c'): ['a'],
+            ('c', 'a'): ['b'],
+            ('b', 'd'): ['end.'],
+            ('d', 'end.'): ['a'],
+            ('end.', 'a'): ['b']
+        }
+        g = generator.Generator(mock_load_model.return_value)
+
+    texts = g.generate_many(20, size=4, rng=np.random.default_rng(0))
+    assert len(texts) == 20
+    assert all(len(text.split()) == 4 for text in texts)
+    assert texts == g.generate_many(20, size=4, rng=np.random.default_rng(0))
+
+    texts = g.generate_many(20, size=4, complete_sentence=True)
+    assert all(text.endswith("end.") for text in texts)
+
+def test_generate_many_sizes():
+    """Batch generation should accept the same sizes as generate()
+    and an empty batch.
+    """
+    with patch("pickle.loads") as mock_load_model:
+        mock_load_model.return_value = {
+            ('a', 'b'): ['c'],
+            ('b', 'c'): ['a'],
+            ('c', 'a'): ['b']
+        }
+        g = generator.Generator(mock_load_model.return_value)
+
+    assert g.generate_many(0, size=4) == []
+    assert all(len(text.split()) == generator.DEFAULT_TEXT_LENGTH for text in g.generate_many(3, size=0))
+    assert all(len(text.split()) == generator.DEFAULT_TEXT_LENGTH for text in g.generate_many(3, size=-2))
+    assert all(len(text.split()) == len(g.generate(size=4.3).split()) == 5 for text in g.generate_many(3, size=4.3))
+
+def test_ff_to_next_sentence():
+    """Fast forwarding should move the generator to a key ending a sentence."""
+    with patch("pickle.loads") as mock_load_model:
+        mock_load_model.return_value = {
+            ('If', 'you'): ['can'],
+            ('you', 'can'): ['look.'],
+            ('can', 'look.'): ['Then']
+        }
+        g = generator.Generator(mock_load_model.return_value)
+
+    state = generator.GenerationState(g.model.find_key(('If', 'you')))
+    g.ff_to_next_sentence(state)
+    assert g.model.key(state.key_index) == ('can', 'look.')
+    assert g.get_word(state) == "Then"
+
+def test_concurrent_generation():
+    """Threads sharing a Generator should not interleave their walks:
+    every generated word should follow the previous words in the model.
+    """
+    # A closed model over words "0"..."99"
+    def w(i):
+        return str(i % 100)
+
+    model = {(w(i), w(i + 1)): {w(i + 2), w(i + 3)} for i in range(100)}
+    model.update({(w(i), w(i + 2)): {w(i + 3)} for i in range(100)})
+    g = generator.Generator(markov_model.serialize(model))
+
+    def generate():
+        return [g.generate(size=20) for _ in range(200)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = [future.result() for future in [executor.submit(generate) for _ in range(8)]]
+
+    for texts in results:
+        for text in texts:
+            words = text.split()
+            for i in range(len(words) - 2):
+                assert words[i + 2] in model[(words[i], words[i + 1])]
+
 def test_output_cleanup():
     """Are special characters removed during string cleanup?"""
     with patch("pickle.loads") as mock_load_model:
@@ -128,3 +254,95 @@ def test_output_cleanup():
     # Special characters are replaced
     tokens = "there are those who (call me) heroic®".split()
     assert g.cleanup(tokens) == "There are those who call me heroic"
+
+def test_generator_from_model_file(tmp_path):
+    """A Generator should load a compact model memory mapped from a local file."""
+    model = {
+        ('If', 'you'): {'can'},
+        ('you', 'can'): {'look'}
+    }
+    path = tmp_path / "model.pkl"
+    path.write_bytes(markov_model.serialize(model))
+
+    g = generator.Generator(path)
+    state = generator.GenerationState(g.model.find_key(('If', 'you')))
+
+    assert g.model.find_key(('you', 'can')) is not None
+    assert g.get_word(state) == "can"
+
+def test_semantic_context_with_word_vectors():
+    """With word vectors, the successor closest to the context vector should be chosen,
+    penalizing short words.
+    """
+    model = markov_model.MarkovModel.from_dict({
+        ('a', 'b'): ['space', 'farm', 'ship'],
+        ('b', 'space'): ['a'],
+        ('b', 'farm'): ['a'],
+        ('b', 'ship'): ['a'],
+        ('space', 'a'): ['b'],
+        ('farm', 'a'): ['b'],
+        ('ship', 'a'): ['b']
+    })
+    directions = {"space": [1, 0], "ship": [0.8, 0.6], "farm": [0, 1], "a": [1, 0], "b": [1, 0]}
+    vectors = np.array([directions[model.word(i)] for i in range(model.vocab_size)], dtype=np.float32)
+    g = generator.Generator(markov_model.serialize(model.to_dict()), vectors=vectors)
+
+    context = g.semantic_context("Farming farm")
+    state = generator.GenerationState(g.model.find_key(('a', 'b')))
+    assert g.get_word(state, context) == "farm"
+
+    context = g.semantic_context("space")
+    state = generator.GenerationState(g.model.find_key(('a', 'b')))
+    assert g.get_word(state, context) == "space"
+
+    # Unknown words have no vector without spaCy
+    with patch("app.generator.generator.nlp", None):
+        assert g.context_vector("unknown") is None
+
+    # Vectors of another vocabulary are ignored
+    assert generator.Generator(markov_model.serialize(model.to_dict()), vectors=vectors[:2]).vectors is None
+
+def test_short_words_are_counted_in_characters():
+    """Short words should be found by their length in characters, as in
+    common.get_closest_word_match, rather than in UTF-8 bytes.
+    """
+    model = markov_model.MarkovModel(markov_model.serialize({("ça", "été"): {"ship"}, ("été", "ship"): {"ça"}}))
+    short = word_vectors.short_words(model)
+
+    assert {model.word(token_id): bool(short[token_id]) for token_id in range(model.vocab_size)} == {
+        "ça": True, "été": True, "ship": False
+    }
+
+def test_semantic_context_with_genre_table(tmp_path):
+    """Genre contexts should be looked up from a precomputed genre table
+    matching the word vector choice, without word vectors at generation time.
+    """
+    successors = ['space', 'farm', 'ship', 'boat']
+    model = {('a', 'b'): successors, ('x', 'a'): ['b']}
+    model.update({('b', word): ['x'] for word in successors})
+    model.update({(word, 'x'): ['a'] for word in successors})
+    model_data = markov_model.serialize(model)
+
+    directions = {"space": [1, 0], "ship": [0.8, 0.6], "farm": [0, 1], "boat": [0.6, 0.8]}
+    g = generator.Generator(model_data)
+    vectors = np.array([directions.get(g.model.word(i), [0, 0]) for i in range(g.model.vocab_size)], dtype=np.float32)
+
+    table = word_vectors.export_genre_table(g.model, vectors, ["Space", "Farming farm"], min_degree=3)
+    assert len(table.hubs) == 1
+    path = tmp_path / "genres.npz"
+    path.write_bytes(table.to_bytes())
+
+    g = generator.Generator(model_data, genre_table=path)
+    index = g.model.find_key(('a', 'b'))
+    for genre, expected in [("Space", "space"), ("Farming farm", "farm")]:
+        context = g.semantic_context(genre)
+        state = generator.GenerationState(index)
+        assert g.get_word(state, context) == expected
+        # keys not in the table are sampled
+        assert g.get_word(state, context) == "x"
+
+    # Contexts not in the table are sampled, without spaCy
+    state = generator.GenerationState(index)
+    with patch("app.utils.common.get_closest_word_match") as mock_match:
+        assert g.get_word(state, g.semantic_context("Farming")) in successors
+    mock_match.assert_not_called()
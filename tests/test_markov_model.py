@@ -0,0 +1,144 @@
+import random
+from collections import Counter
+
+import pytest
+
+from app.generator import markov_model
+
+
+MODEL = {
+    ("almost", "too"): Counter({"hot,": 2, "cold.": 1}),
+    ("too", "hot,"): Counter({"almost": 1}),
+    ("hot,", "almost"): Counter({"too": 1}),
+    ("too", "cold."): Counter({"almost": 1}),
+    ("cold.", "almost"): Counter({"too": 1}),
+    ("Ääni", "ja"): Counter({"kuva": 1})
+}
+
+
+def test_serialization_round_trip():
+    """A serialized model should decode back to the original dict."""
+    model = markov_model.MarkovModel.from_dict(MODEL)
+
+    assert model.key_length == 2
+    assert len(model) == len(MODEL)
+    assert model.to_dict() == MODEL
+
+def test_key_lookup():
+    """Keys should be found by their words and missing keys reported as None."""
+    model = markov_model.MarkovModel.from_dict(MODEL)
+
+    for key in MODEL:
+        index = model.find_key(key)
+        assert model.key(index) == key
+
+    assert model.find_key(("too", "warm")) is None
+    assert model.find_key(("almost",)) is None
+    assert ("Ääni", "ja") in model
+
+def test_word_lookup():
+    """Every vocabulary word should map back to its token id."""
+    model = markov_model.MarkovModel.from_dict(MODEL)
+
+    for token_id in range(model.vocab_size):
+        assert model.word_id(model.word(token_id)) == token_id
+
+    assert model.word_id("warm") is None
+    assert model.word_id("") is None
+
+def test_next_key_transitions():
+    """Every successor should point to the key formed by shifting in the successor.
+    Successors leading out of the model should be linked to a sentence break.
+    """
+    model = markov_model.MarkovModel.from_dict(MODEL)
+
+    for index in range(model.num_keys):
+        key = model.key(index)
+        start = model._successor_offsets[index]
+        for edge, word in enumerate(model.successors(index), start=start):
+            expected = model.find_key((*key[1:], word))
+            if expected is None:
+                expected = model.find_key(("too", "cold."))
+            assert model._next_key[edge] == expected
+
+    # ("Ääni", "ja") -> "kuva" is the only dead end
+    assert model.metadata["relinked_dead_ends"] == 1
+
+def test_successor_sets_are_weighted_equally():
+    """Successors given as a set should get a count of 1 each."""
+    model = markov_model.MarkovModel.from_dict({("a", "b"): {"c", "d"}})
+
+    assert model.to_dict() == {("a", "b"): Counter({"c": 1, "d": 1})}
+
+@pytest.mark.parametrize(
+    "weights",
+    [
+        [1],
+        [3, 3, 3],
+        [2, 1],
+        [1, 10, 3, 7, 1, 1],
+    ]
+)
+def test_alias_table_distribution(weights):
+    """An alias table should reproduce the input distribution exactly."""
+    probability, alias = markov_model._alias_table(weights)
+
+    n = len(weights)
+    distribution = [0.0] * n
+    for column in range(n):
+        distribution[column] += probability[column] / n
+        distribution[alias[column]] += (1 - probability[column]) / n
+
+    total = sum(weights)
+    assert distribution == pytest.approx([w / total for w in weights])
+
+def test_successor_sampling_by_frequency():
+    """Successors should be sampled proportional to their counts."""
+    model = markov_model.MarkovModel.from_dict({("a", "b"): Counter({"c": 3, "d": 1})})
+    rng = random.Random(0)
+
+    samples = Counter(model._successors[model.sample_successor(0, rng)] for _ in range(4000))
+    assert samples[model.word_id("c")] / 4000 == pytest.approx(0.75, abs=0.03)
+
+def test_sentence_start_index():
+    """Keys ending in sentence terminating punctuation should be indexed as sentence starts."""
+    model = markov_model.MarkovModel.from_dict(MODEL)
+
+    sentence_starts = {model.key(index) for index in model._sentence_starts}
+    assert sentence_starts == {("too", "cold.")}
+    assert model.random_sentence_start() == model.find_key(("too", "cold."))
+
+    model = markov_model.MarkovModel.from_dict({("a", "b"): {"c"}})
+    assert model.random_sentence_start() is None
+
+def test_sentence_distances():
+    """Distances should count the words to generate until the end of a sentence."""
+    model = markov_model.MarkovModel.from_dict(MODEL)
+
+    distances = {model.key(index): model.sentence_distance(index) for index in range(model.num_keys)}
+    assert distances == {
+        ("too", "cold."): 0,
+        ("almost", "too"): 1,
+        ("Ääni", "ja"): 1,
+        ("hot,", "almost"): 2,
+        ("cold.", "almost"): 2,
+        ("too", "hot,"): 3
+    }
+
+    edge = model.sentence_edge(model.find_key(("almost", "too")))
+    assert model.word(model._successors[edge]) == "cold."
+
+    # No sentence ends
+    model = markov_model.MarkovModel.from_dict({("a", "b"): {"a"}, ("b", "a"): {"b"}})
+    assert model.sentence_distance(0) == markov_model.UNREACHABLE
+
+def test_keys_without_successors_are_dropped():
+    """Keys with an empty successor set should not be stored."""
+    model = markov_model.MarkovModel.from_dict({("a", "b"): {"c"}, ("b", "c"): set()})
+
+    assert model.to_dict() == {("a", "b"): Counter({"c": 1})}
+
+def test_invalid_buffer():
+    """Loading a non-model buffer should raise a ValueError."""
+    with pytest.raises(ValueError):
+        markov_model.MarkovModel(b"not a model")
@@ -0,0 +1,49 @@
+from collections import Counter
+
+import pytest
+
+from app.generator import generator, markov_model, model_bundle
+
+
+MODELS = {
+    "description.pkl": markov_model.serialize({
+        ("almost", "too"): Counter({"hot.": 2, "cold.": 1}),
+        ("too", "hot."): Counter({"almost": 1}),
+        ("too", "cold."): Counter({"almost": 1}),
+        ("hot.", "almost"): Counter({"too": 1}),
+        ("cold.", "almost"): Counter({"too": 1})
+    }),
+    "requirements_OS.pkl": markov_model.serialize({("Windows", "10"): {"or"}, ("10", "or"): {"later."}})
+}
+
+
+def test_bundle_models_are_carved_without_copying(tmp_path):
+    """Uncompressed models should be read in place from a memory mapped bundle."""
+    path = tmp_path / model_bundle.FILENAME
+    path.write_bytes(model_bundle.pack(MODELS))
+
+    bundle = model_bundle.ModelBundle.open(path)
+    assert set(bundle) == set(MODELS)
+    assert "ratings.pkl" not in bundle
+
+    for name, data in MODELS.items():
+        section = bundle.get(name)
+        assert isinstance(section, memoryview)
+        assert section.obj is bundle._buffer.obj
+        assert section == data
+
+    g = generator.Generator(bundle.get("description.pkl"))
+    assert g.model.to_dict() == markov_model.MarkovModel(MODELS["description.pkl"]).to_dict()
+
+def test_compressed_bundle():
+    """zstd compressed models should be decompressed on access."""
+    pytest.importorskip("zstandard")
+    data = model_bundle.pack(MODELS, compression="zstd")
+    bundle = model_bundle.ModelBundle(data)
+
+    for name, model_data in MODELS.items():
+        assert bundle.sections[name]["compression"] == "zstd"
+        assert bundle.get(name) == model_data
+
+    with pytest.raises(ValueError):
+        model_bundle.pack(MODELS, compression="lz4")
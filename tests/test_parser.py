@@ -2,6 +2,8 @@ from unittest.mock import patch
 
 with patch("google.cloud.storage.Client"):
     from app import parser
+from app.utils import rate_limit, storage
+from tests.stub_server import StubServer
 
 
 def test_description_parsing_on_html_tags():
@@ -207,3 +209,118 @@ def test_ratings_parsing():
     }
 
     assert parser._extract_content_rating(data) == []
+
+def test_description_batch_is_fetched_within_rate_limit():
+    """Valid app descriptions should be uploaded while unsuccesful and
+    failing requests are skipped without aborting the batch.
+    """
+    def app_details(app_id):
+        return {
+            "type": "game",
+            "name": f"Game {app_id}",
+            "steam_appid": app_id,
+            "detailed_description": "<strong>A game.</strong>",
+            "supported_languages": "English",
+            "pc_requirements": {"minimum": "<ul><li>OS: Windows 10</li></ul>"},
+            "mac_requirements": [],
+            "linux_requirements": [],
+            "ratings": None,
+        }
+
+    def handler(path, query):
+        app_id = int(query["appids"])
+        if app_id == 30:
+            return 500, None
+        if app_id == 40:
+            return 200, {"40": {"success": False}}
+        return 200, {str(app_id): {"success": True, "data": app_details(app_id)}}
+
+    backend = storage.MemoryBackend()
+    with (
+        StubServer(handler) as server,
+        patch.object(parser, "API_ENDPOINT", server.url),
+        patch.object(parser, "RATE_LIMIT", 1_000_000),
+        patch.object(parser, "get_app_id_batch", return_value=[10, 20, 30, 40]),
+        patch.object(rate_limit.RateLimitedFetcher, "_retry", lambda *args, **kwargs: None),
+        patch.object(storage, "get_backend", return_value=backend),
+    ):
+        parser.upload_description_batch(4, prefilter=False)
+
+    uploaded = {name.rsplit("/", 1)[-1] for bucket, name in backend.objects}
+    assert uploaded == {"Game 10.json", "Game 20.json"}
+    # Every id is requested; the server error is retried
+    assert sorted(int(query["appids"]) for _, query in server.requests) == [10, 20] + [30] * 5 + [40]
+
+def test_descriptions_are_uploaded_in_chunks():
+    """Parsed descriptions should be uploaded in chunks as they arrive."""
+    def handler(path, query):
+        app_id = int(query["appids"])
+        data = {
+            "type": "game",
+            "name": f"Game {app_id}",
+            "steam_appid": app_id,
+            "detailed_description": "A game.",
+            "pc_requirements": [],
+            "mac_requirements": [],
+            "linux_requirements": [],
+            "ratings": None,
+        }
+        return 200, {str(app_id): {"success": True, "data": data}}
+
+    backend = storage.MemoryBackend()
+    with (
+        StubServer(handler) as server,
+        patch.object(parser, "API_ENDPOINT", server.url),
+        patch.object(parser, "RATE_LIMIT", 1_000_000),
+        patch.object(parser, "UPLOAD_CHUNK_SIZE", 2),
+        patch.object(parser, "get_app_id_batch", return_value=[10, 20, 30, 40, 50]),
+        patch.object(storage, "get_backend", return_value=backend),
+        patch.object(backend, "put_many", wraps=backend.put_many) as mock_put_many
+    ):
+        parser.upload_description_batch(5, prefilter=False)
+
+    assert [len(call.args[1]) for call in mock_put_many.call_args_list] == [2, 2, 1]
+    assert len(backend.objects) == 5
+
+def test_app_ids_are_prefiltered_in_bulk():
+    """Candidate ids should be checked in bulk price_overview queries, and only
+    existing apps requested in full.
+    """
+    def handler(path, query):
+        app_ids = query["appids"].split(",")
+        if query.get("filters") == "price_overview":
+            return 200, {app_id: {"success": int(app_id) % 30 == 0, "data": []} for app_id in app_ids}
+        return 200, {app_ids[0]: {"success": False}}
+
+    with (
+        StubServer(handler) as server,
+        patch.object(parser, "API_ENDPOINT", server.url),
+        patch.object(parser, "RATE_LIMIT", 1_000_000),
+        patch.object(storage, "get_backend", return_value=storage.MemoryBackend()),
+    ):
+        parser.upload_description_batch(100)
+
+    checks = [query for _, query in server.requests if "filters" in query]
+    details = [int(query["appids"]) for _, query in server.requests if "filters" not in query]
+    assert len(checks) == parser.FETCH_WORKERS
+    assert all(len(query["appids"].split(",")) == parser.PREFILTER_CHUNK_SIZE for query in checks)
+    assert len(details) == 100
+    assert all(app_id % 30 == 0 for app_id in details)
+
+def test_scheduled_batch_is_not_throttled():
+    """A scheduled batch of 150 app ids, including its prefilter requests,
+    should fit in the burst of the rate limit.
+    """
+    def sleep(seconds):
+        raise AssertionError(f"throttled for {seconds}s")
+
+    limiter = rate_limit.TokenBucket.for_quota(
+        parser.RATE_LIMIT,
+        parser.RATE_LIMIT_WINDOW,
+        burst=parser.RATE_LIMIT_BURST,
+        clock=lambda: 0.0,
+        sleep=sleep
+    )
+
+    for _ in range(150 + parser.PREFILTER_MAX_REQUESTS):
+        limiter.acquire()
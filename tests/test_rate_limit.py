@@ -0,0 +1,99 @@
+import pytest
+import requests
+
+from app.utils import rate_limit
+from tests.stub_server import StubServer
+
+
+class FakeClock:
+    """A clock advanced by sleeping."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_stays_within_quota():
+    """No window of the quota should see more requests than the limit,
+    including the initial burst.
+    """
+    clock = FakeClock()
+    limiter = rate_limit.TokenBucket.for_quota(200, 300, burst=10, clock=clock, sleep=clock.sleep)
+
+    times = []
+    for _ in range(500):
+        limiter.acquire()
+        times.append(clock.now)
+
+    assert times[9] == 0
+    for i, start in enumerate(times):
+        assert sum(start <= t < start + 300 for t in times[i:]) <= 200
+    # After the burst, requests are spaced evenly at the remaining rate
+    assert times[-1] == pytest.approx(490 / (190 / 300))
+
+def test_token_bucket_pause():
+    """A pause should hold back all tokens without adding any,
+    and keep the tokens left in the bucket.
+    """
+    clock = FakeClock()
+    limiter = rate_limit.TokenBucket(rate=1, capacity=5, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        limiter.acquire()
+    limiter.pause(10)
+    for _ in range(2):
+        limiter.acquire()
+    assert clock.now == 10
+    limiter.acquire()
+    assert clock.now == 11
+
+def test_batch_resumes_after_rate_limit_pause():
+    """A 429 early in a batch within the burst should only delay the
+    rest of the batch by the pause.
+    """
+    clock = FakeClock()
+    limiter = rate_limit.TokenBucket.for_quota(200, 300, burst=180, clock=clock, sleep=clock.sleep)
+
+    for _ in range(10):
+        limiter.acquire()
+    limiter.pause(5)
+    for _ in range(140):
+        limiter.acquire()
+
+    assert clock.now == 5
+
+def test_fetcher_retries_and_isolates_failures():
+    """Rate limited requests should be retried after Retry-After, server errors
+    retried until they give up, and a failing request should not affect the others.
+    """
+    attempts = {}
+
+    def handler(path, query):
+        app_id = query["appids"]
+        attempts[app_id] = attempts.get(app_id, 0) + 1
+        if app_id == "20" and attempts[app_id] == 1:
+            return 429, None, {"Retry-After": "0"}
+        if app_id == "30":
+            return 500, None
+        return 200, {app_id: {"success": True}}
+
+    with StubServer(handler) as server, requests.Session() as session:
+        limiter = rate_limit.TokenBucket(rate=1000, capacity=10)
+        fetcher = rate_limit.RateLimitedFetcher(session, limiter, workers=4, max_retries=2, backoff=0.01)
+        results = dict(
+            (params["appids"], response)
+            for params, response in fetcher.fetch_many(server.url, [{"appids": i} for i in (10, 20, 30, 40)])
+        )
+
+    assert results[10] == {"10": {"success": True}}
+    assert results[20] == {"20": {"success": True}}
+    assert results[40] == {"40": {"success": True}}
+    assert isinstance(results[30], requests.HTTPError)
+    assert attempts == {"10": 1, "20": 2, "30": 3, "40": 1}
+    assert fetcher.requests == 7
+    assert fetcher.retries == 3
@@ -0,0 +1,73 @@
+from unittest.mock import patch
+
+import pytest
+
+from app.utils import storage
+
+
+@pytest.fixture(params=["local", "memory"])
+def backend(request, tmp_path):
+    if request.param == "local":
+        return storage.LocalBackend(tmp_path)
+    return storage.MemoryBackend()
+
+
+def test_object_round_trip(backend):
+    """Stored objects should be read back, listed by prefix and deleted."""
+    backend.put("bucket", "models/v1/description.pkl", b"abc")
+    backend.put("bucket", "models/manifest.json", b"{}")
+    backend.put("other", "models/v1/names.pkl", b"xyz")
+
+    assert backend.get("bucket", "models/v1/description.pkl") == b"abc"
+    assert [obj.name for obj in backend.list("bucket", prefix="models/v1/")] == ["models/v1/description.pkl"]
+    assert [obj.name for obj in backend.list("bucket")] == ["models/manifest.json", "models/v1/description.pkl"]
+
+    obj = backend.stat("bucket", "models/v1/description.pkl")
+    assert obj.size == 3
+    backend.put("bucket", "models/v1/description.pkl", b"abcd")
+    assert backend.stat("bucket", "models/v1/description.pkl").generation != obj.generation
+
+    backend.delete("bucket", "models/v1/description.pkl")
+    assert backend.stat("bucket", "models/v1/description.pkl") is None
+    with pytest.raises(FileNotFoundError):
+        backend.get("bucket", "models/v1/description.pkl")
+
+def test_bulk_operations(backend, tmp_path):
+    """Bulk operations should return a result or an exception per item."""
+    assert backend.put_many("bucket", [("a", b"1"), ("b", b"2")]) == [None, None]
+
+    results = backend.get_many("bucket", ["a", "missing", "b"])
+    assert results[0] == b"1" and results[2] == b"2"
+    assert isinstance(results[1], FileNotFoundError)
+
+    results = backend.download_many("bucket", [("b", tmp_path / "b.download"), ("missing", tmp_path / "missing")])
+    assert results[0] is None and isinstance(results[1], FileNotFoundError)
+    assert (tmp_path / "b.download").read_bytes() == b"2"
+
+def test_backend_selection():
+    """Backends should be created by name."""
+    assert isinstance(storage.create_backend("memory"), storage.MemoryBackend)
+    with pytest.raises(ValueError):
+        storage.create_backend("ftp")
+
+def test_incomplete_backend_cannot_be_created():
+    """A backend missing a basic operation should fail on creation."""
+    class ReadOnlyBackend(storage.StorageBackend):
+        def get(self, bucket, name):
+            return b""
+
+    with pytest.raises(TypeError):
+        ReadOnlyBackend()
+
+def test_gcs_bulk_upload():
+    """Cloud Storage uploads should reuse bucket handles and use transfer_manager."""
+    with patch("google.cloud.storage.Client") as mock_client:
+        backend = storage.GCSBackend()
+
+    with patch.object(storage.transfer_manager, "upload_many", return_value=[None, None]) as mock_upload_many:
+        assert backend.put_many("bucket", [("a", b"1"), ("b", b"2")], content_type="application/json", max_workers=2) == [None, None]
+        backend.put("bucket", "c", b"3")
+
+    mock_client.return_value.bucket.assert_called_once_with("bucket")
+    assert mock_upload_many.call_args.kwargs["upload_kwargs"] == {"content_type": "application/json"}
+    assert mock_upload_many.call_args.kwargs["max_workers"] == 2
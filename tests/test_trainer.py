@@ -1,3 +1,4 @@
+from collections import Counter
 from unittest.mock import patch
 
 with patch("google.cloud.storage.Client"):
@@ -11,17 +12,17 @@ def test_model_train():
     t.train()
 
     expected = {
-        ("I", "am"): {"not"},
-        ("am", "not"): {"a"},
-        ("not", "a"): {"Russian"},
-        ("a", "Russian"): {"spy,"},
-        ("Russian", "spy,"): {"cross"},
-        ("spy,", "cross"): {"my"},
-        ("cross", "my"): {"heart"},
-        ("my", "heart"): {"and"},
-        ("heart", "and"): {"hope"},
-        ("and", "hope"): {"to"},
-        ("hope", "to"): {"die"}
+        ("I", "am"): Counter(["not"]),
+        ("am", "not"): Counter(["a"]),
+        ("not", "a"): Counter(["Russian"]),
+        ("a", "Russian"): Counter(["spy,"]),
+        ("Russian", "spy,"): Counter(["cross"]),
+        ("spy,", "cross"): Counter(["my"]),
+        ("cross", "my"): Counter(["heart"]),
+        ("my", "heart"): Counter(["and"]),
+        ("heart", "and"): Counter(["hope"]),
+        ("and", "hope"): Counter(["to"]),
+        ("hope", "to"): Counter(["die"])
     }
     assert t.model == expected
 
@@ -32,25 +33,41 @@ def test_character_level_model_train():
     t.train()
 
     expected = {
-        ("a", "b"): {"c"},
-        ("b", "c"): {"d"},
-        ("c", "d"): {"e"},
-        ("d", "e"): {"f"},
-        ("e", "f"): {"g"},
+        ("a", "b"): Counter(["c"]),
+        ("b", "c"): Counter(["d"]),
+        ("c", "d"): Counter(["e"]),
+        ("d", "e"): Counter(["f"]),
+        ("e", "f"): Counter(["g"]),
     }
     assert t.model == expected
 
 def test_model_on_duplicate_successors():
-    """Test model train with duplicate ngrams."""
+    """Test model train with duplicate ngrams: successors should be counted."""
     train_text_data = "almost too hot, almost too cold. almost too hot,"
     t = trainer.Trainer(train_text_data, "dummy_filename")
     t.train()
 
     expected = {
-        ("almost", "too"): {"hot,", "cold."},
-        ("too", "hot,"): {"almost"},
-        ("hot,", "almost"): {"too"},
-        ("too", "cold."): {"almost"},
-        ("cold.", "almost"): {"too"}
+        ("almost", "too"): Counter({"hot,": 2, "cold.": 1}),
+        ("too", "hot,"): Counter(["almost"]),
+        ("hot,", "almost"): Counter(["too"]),
+        ("too", "cold."): Counter(["almost"]),
+        ("cold.", "almost"): Counter(["too"])
     }
     assert t.model == expected
+
+def test_dead_end_closure():
+    """Keys leading out of the model should be linked back to the start of the text."""
+    train_text_data = "I am not a Russian spy"
+    t = trainer.Trainer(train_text_data, "dummy_filename")
+    t.train()
+    t.close_dead_ends()
+
+    assert t.dead_ends == 1
+    assert t.model[("Russian", "spy")] == Counter(["I"])
+    assert t.model[("spy", "I")] == Counter(["am"])
+
+    # Every successor leads to a key in the model
+    for key, successors in t.model.items():
+        for word in successors:
+            assert (*key[1:], word) in t.model
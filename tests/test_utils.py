@@ -1,6 +1,13 @@
-from unittest.mock import patch
+import hashlib
+import os
+import pickle
+import time
+from unittest.mock import patch, MagicMock
+
+import numpy as np
 
 from app import setup_gcs_models
+from app.generator import generator, markov_model
 
 with patch("google.cloud.storage.Client"):
     from app import utils
@@ -156,3 +163,162 @@ def test_merge_similar_categories():
     }
 
     assert setup_gcs_models._merge_requirements(requirements) == expected
+
+
+def test_model_download_through_manifest(tmp_path):
+    """Model files listed in the manifest should be downloaded once
+    and verified against their hashes.
+    """
+    backend = utils.storage.MemoryBackend()
+
+    def manifest(version, data):
+        return {
+            "version": version,
+            "files": {
+                "description.pkl": {
+                    "path": f"models/{version}/description.pkl",
+                    "size": len(data),
+                    "sha256": hashlib.sha256(data).hexdigest()
+                }
+            }
+        }
+
+    def download_all():
+        manifest = utils.gcs.get_model_manifest(tmp_path)
+        return manifest["version"], utils.gcs.download_model_files(manifest, manifest["files"], tmp_path)
+
+    backend.put(utils.gcs.DATA_BUCKET, "models/v1/description.pkl", b"abc")
+
+    with (
+        patch.object(utils.gcs, "_get_cached_manifest", return_value=manifest("v1", b"abc")) as mock_get_manifest,
+        patch.object(utils.storage, "get_backend", return_value=backend),
+        patch.object(backend, "download_many", wraps=backend.download_many) as mock_download
+    ):
+        version, paths = download_all()
+        assert version == "v1"
+        assert paths["description.pkl"].read_bytes() == b"abc"
+        assert len(mock_download.call_args.args[1]) == 1
+
+        # Local copy is current: nothing to download
+        download_all()
+        assert mock_download.call_args.args[1] == []
+
+        # Unchanged file in a new version: nothing to download
+        mock_get_manifest.return_value = manifest("v2", b"abc")
+        version, paths = download_all()
+        assert version == "v2"
+        assert mock_download.call_args.args[1] == []
+
+        # Changed file: download again. The old file may still be about to be
+        # mapped by other processes; it is removed once unused for the grace period.
+        old_path = paths["description.pkl"]
+        mock_get_manifest.return_value = manifest("v2", b"abcd")
+        backend.put(utils.gcs.DATA_BUCKET, "models/v2/description.pkl", b"abcd")
+        version, paths = download_all()
+        assert paths["description.pkl"].read_bytes() == b"abcd"
+        assert old_path.exists()
+
+        expired = time.time() - utils.gcs.MODEL_FILE_GRACE_PERIOD - 1
+        os.utime(old_path, (expired, expired))
+        download_all()
+        assert not old_path.exists()
+
+        # Corrupted downloads are discarded
+        backend.put(utils.gcs.DATA_BUCKET, "models/v3/description.pkl", b"xyz")
+        mock_get_manifest.return_value = manifest("v3", b"abc")
+        version, paths = download_all()
+        assert paths == {}
+
+def test_manifest_is_cached(tmp_path):
+    """A local copy of the manifest should be used while its generation is current."""
+    backend = utils.storage.MemoryBackend()
+    backend.put(utils.gcs.DATA_BUCKET, utils.gcs.MODEL_MANIFEST, b'{"version": "v1"}')
+
+    with (
+        patch.object(utils.storage, "get_backend", return_value=backend),
+        patch.object(backend, "get", wraps=backend.get) as mock_get
+    ):
+        assert utils.gcs._get_cached_manifest(tmp_path) == {"version": "v1"}
+        assert utils.gcs._get_cached_manifest(tmp_path) == {"version": "v1"}
+        assert mock_get.call_count == 1
+
+        backend.put(utils.gcs.DATA_BUCKET, utils.gcs.MODEL_MANIFEST, b'{"version": "v2"}')
+        assert utils.gcs._get_cached_manifest(tmp_path) == {"version": "v2"}
+
+def test_legacy_models_are_used_without_manifest(tmp_path):
+    """Without a manifest, the requested legacy pickled models stored directly under
+    the model prefix should be converted once to memory mappable model files.
+    """
+    data = pickle.dumps({("a", "b"): {"c"}, ("b", "c"): {"d"}})
+
+    backend = utils.storage.MemoryBackend()
+    backend.put(utils.gcs.DATA_BUCKET, f"{utils.gcs.MODEL_PREFIX}description.pkl", data)
+    backend.put(utils.gcs.DATA_BUCKET, f"{utils.gcs.MODEL_PREFIX}ratings.pkl", data)
+    backend.put(utils.gcs.DATA_BUCKET, f"{utils.gcs.MODEL_PREFIX}v1/description.pkl", b"abc")
+
+    with (
+        patch.object(utils.storage, "get_backend", return_value=backend),
+        patch.object(backend, "get_many", wraps=backend.get_many) as mock_get_many,
+        patch.object(backend, "download_many", wraps=backend.download_many) as mock_download
+    ):
+        assert utils.gcs._get_cached_manifest(tmp_path) is None
+        manifest = utils.gcs.get_model_manifest(tmp_path, legacy_filenames=["description.pkl"])
+        paths = utils.gcs.download_model_files(manifest, ["description.pkl"], tmp_path)
+
+        # Other workers reuse the converted files
+        assert utils.gcs.get_model_manifest(tmp_path, legacy_filenames=["description.pkl"]) == manifest
+
+    assert manifest["version"] == utils.gcs.LEGACY_MODEL_VERSION
+    assert list(manifest["files"]) == ["description.pkl"]
+    assert [call.args[1] for call in mock_get_many.call_args_list] == [[f"{utils.gcs.MODEL_PREFIX}description.pkl"]]
+    assert mock_download.call_args.args[1] == []
+    assert markov_model.is_compact_model(paths["description.pkl"].read_bytes())
+    assert generator.Generator(paths["description.pkl"]).generate(seed="a b", size=3).lower() == "a b c"
+
+def test_old_model_versions_are_deleted():
+    """Publishing a manifest should keep only the most recent model versions."""
+    backend = utils.storage.MemoryBackend()
+    for version in ["v1", "v2", "v3"]:
+        backend.put(utils.gcs.DATA_BUCKET, f"{utils.gcs.MODEL_PREFIX}{version}/description.pkl", b"abc")
+
+    with patch.object(utils.storage, "get_backend", return_value=backend):
+        utils.gcs.publish_manifest({"version": "v3", "files": {}}, keep=2)
+        assert utils.gcs.get_manifest() == {"version": "v3", "files": {}}
+
+    assert [obj.name for obj in backend.list(utils.gcs.DATA_BUCKET)] == [
+        utils.gcs.MODEL_MANIFEST, f"{utils.gcs.MODEL_PREFIX}v2/description.pkl", f"{utils.gcs.MODEL_PREFIX}v3/description.pkl"
+    ]
+
+def test_model_files_are_uploaded_together():
+    """Model files should be uploaded in a single bulk upload and listed with their hashes."""
+    backend = utils.storage.MemoryBackend()
+
+    with (
+        patch.object(utils.storage, "get_backend", return_value=backend),
+        patch.object(backend, "put_many", wraps=backend.put_many) as mock_put_many
+    ):
+        entries = utils.gcs.upload_model_files({"description.pkl": b"abc", "names.pkl": b"xyz"}, "v1")
+
+    assert mock_put_many.call_count == 1
+    assert entries["names.pkl"] == {
+        "path": f"{utils.gcs.MODEL_PREFIX}v1/names.pkl", "size": 3, "sha256": hashlib.sha256(b"xyz").hexdigest()
+    }
+    assert backend.get(utils.gcs.DATA_BUCKET, entries["description.pkl"]["path"]) == b"abc"
+
+def test_closest_word_match_is_cached():
+    """Repeated similarity lookups should be served from the cache."""
+    vectors = {"ship": np.array([3.0, 4.0]), "farm": np.array([4.0, 3.0]), "boats": np.array([0.0, 2.0])}
+    mock_nlp = MagicMock()
+    mock_nlp.side_effect = lambda text: MagicMock(vector=vectors[text], vector_norm=np.linalg.norm(vectors[text]))
+    utils.common._similarity.cache_clear()
+    utils.common._vector.cache_clear()
+
+    with patch("app.utils.common.nlp", mock_nlp):
+        for _ in range(3):
+            assert utils.common.get_closest_word_match("ship", ["farm", "yes", "boats"]) == "farm"
+
+    # 1 context and 2 candidates; "yes" is too short to compare
+    assert mock_nlp.call_count == 3
+    info = utils.common.similarity_cache_info()
+    assert (info["similarity"].hits, info["similarity"].misses) == (4, 2)
+    assert info["vector"].currsize == 3
@@ -0,0 +1,178 @@
+import concurrent.futures
+import json
+import threading
+import time
+from unittest.mock import patch
+
+with patch("google.cloud.storage.Client"):
+    from app import views
+    from app.utils import verify_oidc
+
+
+def test_generator_is_created_once():
+    """Concurrent first requests should share a single DescriptionGenerator."""
+    instances = []
+    lock = threading.Lock()
+
+    class SlowDescriptionGenerator:
+        def __init__(self, config):
+            time.sleep(0.1)
+            with lock:
+                instances.append(self)
+
+        def load_all(self):
+            pass
+
+        def __call__(self):
+            return {"description": "ok"}
+
+    def request():
+        with views.app.test_client() as client:
+            return client.get("/_generate", headers={"X-Button-Callback": "1"})
+
+    with (
+        patch.object(views, "generator", None),
+        patch("app.generate_description.DescriptionGenerator", SlowDescriptionGenerator)
+    ):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(lambda _: request(), range(8)))
+
+    assert len(instances) == 1
+    assert all(r.get_json() == {"description": "ok"} for r in responses)
+
+def test_descriptions_are_served_from_pool():
+    """With a pool configured, descriptions should be taken from the pool."""
+    class CountingDescriptionGenerator:
+        def __init__(self, config):
+            self.calls = 0
+
+        def load_all(self):
+            pass
+
+        def __call__(self):
+            self.calls += 1
+            return {"description": self.calls}
+
+    with (
+        patch.object(views, "generator", None),
+        patch.object(views, "pool", None),
+        patch.dict(views.app.config, {"DESCRIPTION_POOL_SIZE": 2}),
+        patch("app.generate_description.DescriptionGenerator", CountingDescriptionGenerator)
+    ):
+        with views.app.test_client() as client:
+            response = client.get("/_generate", headers={"X-Button-Callback": "1"})
+        assert response.status_code == 200
+        assert views.pool is not None
+        assert views.pool.hits + views.pool.misses == 1
+
+def test_seeded_descriptions_are_cached():
+    """Seeded descriptions should be generated once per seed and model version
+    and support conditional requests.
+    """
+    calls = []
+
+    class SeededDescriptionGenerator:
+        version = "v1"
+
+        def __call__(self, seed=None):
+            calls.append(seed)
+            return {"seed": seed}
+
+    views.response_cache.clear()
+    headers = {"X-Button-Callback": "1"}
+    with (
+        patch.object(views, "generator", SeededDescriptionGenerator()),
+        views.app.test_client() as client
+    ):
+        first = client.get("/_generate?seed=42", headers=headers)
+        second = client.get("/_generate?seed=42", headers=headers)
+        assert first.get_json() == second.get_json() == {"seed": 42}
+        assert calls == [42]
+
+        etag = first.headers["ETag"]
+        assert etag == 'W/"v1-42"'
+        response = client.get("/_generate?seed=42", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+
+        assert client.get("/_generate?seed=abc", headers=headers).status_code == 400
+
+def test_seeded_description_is_rendered_by_the_request_generator():
+    """A seeded description should be rendered and cached with the generator
+    the request started with, even if a reload swaps the shared generator.
+    """
+    class VersionedDescriptionGenerator:
+        def __init__(self, version):
+            self.version = version
+
+        def __call__(self, seed=None):
+            return {"version": self.version, "seed": seed}
+
+    old, new = VersionedDescriptionGenerator("v1"), VersionedDescriptionGenerator("v2")
+    views.response_cache.clear()
+    with patch.object(views, "generator", new):
+        assert json.loads(views.render_seeded_description(old, 42)) == {"version": "v1", "seed": 42}
+        assert json.loads(views.render_seeded_description(new, 42)) == {"version": "v2", "seed": 42}
+        assert json.loads(views.render_seeded_description(old, 42)) == {"version": "v1", "seed": 42}
+
+def test_description_stream():
+    """Descriptions should be streamed as newline delimited JSON, up to a limit."""
+    class SeededDescriptionGenerator:
+        version = "v1"
+
+        def __call__(self, seed=None):
+            return {"seed": seed}
+
+    headers = {"Authorization": "Bearer token"}
+    with (
+        patch.object(views, "generator", SeededDescriptionGenerator()),
+        patch("google.oauth2.id_token.verify_oauth2_token", return_value={"email": verify_oidc.EXPECTED_EMAIL}),
+        patch.dict(views.app.config, {"STREAM_MAX_COUNT": 5}),
+        views.app.test_client() as client
+    ):
+        response = client.get("/_generate_stream?count=3&seed=10", headers=headers)
+        assert response.mimetype == "application/x-ndjson"
+        assert [json.loads(line) for line in response.text.splitlines()] == [{"seed": 10}, {"seed": 11}, {"seed": 12}]
+
+        assert client.get("/_generate_stream?count=6", headers=headers).status_code == 400
+        assert client.get("/_generate_stream", headers=headers).status_code == 400
+        assert client.get("/_generate_stream?count=3&seed=abc", headers=headers).status_code == 400
+
+    assert views.app.test_client().get("/_generate_stream?count=1").status_code == 403
+
+def test_models_are_reloaded_on_new_version():
+    """A new model version should replace the generator and its pool."""
+    class VersionedDescriptionGenerator:
+        def __init__(self, config):
+            self.version = len(instances)
+            instances.append(self)
+
+        def load_all(self):
+            pass
+
+        def __call__(self, seed=None):
+            return {"version": self.version}
+
+    instances = []
+    with (
+        patch.object(views, "generator", None),
+        patch.object(views, "pool", None),
+        patch.dict(views.app.config, {"DESCRIPTION_POOL_SIZE": 1}),
+        patch("app.generate_description.DescriptionGenerator", VersionedDescriptionGenerator),
+        patch("app.utils.gcs.get_model_version") as mock_get_model_version
+    ):
+        views.get_generator()
+        old_pool = views.pool
+
+        mock_get_model_version.return_value = 1
+        assert views.check_for_new_models(1) == 1
+        assert views.generator is instances[0]
+
+        mock_get_model_version.return_value = 2
+        assert views.check_for_new_models(1) == 2
+        assert views.generator is instances[1]
+        assert views.pool is not old_pool and old_pool._closed
+
+        # Failed reloads keep the current models
+        mock_get_model_version.side_effect = RuntimeError("unavailable")
+        assert views.check_for_new_models(2) == 2
+        assert views.generator is instances[1]